@@ -3,6 +3,10 @@ from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.staticfiles import StaticFiles
 from app.routers.admin import router as admin_router
+from app.utils import metrics
+from app.utils.backends import close_backend
+from app.utils.inventory import model_inventory
+from app.utils.tracing import TracingMiddleware
 
 app = FastAPI(
     title="Ollama Admin Panel",
@@ -24,3 +28,20 @@ app.mount("/static", StaticFiles(directory="static"), name="static")
 
 # Подключаем роутер админ-панели
 app.include_router(admin_router)
+
+# Метрики Prometheus: GET /metrics
+metrics.install(app, "admin")
+
+# Server-Timing и журнал медленных запросов
+app.add_middleware(TracingMiddleware)
+
+
+@app.on_event("startup")
+async def startup():
+    await model_inventory.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    await model_inventory.stop()
+    await close_backend()
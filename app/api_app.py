@@ -1,7 +1,19 @@
 # app/api_app.py
 from fastapi import FastAPI
 from fastapi.middleware.cors import CORSMiddleware
-from app.database import engine, Base
+from app.database import engine, async_engine, Base
+from app.migrations import migrate
+from app.utils import metrics
+from app.utils.backends import close_backend
+from app.utils.catalog import model_catalog
+from app.utils.inventory import model_inventory
+from app.utils.jobs import pull_jobs
+from app.utils.ratelimit import rate_limiter
+from app.utils.residency import residency_manager
+from app.utils.response_cache import response_cache
+from app.utils.supervisor import worker_heartbeat
+from app.utils.tracing import TracingMiddleware
+from app.utils.writer import turn_writer
 from app.routers import auth, models, chat, history
 
 app = FastAPI(
@@ -12,6 +24,7 @@ app = FastAPI(
 
 # Создать таблицы
 Base.metadata.create_all(bind=engine)
+migrate(engine)
 
 # CORS
 app.add_middleware(
@@ -27,3 +40,36 @@ app.include_router(auth.router)
 app.include_router(models.router, prefix="/models", tags=["Models"])
 app.include_router(chat.router, prefix="/chat", tags=["Chat"])
 app.include_router(history.router, prefix="/history", tags=["History"])
+
+# Метрики Prometheus: GET /metrics
+metrics.install(app, "api")
+
+# Server-Timing и журнал медленных запросов
+app.add_middleware(TracingMiddleware)
+
+
+@app.on_event("startup")
+async def startup():
+    await rate_limiter.start()
+    await turn_writer.start()
+    await model_catalog.start()
+    await model_inventory.start()
+    await pull_jobs.start()
+    await residency_manager.start()
+    # Последним: супервизор считает воркер готовым по первому heartbeat
+    await worker_heartbeat.start()
+
+
+@app.on_event("shutdown")
+async def shutdown():
+    """Закрыть пул соединений к Ollama и async-движок БД."""
+    await worker_heartbeat.stop()
+    await residency_manager.stop()
+    await pull_jobs.stop()
+    await model_inventory.stop()
+    await model_catalog.stop()
+    await turn_writer.stop()
+    await rate_limiter.stop()
+    response_cache.close()
+    await close_backend()
+    await async_engine.dispose()
@@ -2,9 +2,19 @@
 """
 Database configuration and setup using SQLAlchemy.
 Loads DATABASE_URL from environment or defaults to SQLite.
+
+The API request path uses the async engine (AsyncSessionLocal / get_db);
+the sync engine is kept for the CLI and one-off scripts.
+
+Performance settings come from a named profile (DB_PROFILE in .env):
+PRAGMAs applied to every SQLite connection, pool sizing and pre-ping for
+server databases. effective_settings() reports what is actually in force.
 """
 import os
-from sqlalchemy import create_engine
+from typing import AsyncIterator, Dict
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
 from dotenv import load_dotenv
 
@@ -14,10 +24,99 @@ load_dotenv()
 # Database URL, default to local SQLite file
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./app.db")
 
+# Async drivers for the sync URL schemes we support
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "postgres": "postgresql+asyncpg",
+}
+
+
+def to_async_url(url: str) -> str:
+    """Map a sync DATABASE_URL to its async driver (sqlite -> aiosqlite, ...)."""
+    scheme, sep, rest = url.partition("://")
+    if "+" in scheme and scheme.split("+")[1] in ("aiosqlite", "asyncpg"):
+        return url
+    base = scheme.split("+")[0]
+    return ASYNC_DRIVERS.get(base, scheme) + sep + rest
+
+
+ASYNC_DATABASE_URL = os.getenv("ASYNC_DATABASE_URL", to_async_url(DATABASE_URL))
+
+DB_PROFILE = os.getenv("DB_PROFILE", "balanced").lower()
+
+# PRAGMA на каждое соединение SQLite; "legacy" — поведение по умолчанию SQLite
+SQLITE_PROFILES: Dict[str, Dict[str, object]] = {
+    "legacy": {},
+    "safe": {
+        "journal_mode": "WAL",
+        "synchronous": "FULL",
+        "busy_timeout": 5000,
+        "cache_size": -16000,       # 16 MB
+        "temp_store": "MEMORY",
+    },
+    "balanced": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 5000,
+        "cache_size": -64000,       # 64 MB
+        "mmap_size": 268435456,     # 256 MB
+        "temp_store": "MEMORY",
+    },
+    "throughput": {
+        "journal_mode": "WAL",
+        "synchronous": "NORMAL",
+        "busy_timeout": 10000,
+        "cache_size": -256000,      # 256 MB
+        "mmap_size": 1073741824,    # 1 GB
+        "temp_store": "MEMORY",
+        "wal_autocheckpoint": 10000,
+    },
+}
+
+# Пул соединений (и кеш подготовленных выражений asyncpg) для серверных БД
+SERVER_PROFILES: Dict[str, Dict[str, object]] = {
+    "legacy": {},
+    "safe": {"pool_size": 5, "max_overflow": 5, "pool_pre_ping": True, "pool_recycle": 1800,
+             "statement_cache_size": 100},
+    "balanced": {"pool_size": 10, "max_overflow": 20, "pool_pre_ping": True, "pool_recycle": 1800,
+                 "statement_cache_size": 500},
+    "throughput": {"pool_size": 30, "max_overflow": 30, "pool_pre_ping": False, "pool_recycle": 3600,
+                   "statement_cache_size": 2000},
+}
+
+# Пул для файловой SQLite: запись всё равно одна, но чтения идут параллельно
+SQLITE_POOLS: Dict[str, Dict[str, object]] = {
+    "legacy": {},
+    "safe": {"pool_size": 5, "max_overflow": 10},
+    "balanced": {"pool_size": 10, "max_overflow": 20},
+    "throughput": {"pool_size": 20, "max_overflow": 40},
+}
+
+if DB_PROFILE not in SQLITE_PROFILES:
+    raise RuntimeError(
+        f"Unknown DB_PROFILE '{DB_PROFILE}', expected one of: {', '.join(SQLITE_PROFILES)}"
+    )
+
+IS_SQLITE = DATABASE_URL.startswith("sqlite")
+IS_MEMORY_SQLITE = IS_SQLITE and make_url(DATABASE_URL).database in (None, "", ":memory:")
+
+connect_args = {"check_same_thread": False} if IS_SQLITE else {}
+
+if IS_SQLITE:
+    SQLITE_PRAGMAS = SQLITE_PROFILES[DB_PROFILE]
+    POOL_OPTIONS = {} if IS_MEMORY_SQLITE else dict(SQLITE_POOLS[DB_PROFILE])
+    STATEMENT_CACHE_SIZE = None
+else:
+    SQLITE_PRAGMAS = {}
+    POOL_OPTIONS = dict(SERVER_PROFILES[DB_PROFILE])
+    STATEMENT_CACHE_SIZE = POOL_OPTIONS.pop("statement_cache_size", None)
+
 # Create SQLAlchemy engine
 engine = create_engine(
     DATABASE_URL,
-    connect_args={"check_same_thread": False}  # Needed for SQLite
+    connect_args=connect_args,  # Needed for SQLite
+    **POOL_OPTIONS,
 )
 
 # SessionLocal class for creating new Session objects
@@ -27,5 +126,75 @@ SessionLocal = sessionmaker(
     bind=engine
 )
 
+# Async engine and sessions for the request path
+_async_url = make_url(ASYNC_DATABASE_URL)
+if STATEMENT_CACHE_SIZE is not None and _async_url.drivername.endswith("asyncpg"):
+    _async_url = _async_url.update_query_dict(
+        {"prepared_statement_cache_size": str(STATEMENT_CACHE_SIZE)}
+    )
+async_engine = create_async_engine(_async_url, **POOL_OPTIONS)
+
+
+def _apply_pragmas(dbapi_connection, connection_record) -> None:
+    cursor = dbapi_connection.cursor()
+    try:
+        for name, value in SQLITE_PRAGMAS.items():
+            cursor.execute(f"PRAGMA {name}={value}")
+    finally:
+        cursor.close()
+
+
+if SQLITE_PRAGMAS:
+    event.listen(engine, "connect", _apply_pragmas)
+    event.listen(async_engine.sync_engine, "connect", _apply_pragmas)
+
+
+async def effective_settings() -> Dict[str, str]:
+    """Settings actually in force on a pooled connection (shown on the admin page)."""
+    settings: Dict[str, str] = {
+        "profile": DB_PROFILE,
+        "dialect": async_engine.dialect.name,
+        "driver": async_engine.dialect.driver,
+    }
+    pool = async_engine.pool
+    settings["pool"] = type(pool).__name__
+    for name in ("pool_size", "max_overflow", "pool_recycle"):
+        if name in POOL_OPTIONS:
+            settings[name] = str(POOL_OPTIONS[name])
+    if hasattr(pool, "checkedout"):
+        settings["pool_checked_out"] = str(pool.checkedout())
+    settings["pool_pre_ping"] = str(bool(POOL_OPTIONS.get("pool_pre_ping", False)))
+    if STATEMENT_CACHE_SIZE is not None:
+        settings["statement_cache_size"] = str(STATEMENT_CACHE_SIZE)
+    if IS_SQLITE:
+        async with async_engine.connect() as conn:
+            for name in ("journal_mode", "synchronous", "busy_timeout", "cache_size",
+                         "mmap_size", "temp_store", "wal_autocheckpoint"):
+                value = (await conn.exec_driver_sql(f"PRAGMA {name}")).scalar()
+                settings[name] = str(value)
+    return settings
+
+
+AsyncSessionLocal = async_sessionmaker(
+    async_engine,
+    autoflush=False,
+    expire_on_commit=False,
+)
+
+
+async def get_db() -> AsyncIterator[AsyncSession]:
+    """FastAPI dependency: one AsyncSession per request."""
+    async with AsyncSessionLocal() as db:
+        yield db
+
+
+def upsert(model):
+    """INSERT supporting ON CONFLICT clauses for the configured dialect (SQLite, PostgreSQL)."""
+    if async_engine.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    return insert(model)
+
 # Base class for ORM models
 Base = declarative_base()
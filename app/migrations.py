@@ -0,0 +1,71 @@
+# app/migrations.py
+"""
+Ad-hoc schema migrations for databases created by older versions.
+
+create_all() only creates missing tables, so columns and indexes added to
+existing tables are applied here. Every step is idempotent; migrate() runs
+on every start (cli.py and the API apps).
+"""
+from sqlalchemy import inspect, text
+from sqlalchemy.engine import Engine
+
+from app.utils.search import create_fts
+
+
+def migrate(engine: Engine) -> None:
+    insp = inspect(engine)
+    tables = insp.get_table_names()
+    with engine.begin() as conn:
+        # users → is_admin, daily_limit
+        if "users" in tables:
+            cols = [c["name"] for c in insp.get_columns("users")]
+            if "is_admin" not in cols:
+                conn.execute(text("ALTER TABLE users ADD COLUMN is_admin BOOLEAN DEFAULT 0"))
+            if "daily_limit" not in cols:
+                conn.execute(text("ALTER TABLE users ADD COLUMN daily_limit INTEGER DEFAULT 1000"))
+
+        # sessions → message_count, last_activity (счётчики для админ-панели)
+        if "sessions" in tables:
+            cols = [c["name"] for c in insp.get_columns("sessions")]
+            if "message_count" not in cols:
+                conn.execute(text(
+                    "ALTER TABLE sessions ADD COLUMN message_count INTEGER NOT NULL DEFAULT 0"
+                ))
+                conn.execute(text(
+                    "UPDATE sessions SET message_count = "
+                    "(SELECT COUNT(*) FROM messages WHERE messages.session_id = sessions.session_id)"
+                ))
+            if "last_activity" not in cols:
+                conn.execute(text("ALTER TABLE sessions ADD COLUMN last_activity TIMESTAMP"))
+                conn.execute(text(
+                    "UPDATE sessions SET last_activity = COALESCE("
+                    "(SELECT MAX(timestamp) FROM messages WHERE messages.session_id = sessions.session_id), "
+                    "created_at)"
+                ))
+            if "username" not in cols:
+                # Владельца старых сессий взять неоткуда — остаётся NULL (см. app/utils/search.py)
+                conn.execute(text("ALTER TABLE sessions ADD COLUMN username VARCHAR"))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_sessions_username ON sessions (username)"
+            ))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_sessions_message_count ON sessions (message_count)"
+            ))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_sessions_last_activity ON sessions (last_activity)"
+            ))
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_sessions_created_at_session_id "
+                "ON sessions (created_at, session_id)"
+            ))
+
+        # messages → (session_id, id) вместо индекса по одному session_id
+        if "messages" in tables:
+            conn.execute(text(
+                "CREATE INDEX IF NOT EXISTS ix_messages_session_id_id ON messages (session_id, id)"
+            ))
+            conn.execute(text("DROP INDEX IF EXISTS ix_messages_session_id"))
+
+        # messages → полнотекстовый индекс FTS5 (только SQLite)
+        if "messages" in tables and engine.dialect.name == "sqlite":
+            create_fts(conn)
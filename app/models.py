@@ -1,5 +1,5 @@
 # app/models.py
-from sqlalchemy import Column, Integer, String, DateTime, Boolean, ForeignKey
+from sqlalchemy import BigInteger, Column, Integer, String, DateTime, Boolean, Float, ForeignKey, Index, text
 from sqlalchemy.sql import func
 from .database import Base
 
@@ -20,12 +20,51 @@ class Session(Base):
     __tablename__ = "sessions"
     session_id = Column(String, server_default=func.random(), primary_key=True, index=True)
     created_at = Column(DateTime(timezone=True), server_default=func.now())
+    username   = Column(String, index=True)  # кто начал сессию
+    # Денормализованные счётчики, обновляются при записи реплик
+    message_count = Column(Integer, nullable=False, default=0, server_default="0", index=True)
+    last_activity = Column(DateTime(timezone=True), server_default=func.now(), index=True)
+
+    __table_args__ = (
+        # Keyset-пагинация списка сессий (покрывающий индекс)
+        Index("ix_sessions_created_at_session_id", "created_at", "session_id"),
+    )
 
 class Message(Base):
     __tablename__ = "messages"
     id         = Column(Integer, primary_key=True, index=True)
-    session_id = Column(String,  nullable=False, index=True)
+    session_id = Column(String,  nullable=False)
     role       = Column(String,  nullable=False)
     model      = Column(String,  nullable=False)
     content    = Column(String,  nullable=False)
     timestamp  = Column(DateTime(timezone=True), server_default=func.now())
+
+    __table_args__ = (
+        # Сообщения сессии по порядку записи; заменяет индекс по одному session_id
+        Index("ix_messages_session_id_id", "session_id", "id"),
+    )
+
+class ModelPull(Base):
+    """Задание на установку модели; общее для всех воркеров API (см. app/utils/jobs.py)."""
+    __tablename__ = "model_pulls"
+    id           = Column(String,  primary_key=True)
+    model        = Column(String,  nullable=False)
+    status       = Column(String,  nullable=False, index=True)
+    detail       = Column(String,  nullable=False, default="")
+    total        = Column(BigInteger, nullable=False, default=0)
+    completed    = Column(BigInteger, nullable=False, default=0)
+    error        = Column(String)
+    owner        = Column(String,  nullable=False)  # воркер, который качает модель
+    cancel_requested = Column(Boolean, nullable=False, default=False)
+    created_at   = Column(Float,   nullable=False)
+    updated_at   = Column(Float,   nullable=False)
+    finished_at  = Column(Float)
+
+    __table_args__ = (
+        # Не больше одного незавершённого задания на модель во всех воркерах
+        Index(
+            "ux_model_pulls_active_model", "model", unique=True,
+            sqlite_where=text("status IN ('queued', 'running')"),
+            postgresql_where=text("status IN ('queued', 'running')"),
+        ),
+    )
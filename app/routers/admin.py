@@ -1,38 +1,42 @@
 import os
-import sys
-import subprocess
-import secrets
+from datetime import datetime
+from typing import Optional
 
 from fastapi import (
-    APIRouter, Request, Depends, Form,
+    APIRouter, Request, Depends, File, Form, Query, UploadFile,
     status, HTTPException
 )
-from fastapi.responses import RedirectResponse, HTMLResponse
+from fastapi.responses import RedirectResponse, HTMLResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
 from dotenv import load_dotenv, dotenv_values, set_key
-from sqlalchemy.orm import Session
+from sqlalchemy import delete, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.database import SessionLocal
+from app.database import effective_settings, get_db
 from app.models import User, RateLimit, Session as SessionModel, Message
+from app.routers.auth import authenticate
+from app.utils.auth_cache import credential_cache
 from app.utils.ollama import list_installed_models, remove_model
+from app.utils.concurrency import run_blocking
+from app.utils.ratelimit import rate_limiter
+from app.utils.residency import read_snapshot
+from app.utils.response_cache import response_cache
+from app.utils.supervisor import supervisor
+from app.utils.transfer import Exporter, Importer, gzip_chunks_async
 
 router = APIRouter()
 templates = Jinja2Templates(directory="templates")
 ENV_PATH = os.path.join(os.getcwd(), ".env")
+ADMIN_PAGE_SIZE = int(os.getenv("ADMIN_PAGE_SIZE", "50"))
 security = HTTPBasic()
 
-# Глобальный процесс API
-api_process: subprocess.Popen = None
-
-
-def get_current_admin(
-    creds: HTTPBasicCredentials = Depends(security)
+async def get_current_admin(
+    creds: HTTPBasicCredentials = Depends(security),
 ):
-    db: Session = SessionLocal()
-    user = db.query(User).filter(User.username == creds.username).first()
-    db.close()
-    if not user or not secrets.compare_digest(creds.password, user.password_hash):
+    try:
+        user = await authenticate(creds.username, creds.password)
+    except HTTPException:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Неверные креденшлы"
@@ -47,51 +51,120 @@ def get_current_admin(
 
 @router.on_event("startup")
 def start_api_server():
-    """Запуск API-процесса при старте админ-приложения."""
-    global api_process
-    # Если API уже запущен, не запускаем второй процесс
-    if api_process is not None:
+    """Запуск API-воркеров при старте админ-приложения."""
+    # Если API уже запущен, не запускаем второй набор воркеров
+    if supervisor.running:
         return
     load_dotenv(ENV_PATH)
-    port = os.getenv("PORT", "8000")
-    cmd = [
-        sys.executable, "-m", "uvicorn",
-        "app.api_app:app", "--host", "0.0.0.0", "--port", port
-    ]
-    api_process = subprocess.Popen(cmd)
+    supervisor.start(int(os.getenv("PORT", "8000")))
+
+
+@router.on_event("shutdown")
+def stop_api_server():
+    """Плавная остановка API-воркеров вместе с админ-приложением."""
+    supervisor.stop()
+
+
+USER_SORTS = {
+    "username":    User.username,
+    "daily_limit": User.daily_limit,
+}
+SESSION_SORTS = {
+    "created_at":    SessionModel.created_at,
+    "last_activity": SessionModel.last_activity,
+    "message_count": SessionModel.message_count,
+}
+
+
+async def _page(db: AsyncSession, model, column, key, order: str, size: int,
+                after: Optional[str] = None, before: Optional[str] = None):
+    """
+    One keyset page in ORDER BY column, key (primary key for a stable order):
+    rows after / before the cursor row, given by its primary key, as in
+    history.py. Returns (rows, prev_cursor, next_cursor).
+    """
+    cursor = after if after is not None else before
+    if cursor is not None and await db.scalar(select(key).where(key == cursor)) is None:
+        # Строку-курсор удалили — начинаем с первой страницы
+        after = before = cursor = None
+    backward = before is not None
+    descending = (order == "desc") != backward
+    query = select(model)
+    if cursor is not None:
+        bound = tuple_(select(column).where(key == cursor).scalar_subquery(), cursor)
+        sort = tuple_(column, key)
+        query = query.where(sort < bound if descending else sort > bound)
+    direction = (lambda c: c.desc()) if descending else (lambda c: c.asc())
+    rows = list((await db.scalars(
+        query.order_by(direction(column), direction(key)).limit(size + 1)
+    )).all())
+    more = len(rows) > size
+    rows = rows[:size]
+    if backward:
+        rows.reverse()
+    prev_cursor = next_cursor = None
+    if rows:
+        first, last = getattr(rows[0], key.key), getattr(rows[-1], key.key)
+        if backward:
+            prev_cursor, next_cursor = (first if more else None), last
+        else:
+            prev_cursor, next_cursor = (first if after is not None else None), (last if more else None)
+    return rows, prev_cursor, next_cursor
 
 
 @router.get("/admin", response_class=HTMLResponse)
-def dashboard(
+async def dashboard(
     request: Request,
-    admin: str = Depends(get_current_admin)
+    users_after: Optional[str] = Query(None),
+    users_before: Optional[str] = Query(None),
+    users_sort: str = Query("username"),
+    users_order: str = Query("asc", pattern="^(asc|desc)$"),
+    sessions_after: Optional[str] = Query(None),
+    sessions_before: Optional[str] = Query(None),
+    sessions_sort: str = Query("last_activity"),
+    sessions_order: str = Query("desc", pattern="^(asc|desc)$"),
+    admin: str = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_db),
 ):
     cfg    = dotenv_values(ENV_PATH)
     port   = cfg.get("PORT", os.getenv("PORT", "8000"))
     limit  = cfg.get("DAILY_LIMIT", os.getenv("DAILY_LIMIT", "1000"))
 
-    db: Session = SessionLocal()
-    try:
-        users     = db.query(User).all()
-        models    = list_installed_models()
-        sessions  = db.query(SessionModel).order_by(SessionModel.created_at.desc()).all()
-        msg_counts = {
-            s.session_id: db.query(Message)
-                             .filter(Message.session_id == s.session_id)
-                             .count()
-            for s in sessions
-        }
-    finally:
-        db.close()
-
-    return templates.TemplateResponse("admin.html", {
-        "request":    request,
-        "port":       port,
-        "limit":      limit,
-        "users":      users,
-        "models":     models,
-        "sessions":   sessions,
-        "msg_counts": msg_counts,
+    users_sort    = users_sort if users_sort in USER_SORTS else "username"
+    sessions_sort = sessions_sort if sessions_sort in SESSION_SORTS else "last_activity"
+
+    # Каждая таблица — одна страница по ключу (без OFFSET); счётчики сообщений
+    # хранятся в sessions, отдельного COUNT на сессию нет
+    users, users_prev, users_next = await _page(
+        db, User, USER_SORTS[users_sort], User.username,
+        users_order, ADMIN_PAGE_SIZE, users_after, users_before,
+    )
+    sessions, sessions_prev, sessions_next = await _page(
+        db, SessionModel, SESSION_SORTS[sessions_sort], SessionModel.session_id,
+        sessions_order, ADMIN_PAGE_SIZE, sessions_after, sessions_before,
+    )
+    models = await list_installed_models()
+    db_settings = await effective_settings()
+
+    return templates.TemplateResponse(request, "admin.html", {
+        "port":     port,
+        "limit":    limit,
+        "users":    users,
+        "models":   models,
+        "sessions": sessions,
+        "db_settings": db_settings,
+        "workers":  supervisor.status(),
+        "residency": read_snapshot(),
+        "view": {
+            "users_sort":     users_sort,
+            "users_order":    users_order,
+            "users_prev":     users_prev,
+            "users_next":     users_next,
+            "sessions_sort":  sessions_sort,
+            "sessions_order": sessions_order,
+            "sessions_prev":  sessions_prev,
+            "sessions_next":  sessions_next,
+        },
     })
 
 
@@ -108,107 +181,123 @@ def update_config(
 
 
 @router.post("/admin/user")
-def create_or_update_user(
+async def create_or_update_user(
     username_new: str = Form(...),
     password_new: str = Form(...),
     daily_limit: int   = Form(...),
-    admin: str         = Depends(get_current_admin)
+    admin: str         = Depends(get_current_admin),
+    db: AsyncSession   = Depends(get_db),
 ):
-    db: Session = SessionLocal()
-    try:
-        u = db.query(User).filter(User.username == username_new).first()
-        if u:
-            u.password_hash = password_new
-            u.daily_limit   = daily_limit
-        else:
-            u = User(
-                username=username_new,
-                password_hash=password_new,
-                is_admin=False,
-                daily_limit=daily_limit
-            )
-            db.add(u)
-        db.commit()
-    finally:
-        db.close()
+    u = await db.get(User, username_new)
+    if u:
+        u.password_hash = password_new
+        u.daily_limit   = daily_limit
+    else:
+        u = User(
+            username=username_new,
+            password_hash=password_new,
+            is_admin=False,
+            daily_limit=daily_limit
+        )
+        db.add(u)
+    await db.commit()
+    # Новый лимит доходит до воркеров через кэш учётных данных; счётчик за день не сбрасывается
+    credential_cache.invalidate(username_new)
     return RedirectResponse("/admin", status_code=status.HTTP_303_SEE_OTHER)
 
 
 @router.post("/admin/user/delete")
-def delete_user(
+async def delete_user(
     username_del: str = Form(...),
-    admin: str        = Depends(get_current_admin)
+    admin: str        = Depends(get_current_admin),
+    db: AsyncSession  = Depends(get_db),
 ):
-    db: Session = SessionLocal()
-    try:
-        user = db.query(User).filter(User.username == username_del).first()
-        if not user:
-            raise HTTPException(status_code=404, detail="Пользователь не найден")
-        if user.is_admin:
-            raise HTTPException(status_code=403, detail="Нельзя удалять администратора")
-        db.delete(user)
-        db.commit()
-    finally:
-        db.close()
+    user = await db.get(User, username_del)
+    if not user:
+        raise HTTPException(status_code=404, detail="Пользователь не найден")
+    if user.is_admin:
+        raise HTTPException(status_code=403, detail="Нельзя удалять администратора")
+    await db.delete(user)
+    # Пересозданный с тем же именем пользователь начинает с нуля
+    await db.execute(delete(RateLimit).where(RateLimit.username == username_del))
+    await db.commit()
+    credential_cache.invalidate(username_del)
+    await rate_limiter.forget(username_del)
     return RedirectResponse("/admin", status_code=status.HTTP_303_SEE_OTHER)
 
 
 @router.post("/admin/clear")
-def clear_database(
-    admin: str = Depends(get_current_admin)
+async def clear_database(
+    admin: str       = Depends(get_current_admin),
+    db: AsyncSession = Depends(get_db),
 ):
     """Очистить всю БД и удалить все установленные модели."""
-    db: Session = SessionLocal()
-    try:
-        db.query(Message).delete()
-        db.query(SessionModel).delete()
-        db.query(RateLimit).delete()
-        db.query(User).delete()
-        db.commit()
-    finally:
-        db.close()
-
-    for model in list_installed_models():
+    await db.execute(delete(Message))
+    await db.execute(delete(SessionModel))
+    await db.execute(delete(RateLimit))
+    await db.execute(delete(User))
+    await db.commit()
+    credential_cache.invalidate()
+    await rate_limiter.forget()
+    await response_cache.clear()
+
+    for model in await list_installed_models():
         try:
-            remove_model(model)
+            await remove_model(model)
         except Exception:
             pass
     return RedirectResponse("/admin", status_code=status.HTTP_303_SEE_OTHER)
 
 
+@router.get("/admin/export")
+async def export_history(
+    username: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    model: Optional[str] = None,
+    gzip: bool = False,
+    admin: str = Depends(get_current_admin),
+):
+    """
+    Выгрузка истории (сессии и сообщения) потоком NDJSON, при gzip=true — сжатой.
+    Фильтры: пользователь, интервал дат сообщений [since, until), модель.
+    """
+    # Пустые поля формы — без фильтра
+    chunks = Exporter(username or None, since, until, model or None).chunks_async()
+    filename = "history.ndjson"
+    if gzip:
+        chunks = gzip_chunks_async(chunks)
+        filename += ".gz"
+    return StreamingResponse(
+        chunks,
+        media_type="application/gzip" if gzip else "application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
+    )
+
+
+@router.post("/admin/import")
+async def import_history(
+    file: UploadFile = File(...),
+    admin: str = Depends(get_current_admin),
+):
+    """
+    Загрузка истории из NDJSON (в т.ч. .gz) в формате выгрузки.
+    Импорт идёт пачками в пуле потоков, не блокируя event loop.
+    """
+    stats = await run_blocking(Importer().run, file.file)
+    return stats.as_dict()
+
+
 @router.post("/admin/restart")
 def restart_api_server(
     admin: str = Depends(get_current_admin)
 ):
-    """Перезапуск API-сервера на новом порту из .env."""
-    global api_process
-
-    # Убить процессы, слушающие старый порт
-    old_cfg  = dotenv_values(ENV_PATH)
-    old_port = old_cfg.get("PORT", "8000")
-    try:
-        out = subprocess.check_output(f'netstat -ano | findstr :{old_port}', shell=True, text=True)
-        for line in out.splitlines():
-            pid = line.split()[-1]
-            subprocess.run(
-                f'taskkill /PID {pid} /F', shell=True,
-                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
-            )
-    except subprocess.CalledProcessError:
-        pass
-
-    # Завершаем текущий процесс API
-    if api_process and api_process.poll() is None:
-        api_process.kill()
-        api_process.wait(timeout=5)
-        api_process = None
-
-    # Запуск API на новом порту
+    """
+    Перезапуск API на порту из .env: воркеры заменяются по одному
+    (новый готов → старый дорабатывает запросы и завершается), в фоне.
+    """
     new_cfg  = dotenv_values(ENV_PATH)
-    new_port = new_cfg.get("PORT", "8000")
-    cmd = [
-        sys.executable, "-m", "uvicorn",
-        "app.api_app:app", "--host", "0.0.0.0", "--port", new_port
-    ]
-    api_process = subprocess.Popen(cmd)
+    new_port = int(new_cfg.get("PORT", "8000"))
+    if supervisor.restart_async(new_port) is None:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail="Перезапуск уже идёт")
     return RedirectResponse("/admin", status_code=status.HTTP_303_SEE_OTHER)
@@ -2,42 +2,57 @@
 
 from fastapi import APIRouter, Depends, HTTPException, status
 from fastapi.security import HTTPBasic, HTTPBasicCredentials
-from sqlalchemy.orm import Session
 import secrets
 
-from app.database import SessionLocal
+from app.database import AsyncSessionLocal
 from app.models import User
+from app.utils.auth_cache import CachedUser, credential_cache
+from app.utils.tracing import phase
 
 router = APIRouter()
 security = HTTPBasic()
 
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
-
-
-def get_current_username(
-    credentials: HTTPBasicCredentials = Depends(security),
-    db: Session = Depends(get_db),
-) -> str:
+async def authenticate(username: str, password: str) -> CachedUser:
     """
-    Проверяет Basic Auth данные и возвращает имя пользователя.
+    Проверяет логин и пароль: сначала по кэшу проверенных креденшлов,
+    при промахе — по таблице users. Бросает 401 при неверных данных.
     """
-    user = db.query(User).filter(User.username == credentials.username).first()
-    if not user or not secrets.compare_digest(credentials.password, user.password_hash):
+    cached = credential_cache.get(username, password)
+    if cached is not None:
+        return cached
+
+    async with AsyncSessionLocal() as db:
+        user = await db.get(User, username)
+    if not user or not secrets.compare_digest(password, user.password_hash):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Неверные имя пользователя или пароль",
             headers={"WWW-Authenticate": "Basic"},
         )
+    cached = CachedUser(user.username, user.is_admin, user.daily_limit)
+    credential_cache.put(username, password, cached)
+    return cached
+
+
+async def get_current_user(
+    credentials: HTTPBasicCredentials = Depends(security),
+) -> CachedUser:
+    """Проверяет Basic Auth данные и возвращает пользователя (с is_admin и daily_limit)."""
+    with phase("auth"):
+        return await authenticate(credentials.username, credentials.password)
+
+
+async def get_current_username(
+    user: CachedUser = Depends(get_current_user),
+) -> str:
+    """
+    Проверяет Basic Auth данные и возвращает имя пользователя.
+    """
     return user.username
 
 
 @router.get("/ping")
-def ping(username: str = Depends(get_current_username)):
+async def ping(username: str = Depends(get_current_username)):
     """Простой эндпоинт для проверки доступности сервиса и авторизации"""
     return {"message": "pong", "user": username}
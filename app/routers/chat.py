@@ -1,91 +1,283 @@
 # app/routers/chat.py
-from fastapi import APIRouter, Depends, HTTPException, status
-from datetime import datetime
-from sqlalchemy.orm import Session
-from app.database import SessionLocal
-from app.models import RateLimit, User, Session as SessionModel, Message
-from app.routers.auth import get_current_username
-from app.utils.ollama import chat
+import json
+import time
+from contextlib import nullcontext
+from typing import Optional
+
+import anyio
+from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
+from fastapi.responses import StreamingResponse
+from app.database import AsyncSessionLocal
+from app.routers.auth import get_current_user
+from app.utils import metrics
+from app.utils.auth_cache import CachedUser
+from app.utils.backends import TokenStream, _noop, _single, build_options
+from app.utils.context import context_cache
+from app.utils.inventory import model_inventory
+from app.utils.ollama import chat_stream
+from app.utils.ratelimit import RateLimitExceeded, rate_limiter
+from app.utils.residency import residency_manager
+from app.utils.response_cache import cache_mode, completion_key, response_cache
+from app.utils.scheduler import SchedulerRejected, Ticket, inference_scheduler
+from app.utils.singleflight import single_flight
+from app.utils.tracing import phase
+from app.utils.writer import Turn, turn_writer
 
 router = APIRouter()
 
-def get_db():
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
 
-def check_and_increment_limit(db: Session, username: str):
-    user = db.query(User).filter(User.username == username).first()
-    if not user:
-        raise HTTPException(status_code=404, detail="User not found")
+async def check_and_increment_limit(user: CachedUser):
     if user.is_admin:
         return  # админ без ограничений
-
-    today = datetime.now().strftime("%Y-%m-%d")
-    rl = db.query(RateLimit).filter(
-        RateLimit.username == username,
-        RateLimit.date == today
-    ).first()
-    if not rl:
-        rl = RateLimit(username=username, date=today, count=0)
-        db.add(rl)
-        db.commit()
-        db.refresh(rl)
-
-    if rl.count >= user.daily_limit:
+    try:
+        with phase("rate_limit"):
+            await rate_limiter.hit(user)
+    except RateLimitExceeded:
+        metrics.REJECTIONS.labels("daily_limit").inc()
         raise HTTPException(
             status_code=status.HTTP_429_TOO_MANY_REQUESTS,
             detail="Daily request limit reached"
         )
 
-    rl.count += 1
-    db.commit()
+
+def _rejected(e: SchedulerRejected) -> HTTPException:
+    return HTTPException(
+        status_code=e.status_code,
+        detail=str(e),
+        headers={"Retry-After": str(e.retry_after)},
+    )
+
+
+@router.get("/cache")
+async def cache_stats(user: CachedUser = Depends(get_current_user)):
+    """Кэш ответов в этом процессе: попадания по уровням, промахи, вытеснения."""
+    return response_cache.stats()
+
+
+@router.get("/flights")
+async def flight_stats(user: CachedUser = Depends(get_current_user)):
+    """Идущие генерации и сколько запросов к ним подключилось."""
+    return single_flight.stats()
+
+
+@router.get("/scheduler")
+async def scheduler_stats(user: CachedUser = Depends(get_current_user)):
+    """Очереди к моделям в этом процессе: занятые слоты, глубина очереди, время ожидания."""
+    return inference_scheduler.stats()
+
+
+def _frame(data: dict, sse: bool) -> str:
+    line = json.dumps(data, ensure_ascii=False)
+    if sse:
+        event = "done" if data.get("done") else ("error" if "error" in data else "token")
+        return f"event: {event}\ndata: {line}\n\n"
+    return line + "\n"
+
+
+async def stream_reply(
+    request: Request,
+    tokens: TokenStream,
+    session_id: str,
+    model: str,
+    prompt: str,
+    sse: bool,
+    username: Optional[str] = None,
+):
+    """
+    Пересылает токены клиенту по мере генерации.
+    При отключении клиента отменяет генерацию в Ollama;
+    реплика (с частичным ответом, если он есть) сохраняется в конце стрима.
+    """
+    parts = []
+    try:
+        async for token in tokens:
+            if await request.is_disconnected():
+                break
+            parts.append(token)
+            yield _frame({"token": token, "done": False}, sse)
+        else:
+            yield _frame({"response": "".join(parts).strip(), "done": True}, sse)
+    except RuntimeError as e:
+        yield _frame({"error": str(e), "done": True}, sse)
+    finally:
+        await tokens.cancel()
+        messages = [("user", prompt)]
+        if parts:
+            messages.append(("assistant", "".join(parts).strip()))
+        # Задача может быть уже отменена (клиент отключился) — сохраняем под щитом
+        with anyio.CancelScope(shield=True):
+            await turn_writer.record(Turn(session_id, model, messages, username))
 
 
 @router.post("/{session_id}")
-def send_message(
+async def send_message(
     session_id: str,
     payload: dict,
-    username: str = Depends(get_current_username),
-    db: Session = Depends(get_db)
+    request: Request,
+    response: Response,
+    user: CachedUser = Depends(get_current_user),
 ):
-    # Проверяем и инкрементируем лимит перед запросом к модели
-    check_and_increment_limit(db, username)
-
-    # Создаем новую сессию, если её ещё нет
-    session = db.query(SessionModel).filter(SessionModel.session_id == session_id).first()
-    if not session:
-        session = SessionModel(session_id=session_id)
-        db.add(session)
-        db.commit()
-
-    # Сохраняем сообщение пользователя
-    user_msg = Message(
-        session_id=session_id,
-        role="user",
-        model=payload["model"],
-        content=payload["prompt"]
-    )
-    db.add(user_msg)
-    db.commit()
-
-    # Запрос к модели
-    response_text = chat(
-        session_id=session_id,
-        model=payload["model"],
-        prompt=payload["prompt"]
-    )
+    """
+    Отправляет промпт модели и сохраняет обе реплики в истории.
+    С `"stream": true` в теле ответ приходит потоком: NDJSON по умолчанию
+    или Server-Sent Events, если клиент прислал `Accept: text/event-stream`.
+    Генерации идут через очередь модели; при переполнении очереди — 503
+    (или 429, если у пользователя слишком много запросов в очереди) с Retry-After.
+    Запросы с `"temperature": 0` обслуживаются из кэша ответов, если он
+    включён (RESPONSE_CACHE); `Cache-Control: no-cache` / `no-store` его обходят.
+    Одинаковые запросы с `"temperature": 0`, пришедшие во время генерации,
+    получают её же ответ (single-flight); `no-store` запрашивает отдельную генерацию.
+    """
+    # Неизвестную модель отклоняем сразу, не расходуя лимит
+    with phase("model_check"):
+        known = await model_inventory.contains(payload["model"])
+    if not known:
+        raise HTTPException(
+            status_code=status.HTTP_404_NOT_FOUND,
+            detail=f"Model '{payload['model']}' is not installed"
+        )
+    # Учёт популярности модели для удержания в памяти
+    residency_manager.touch(payload["model"])
 
-    # Сохраняем ответ модели
-    bot_msg = Message(
-        session_id=session_id,
-        role="assistant",
-        model=payload["model"],
-        content=response_text
-    )
-    db.add(bot_msg)
-    db.commit()
+    model = payload["model"]
+    prompt = payload["prompt"]
+    temperature = payload.get("temperature")
+    max_tokens = payload.get("max_tokens")
+    sse = "text/event-stream" in request.headers.get("accept", "")
+    stream_headers = {"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+
+    # Окно контекста из предыдущих реплик (включая ещё не записанные).
+    # Соединение с БД берём только на чтение, не держим его во время генерации
+    with phase("context"):
+        async with AsyncSessionLocal() as db:
+            messages = await context_cache.window(db, session_id, model, prompt)
+
+    lookup, store = cache_mode(request.headers.get("cache-control", ""))
+    key = completion_key(model, build_options(temperature, max_tokens), messages)
+
+    # Кэш ответов: только детерминированные запросы (temperature 0)
+    cache_key = None
+    if response_cache.enabled and temperature == 0:
+        with phase("cache"):
+            cached = await response_cache.get(key) if lookup else None
+        if cached is not None:
+            # Ответ из кэша тоже расходует лимит и пишется в историю
+            await check_and_increment_limit(user)
+            if payload.get("stream"):
+                return StreamingResponse(
+                    stream_reply(
+                        request, TokenStream(_single(cached), _noop), session_id, model, prompt, sse,
+                        user.username,
+                    ),
+                    media_type="text/event-stream" if sse else "application/x-ndjson",
+                    headers={**stream_headers, "X-Cache": "HIT"},
+                )
+            await turn_writer.record(Turn(
+                session_id, model, [("user", prompt), ("assistant", cached)], user.username,
+            ))
+            response.headers["X-Cache"] = "HIT"
+            return {"response": cached}
+        if store:
+            cache_key = key
+        stream_headers["X-Cache"] = response.headers["X-Cache"] = "MISS" if lookup else "BYPASS"
+
+    # Такой же детерминированный запрос уже генерируется — подключаемся к нему.
+    # При сэмплировании каждый запрос должен получить свой ответ
+    ticket: Optional[Ticket] = None
+    share = store and temperature == 0
+    flight = single_flight.join(key) if share else None
+    if flight is not None:
+        try:
+            await check_and_increment_limit(user)
+        except HTTPException:
+            single_flight.leave(flight)
+            raise
+    else:
+        # Место в очереди модели: при переполнении — отказ сразу, до лимита
+        try:
+            ticket = inference_scheduler.enqueue(model, user.username, user.is_admin)
+        except SchedulerRejected as e:
+            raise _rejected(e)
+        try:
+            # Проверяем и инкрементируем лимит перед запросом к модели
+            await check_and_increment_limit(user)
+        except HTTPException:
+            ticket.release()
+            raise
+
+        async def open_stream() -> TokenStream:
+            # Задача генерации наследует контекст запроса: фазы попадают в его трассировку
+            with phase("queue"):
+                await ticket.wait()
+            with phase("open"):
+                return await chat_stream(
+                    session_id=session_id,
+                    model=model,
+                    prompt=prompt,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    messages=messages,
+                )
+
+        async def remember(text: str) -> None:
+            # В кэш попадает только полностью сгенерированный ответ
+            await response_cache.put(cache_key, model, text)
+
+        # Генерация идёт в фоне и держит слот модели до конца
+        flight = single_flight.start(
+            key, model, open_stream,
+            on_complete=remember if cache_key is not None else None,
+            on_finish=ticket.release,
+            share=share,
+        )
+
+    joined_at = time.monotonic()
+    handed_off = False
+    try:
+        try:
+            # До первого ответа бэкенда. Ведущий запрос уже учёл очередь и запуск
+            # в фазах queue / open; подключившийся ждёт чужую генерацию (join)
+            with phase("join") if ticket is None else nullcontext():
+                await flight.wait_open()
+        except SchedulerRejected as e:
+            raise _rejected(e)
+        except RuntimeError as e:
+            # Сообщение пользователя сохраняем и при ошибке модели (в т.ч. для стрима)
+            await turn_writer.record(Turn(session_id, model, [("user", prompt)], user.username))
+            raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=str(e))
+        queue_wait = f"{ticket.waited if ticket is not None else time.monotonic() - joined_at:.3f}"
+        role = "leader" if ticket is not None else "follower"
+
+        if payload.get("stream"):
+            handed_off = True
+            # Отписку (и отмену генерации последним подписчиком) делает stream_reply
+            return StreamingResponse(
+                stream_reply(
+                    request, single_flight.subscribe(flight), session_id, model, prompt, sse,
+                    user.username,
+                ),
+                media_type="text/event-stream" if sse else "application/x-ndjson",
+                headers={**stream_headers, "X-Queue-Wait": queue_wait, "X-Singleflight": role},
+            )
+
+        try:
+            with phase("inference"):
+                response_text = await flight.result()
+        except RuntimeError as e:
+            await turn_writer.record(Turn(session_id, model, [("user", prompt)], user.username))
+            raise HTTPException(status_code=status.HTTP_502_BAD_GATEWAY, detail=str(e))
+    finally:
+        if not handed_off:
+            single_flight.leave(flight)
+
+    # Сессия, сообщение пользователя и ответ модели — одной транзакцией
+    await turn_writer.record(Turn(
+        session_id,
+        model,
+        [("user", prompt), ("assistant", response_text)],
+        user.username,
+    ))
 
+    response.headers["X-Queue-Wait"] = queue_wait
+    response.headers["X-Singleflight"] = role
     return {"response": response_text}
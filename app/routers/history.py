@@ -3,73 +3,260 @@
 Эндпоинты для управления историей чатов:
 - Получение списка сессий
 - Получение сообщений конкретной сессии
+- Полнотекстовый поиск по сообщениям
 - Удаление сессии и всех её сообщений
 """
-from fastapi import APIRouter, Depends, HTTPException, status
-from sqlalchemy.orm import Session
-from typing import List
+from datetime import datetime
+from fastapi import APIRouter, Depends, HTTPException, Query, Response, status
+from sqlalchemy import delete, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+from typing import List, Optional
 
-from app.routers.auth import get_current_username, get_db
+from app.database import get_db
+from app.routers.auth import get_current_user, get_current_username
 from app.models import Session as SessionModel, Message
+from app.utils import search
+from app.utils.auth_cache import CachedUser
+from app.utils.context import context_cache
+from app.utils.tracing import phase
+from app.utils.writer import turn_writer
 from pydantic import BaseModel
 
 router = APIRouter()
 
+PAGE_LIMIT = 100
+MAX_PAGE_LIMIT = 1000
+SEARCH_LIMIT = 20
+MAX_SEARCH_LIMIT = 100
+
 class SessionInfo(BaseModel):
     session_id: str
     created_at: str  # ISO datetime as string
 
 class MessageInfo(BaseModel):
+    id: Optional[int] = None  # None — реплика ещё в очереди записи
     role: str
     model: str
     content: str
     timestamp: str  # ISO datetime as string
 
+class SearchHit(BaseModel):
+    id: int
+    session_id: str
+    role: str
+    model: str
+    snippet: str  # совпадения обёрнуты в <mark>…</mark>
+    rank: float   # bm25: меньше — релевантнее
+    timestamp: str  # ISO datetime as string
+
 @router.get("/sessions", response_model=List[SessionInfo])
-def list_sessions(username: str = Depends(get_current_username), db: Session = Depends(get_db)):
-    """Возвращает список всех сессий чатов"""
-    sessions = db.query(SessionModel).order_by(SessionModel.created_at.desc()).all()
-    return [SessionInfo(session_id=s.session_id, created_at=s.created_at.isoformat()) for s in sessions]
+async def list_sessions(
+    response: Response,
+    after: Optional[str] = Query(None, description="Курсор: сессии старше указанной"),
+    before: Optional[str] = Query(None, description="Курсор: сессии новее указанной"),
+    limit: int = Query(PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
+    username: str = Depends(get_current_username),
+    db: AsyncSession = Depends(get_db),
+):
+    """
+    Возвращает сессии чатов, новые первыми, страницами по `limit`.
+    Курсор — session_id крайней сессии страницы; следующая и предыдущая
+    страницы приходят в заголовках X-Next-Cursor / X-Prev-Cursor.
+    """
+    if after and before:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Use either 'after' or 'before'")
+    key = tuple_(SessionModel.created_at, SessionModel.session_id)
+    # Только колонки индекса (created_at, session_id) — запрос по покрывающему индексу
+    query = select(SessionModel.session_id, SessionModel.created_at)
+    cursor = after or before
+    if cursor:
+        created = select(SessionModel.created_at).where(SessionModel.session_id == cursor).scalar_subquery()
+        if await db.scalar(select(SessionModel.session_id).where(SessionModel.session_id == cursor)) is None:
+            raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Unknown cursor")
+        bound = tuple_(created, cursor)
+        query = query.where(key < bound) if after else query.where(key > bound)
+    if before:
+        query = query.order_by(SessionModel.created_at.asc(), SessionModel.session_id.asc())
+    else:
+        query = query.order_by(SessionModel.created_at.desc(), SessionModel.session_id.desc())
+    rows = (await db.execute(query.limit(limit + 1))).all()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    if before:
+        rows.reverse()
+
+    result = [SessionInfo(session_id=sid, created_at=created.isoformat()) for sid, created in rows]
+    if rows:
+        if before:
+            if more:
+                response.headers["X-Prev-Cursor"] = rows[0][0]
+            response.headers["X-Next-Cursor"] = rows[-1][0]
+        else:
+            if more:
+                response.headers["X-Next-Cursor"] = rows[-1][0]
+            if after:
+                response.headers["X-Prev-Cursor"] = rows[0][0]
+    if cursor:
+        return result
+    # Сессии, реплики которых ещё в очереди записи (read-your-writes) — на первой странице
+    known = {s.session_id for s in result}
+    pending = [
+        SessionInfo(session_id=sid, created_at=created.isoformat())
+        for sid, created in sorted(turn_writer.pending_sessions().items(), key=lambda i: i[1], reverse=True)
+        if sid not in known
+    ]
+    return pending + result
+
+@router.get("/search", response_model=List[SearchHit])
+async def search_messages(
+    response: Response,
+    q: str = Query(..., min_length=1, description="Слова (все обязательны), \"фраза\", префикс*"),
+    model: Optional[str] = Query(None, description="Только сообщения модели"),
+    role: Optional[str] = Query(None, description="user или assistant"),
+    session_id: Optional[str] = Query(None, description="Только в этой сессии"),
+    since: Optional[datetime] = Query(None, description="Сообщения начиная с даты"),
+    until: Optional[datetime] = Query(None, description="Сообщения до даты (не включая)"),
+    username: Optional[str] = Query(None, description="Сессии пользователя (только для администратора)"),
+    offset: int = Query(0, ge=0),
+    limit: int = Query(SEARCH_LIMIT, ge=1, le=MAX_SEARCH_LIMIT),
+    user: CachedUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db),
+) -> List[SearchHit]:
+    """
+    Полнотекстовый поиск по сообщениям (SQLite FTS5), самые релевантные первыми.
+    Пользователь ищет в своих сессиях; администратор — во всех или в сессиях `username`.
+    Сессии без владельца (созданные до появления sessions.username) видит только администратор.
+    Смещение следующей страницы — в заголовке X-Next-Offset.
+    Реплики, ещё стоящие в очереди записи, не находятся.
+    """
+    if not user.is_admin:
+        if username is not None and username != user.username:
+            raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Admin access required")
+        username = user.username
+    if not await search.available(db):
+        raise HTTPException(
+            status_code=status.HTTP_501_NOT_IMPLEMENTED,
+            detail="Full-text search is not available for this database",
+        )
+    match = search.match_query(q)
+    if not match:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Empty search query")
+
+    with phase("search"):
+        rows = await search.search_messages(
+            db, match, username=username, model=model, role=role, session_id=session_id,
+            since=since, until=until, limit=limit + 1, offset=offset,
+        )
+    if len(rows) > limit:
+        response.headers["X-Next-Offset"] = str(offset + limit)
+    return [
+        SearchHit(
+            id=r["id"],
+            session_id=r["session_id"],
+            role=r["role"],
+            model=r["model"],
+            snippet=r["snippet"],
+            rank=r["rank"],
+            timestamp=r["timestamp"].isoformat()
+        ) for r in rows[:limit]
+    ]
 
 @router.get("/{session_id}", response_model=List[MessageInfo])
-def get_session_messages(
+async def get_session_messages(
     session_id: str,
+    response: Response,
+    after: Optional[int] = Query(None, description="Курсор: сообщения после этого id"),
+    before: Optional[int] = Query(None, description="Курсор: сообщения до этого id"),
+    latest: bool = Query(False, description="Последние `limit` сообщений"),
+    limit: int = Query(PAGE_LIMIT, ge=1, le=MAX_PAGE_LIMIT),
     username: str = Depends(get_current_username),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ) -> List[MessageInfo]:
-    """Возвращает список сообщений для указанной сессии"""
-    session = db.query(SessionModel).filter(SessionModel.session_id == session_id).first()
-    if not session:
+    """
+    Возвращает сообщения сессии в порядке записи, страницами по `limit`.
+    По умолчанию — с начала; `after`/`before` листают от курсора (id сообщения),
+    `latest=true` отдаёт последние сообщения. Курсоры соседних страниц —
+    в заголовках X-Next-Cursor / X-Prev-Cursor.
+    """
+    if after is not None and (before is not None or latest):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Use either 'after' or 'before'/'latest'")
+    session = await db.get(SessionModel, session_id)
+    pending = turn_writer.pending_messages(session_id)
+    if not session and not pending:
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Session not found"
         )
-    messages = db.query(Message).filter(Message.session_id == session_id).order_by(Message.timestamp.asc()).all()
-    return [
+    backward = before is not None or latest
+    page = limit
+    if latest:
+        # Хвост истории — ещё не записанные реплики, из БД добираем остальное
+        pending = pending[-limit:]
+        page = limit - len(pending)
+    query = select(Message).where(Message.session_id == session_id)
+    if after is not None:
+        query = query.where(Message.id > after)
+    if before is not None:
+        query = query.where(Message.id < before)
+    query = query.order_by(Message.id.desc() if backward else Message.id.asc())
+    rows = list((await db.scalars(query.limit(page + 1))).all())
+    more = len(rows) > page
+    messages = rows[:page]
+    if backward:
+        messages.reverse()
+
+    result = [
         MessageInfo(
+            id=m.id,
             role=m.role,
             model=m.model,
             content=m.content,
             timestamp=m.timestamp.isoformat()
         ) for m in messages
     ]
+    if backward:
+        if more:
+            # Страница целиком из незаписанных реплик: курсор сразу за самым новым сообщением в БД
+            response.headers["X-Prev-Cursor"] = str(messages[0].id if messages else rows[0].id + 1)
+        if before is not None and messages:
+            response.headers["X-Next-Cursor"] = str(messages[-1].id)
+    elif messages:
+        if more:
+            response.headers["X-Next-Cursor"] = str(messages[-1].id)
+        if after is not None:
+            response.headers["X-Prev-Cursor"] = str(messages[0].id)
+    # Ещё не записанные реплики идут в конце истории
+    if latest or (before is None and not more):
+        result += [
+            MessageInfo(
+                role=m["role"],
+                model=m["model"],
+                content=m["content"],
+                timestamp=m["timestamp"].isoformat()
+            ) for m in pending
+        ]
+    return result
 
 @router.delete("/{session_id}")
-def delete_session(
+async def delete_session(
     session_id: str,
     username: str = Depends(get_current_username),
-    db: Session = Depends(get_db),
+    db: AsyncSession = Depends(get_db),
 ):
     """Удаляет сессию и все её сообщения"""
-    session = db.query(SessionModel).filter(SessionModel.session_id == session_id).first()
-    if not session:
+    session = await db.get(SessionModel, session_id)
+    if not session and not turn_writer.pending_messages(session_id):
         raise HTTPException(
             status_code=status.HTTP_404_NOT_FOUND,
             detail="Session not found"
         )
+    # Отменить реплики, ещё стоящие в очереди записи
+    turn_writer.discard(session_id)
     # Удалить сообщения
-    db.query(Message).filter(Message.session_id == session_id).delete()
+    await db.execute(delete(Message).where(Message.session_id == session_id))
     # Удалить саму сессию
-    db.delete(session)
-    db.commit()
+    if session:
+        await db.delete(session)
+    await db.commit()
+    context_cache.invalidate(session_id)
     return {"message": f"Session '{session_id}' and its messages have been deleted."}
@@ -2,10 +2,12 @@
 """
 Эндпоинты для управления моделями Ollama:
 - Список доступных и установленных моделей
-- Установка модели
+- Установка модели (фоновые задания с прогрессом)
 - Удаление модели
 """
+import json
 from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi.responses import StreamingResponse
 from typing import List, Dict
 
 from app.routers.auth import get_current_username
@@ -13,9 +15,9 @@ from app.utils.ollama import (
     list_remote_base_models,
     list_model_variants,
     list_installed_models,
-    install_model,
     remove_model,
 )
+from app.utils.jobs import FINISHED, pull_jobs
 
 router = APIRouter()
 
@@ -23,8 +25,8 @@ router = APIRouter()
 async def get_models(username: str = Depends(get_current_username)) -> Dict[str, List[str]]:
     """Возвращает списки доступных и локально установленных моделей"""
     try:
-        available = list_remote_base_models()
-        installed = list_installed_models()
+        available = await list_remote_base_models()
+        installed = await list_installed_models()
         return {"available": available, "installed": installed}
     except RuntimeError as e:
         raise HTTPException(
@@ -37,7 +39,7 @@ async def get_models(username: str = Depends(get_current_username)) -> Dict[str,
 async def available_models(username: str = Depends(get_current_username)) -> List[str]:
     """Список моделей, доступных для установки (без вариантов)."""
     try:
-        return list_remote_base_models()
+        return await list_remote_base_models()
     except RuntimeError as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -49,7 +51,7 @@ async def available_models(username: str = Depends(get_current_username)) -> Lis
 async def installed_models(username: str = Depends(get_current_username)) -> List[str]:
     """Список локально установленных моделей."""
     try:
-        return list_installed_models()
+        return await list_installed_models()
     except RuntimeError as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
@@ -61,30 +63,76 @@ async def installed_models(username: str = Depends(get_current_username)) -> Lis
 async def model_variants(name: str, username: str = Depends(get_current_username)) -> List[str]:
     """Вариации указанной модели с параметрами."""
     try:
-        return list_model_variants(name)
+        return await list_model_variants(name)
     except RuntimeError as e:
         raise HTTPException(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail=str(e)
         )
 
-@router.post("/{name}/install")
-async def install(name: str, username: str = Depends(get_current_username)) -> Dict[str, str]:
-    """Устанавливает модель по её имени из публичного реестра"""
+async def _get_job(job_id: str) -> Dict:
+    job = await pull_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job
+
+
+@router.get("/jobs", response_model=List[Dict])
+async def list_jobs(username: str = Depends(get_current_username)) -> List[Dict]:
+    """Задания на установку моделей (всех воркеров), новые первыми."""
+    return await pull_jobs.jobs()
+
+
+@router.get("/jobs/{job_id}")
+async def get_job(job_id: str, username: str = Depends(get_current_username)) -> Dict:
+    """Состояние и прогресс задания."""
+    return await _get_job(job_id)
+
+
+@router.get("/jobs/{job_id}/events")
+async def job_events(job_id: str, username: str = Depends(get_current_username)):
+    """Прогресс задания потоком Server-Sent Events до его завершения."""
+    await _get_job(job_id)
+
+    async def events():
+        async for snapshot in pull_jobs.updates(job_id):
+            event = "done" if snapshot["status"] in FINISHED else "progress"
+            yield f"event: {event}\ndata: {json.dumps(snapshot)}\n\n"
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+@router.delete("/jobs/{job_id}")
+async def cancel_job(job_id: str, username: str = Depends(get_current_username)) -> Dict:
+    """Отменяет задание в очереди или прерывает загрузку (в любом воркере)."""
+    await _get_job(job_id)
+    return await pull_jobs.cancel(job_id)
+
+
+@router.post("/{name}/install", status_code=status.HTTP_202_ACCEPTED)
+async def install(name: str, username: str = Depends(get_current_username)) -> Dict:
+    """
+    Ставит установку модели из публичного реестра в очередь и сразу
+    возвращает задание. Повторный запрос той же модели вернёт то же задание.
+    """
     try:
-        install_model(name)
-        return {"message": f"Model '{name}' installed successfully."}
+        job = await pull_jobs.submit(name)
     except RuntimeError as e:
         raise HTTPException(
-            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
             detail=str(e)
         )
+    return {"message": f"Installation of model '{name}' started.", **job}
 
 @router.delete("/{name}")
 async def uninstall(name: str, username: str = Depends(get_current_username)) -> Dict[str, str]:
     """Удаляет локально установленную модель"""
     try:
-        remove_model(name)
+        await remove_model(name)
         return {"message": f"Model '{name}' removed successfully."}
     except RuntimeError as e:
         raise HTTPException(
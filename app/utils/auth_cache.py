@@ -0,0 +1,129 @@
+# app/utils/auth_cache.py
+"""
+Bounded TTL cache of successfully verified HTTP Basic credentials.
+
+Entries hold an HMAC of (username, password) under a per-process random key
+(plain passwords are never stored) plus the user's is_admin and daily_limit,
+so a cache hit authenticates a request without touching the database.
+
+The admin panel runs in a separate process, so invalidation is propagated
+through an epoch file (AUTH_EPOCH_PATH): invalidate() rewrites it and every
+process drops its cache when the file's identity changes.
+"""
+import hashlib
+import hmac
+import os
+import secrets
+import threading
+import time
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from dotenv import load_dotenv
+
+load_dotenv()
+
+AUTH_CACHE_TTL = float(os.getenv("AUTH_CACHE_TTL", "60"))
+AUTH_CACHE_SIZE = int(os.getenv("AUTH_CACHE_SIZE", "4096"))
+AUTH_EPOCH_PATH = os.getenv("AUTH_EPOCH_PATH", os.path.join(os.getcwd(), ".auth_epoch"))
+
+
+class CachedUser:
+    """The subset of User needed on the hot path."""
+
+    __slots__ = ("username", "is_admin", "daily_limit")
+
+    def __init__(self, username: str, is_admin: bool, daily_limit: int):
+        self.username = username
+        self.is_admin = bool(is_admin)
+        self.daily_limit = daily_limit
+
+
+class CredentialCache:
+    def __init__(
+        self,
+        ttl: float = AUTH_CACHE_TTL,
+        max_size: int = AUTH_CACHE_SIZE,
+        epoch_path: Optional[str] = AUTH_EPOCH_PATH,
+    ):
+        self.ttl = ttl
+        self.max_size = max_size
+        self.epoch_path = epoch_path
+        self._key = secrets.token_bytes(32)
+        self._entries: "OrderedDict[str, Tuple[bytes, CachedUser, float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._epoch = self._read_epoch()
+
+    def _digest(self, username: str, password: str) -> bytes:
+        msg = username.encode() + b"\x00" + password.encode()
+        return hmac.new(self._key, msg, hashlib.sha256).digest()
+
+    def _read_epoch(self) -> Optional[Tuple[int, int]]:
+        if not self.epoch_path:
+            return None
+        try:
+            st = os.stat(self.epoch_path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_mtime_ns
+
+    def _check_epoch(self) -> None:
+        epoch = self._read_epoch()
+        if epoch != self._epoch:
+            with self._lock:
+                self._entries.clear()
+                self._epoch = epoch
+
+    def get(self, username: str, password: str) -> Optional[CachedUser]:
+        """Return the cached user if these exact credentials were verified recently."""
+        if self.ttl <= 0:
+            return None
+        self._check_epoch()
+        digest = self._digest(username, password)
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None:
+                return None
+            cached_digest, user, expires = entry
+            if expires < now:
+                del self._entries[username]
+                return None
+            if not hmac.compare_digest(cached_digest, digest):
+                return None
+            self._entries.move_to_end(username)
+            return user
+
+    def put(self, username: str, password: str, user: CachedUser) -> None:
+        if self.ttl <= 0:
+            return
+        entry = (self._digest(username, password), user, time.monotonic() + self.ttl)
+        with self._lock:
+            self._entries[username] = entry
+            self._entries.move_to_end(username)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, username: Optional[str] = None) -> None:
+        """
+        Drop one user (or everyone) here and bump the shared epoch so that
+        other processes drop their caches too.
+        """
+        with self._lock:
+            if username is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(username, None)
+        if self.epoch_path:
+            tmp = f"{self.epoch_path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp, "w") as f:
+                    f.write(secrets.token_hex(8))
+                os.replace(tmp, self.epoch_path)
+            except OSError:
+                pass
+            with self._lock:
+                self._epoch = self._read_epoch()
+
+
+credential_cache = CredentialCache()
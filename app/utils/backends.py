@@ -0,0 +1,730 @@
+# app/utils/backends.py
+"""
+Pluggable inference backends for chatting with Ollama models.
+
+- HTTPBackend talks to the Ollama REST API (/api/chat, /api/generate)
+  over a persistent keep-alive connection pool.
+- CLIBackend runs `ollama run <model> <prompt>` as a subprocess and is kept
+  as a fallback for hosts without a reachable HTTP API.
+
+All backend calls are coroutines, so a slow generation never blocks the
+event loop. The backend is selected by OLLAMA_BACKEND in .env ("http" or "cli");
+with OLLAMA_HOSTS set, requests are spread over several Ollama hosts
+(PoolBackend, app.utils.pool).
+"""
+import asyncio
+import codecs
+import json
+import os
+import re
+import threading
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+import anyio
+from dotenv import load_dotenv
+
+from app.utils import metrics
+from app.utils.concurrency import run_command
+
+# Optional import for the HTTP backend
+try:
+    import httpx
+except ImportError:
+    httpx = None
+
+load_dotenv()
+
+OLLAMA_CMD = "ollama"
+OLLAMA_BACKEND = os.getenv("OLLAMA_BACKEND", "http").lower()
+OLLAMA_HOST = os.getenv("OLLAMA_HOST", "http://127.0.0.1:11434").rstrip("/")
+OLLAMA_HOSTS = [h.strip().rstrip("/") for h in os.getenv("OLLAMA_HOSTS", "").split(",") if h.strip()]
+OLLAMA_CONNECT_TIMEOUT = float(os.getenv("OLLAMA_CONNECT_TIMEOUT", "5"))
+OLLAMA_READ_TIMEOUT = float(os.getenv("OLLAMA_READ_TIMEOUT", "300"))
+OLLAMA_POOL_SIZE = int(os.getenv("OLLAMA_POOL_SIZE", "20"))
+OLLAMA_CLI_FALLBACK = os.getenv("OLLAMA_CLI_FALLBACK", "1") not in ("0", "false", "no")
+
+# keep_alive для запросов к модели: None — значение по умолчанию сервера Ollama
+KeepAlivePolicy = Callable[[str], Optional[str]]
+_keep_alive: KeepAlivePolicy = lambda model: None
+
+
+def set_keep_alive_policy(policy: Optional[KeepAlivePolicy]) -> None:
+    """Choose the keep_alive sent with every HTTP request for a model (see app.utils.residency)."""
+    global _keep_alive
+    _keep_alive = policy or (lambda model: None)
+
+
+def _with_keep_alive(body: dict) -> dict:
+    keep_alive = _keep_alive(body["model"])
+    if keep_alive is not None:
+        body["keep_alive"] = keep_alive
+    return body
+
+
+def build_options(
+    temperature: Optional[float] = None,
+    max_tokens: Optional[int] = None,
+) -> Dict[str, float]:
+    """Translate proxy parameters into the Ollama `options` object."""
+    options: Dict[str, float] = {}
+    if temperature is not None:
+        options["temperature"] = temperature
+    if max_tokens is not None:
+        options["num_predict"] = max_tokens
+    return options
+
+
+def _decode_output(raw: bytes) -> str:
+    """Decode CLI output: UTF-8 first, then the Windows console code pages."""
+    for enc in ("utf-8", "cp866", "cp1251"):
+        try:
+            return raw.decode(enc)
+        except UnicodeDecodeError:
+            continue
+    return raw.decode("utf-8", errors="ignore")
+
+
+class BackendUnavailable(RuntimeError):
+    """The Ollama host could not be reached; the request was not processed."""
+
+
+class TokenStream:
+    """
+    Async iterator over generated tokens that can be cancelled.
+    Cancelling closes the upstream connection (or kills the CLI process),
+    which makes Ollama stop the generation.
+    """
+
+    def __init__(self, chunks: AsyncIterator[str], on_cancel: Callable[[], Awaitable[None]]):
+        self._chunks = chunks
+        self._on_cancel = on_cancel
+        self.cancelled = False
+
+    def __aiter__(self) -> "TokenStream":
+        return self
+
+    async def __anext__(self) -> str:
+        if self.cancelled:
+            raise StopAsyncIteration
+        try:
+            return await self._chunks.__anext__()
+        except StopAsyncIteration:
+            raise
+        except Exception:
+            # Обрыв соединения после cancel() — штатное завершение
+            if self.cancelled:
+                raise StopAsyncIteration
+            raise
+
+    async def cancel(self) -> None:
+        if self.cancelled:
+            return
+        self.cancelled = True
+        # Вызывается и из уже отменённой задачи (клиент отключился)
+        with anyio.CancelScope(shield=True):
+            try:
+                await self._on_cancel()
+            except Exception:
+                pass
+
+
+class ModelInfo:
+    """An installed model as reported by Ollama."""
+
+    __slots__ = ("name", "size", "digest", "modified")
+
+    def __init__(self, name: str, size: int = 0, digest: str = "", modified: str = ""):
+        self.name = name
+        self.size = size
+        self.digest = digest
+        self.modified = modified
+
+    def as_dict(self) -> Dict[str, object]:
+        return {"name": self.name, "size": self.size, "digest": self.digest, "modified": self.modified}
+
+
+_SIZE_UNITS = {"B": 1, "KB": 1000, "MB": 1000 ** 2, "GB": 1000 ** 3, "TB": 1000 ** 4}
+
+
+def _parse_size(text: str) -> int:
+    """'4.7 GB' -> 4700000000 (as printed by `ollama list`)."""
+    try:
+        number, unit = text.split()
+        return int(float(number) * _SIZE_UNITS[unit.upper()])
+    except (ValueError, KeyError):
+        return 0
+
+
+_PROGRESS_RE = re.compile(r"([\d.]+ [KMGT]?B)\s*/\s*([\d.]+ [KMGT]?B)")
+
+
+def parse_pull_line(line: str) -> Dict[str, object]:
+    """Turn a line of `ollama pull` output into a progress event."""
+    event: Dict[str, object] = {"status": line.split("  ")[0].strip()}
+    match = _PROGRESS_RE.search(line)
+    if match:
+        event["digest"] = event["status"]
+        event["completed"] = _parse_size(match.group(1))
+        event["total"] = _parse_size(match.group(2))
+    return event
+
+
+def parse_ollama_list(output: str) -> List[ModelInfo]:
+    """Parse the NAME / ID / SIZE / MODIFIED table printed by `ollama list`."""
+    models: List[ModelInfo] = []
+    for line in output.splitlines():
+        parts = line.strip().split()
+        if not parts or parts[0].lower() == "name":
+            continue
+        models.append(ModelInfo(
+            name=parts[0],
+            digest=parts[1] if len(parts) > 1 else "",
+            size=_parse_size(" ".join(parts[2:4])) if len(parts) > 3 else 0,
+            modified=" ".join(parts[4:]),
+        ))
+    return models
+
+
+class InferenceBackend:
+    """Base interface for inference backends."""
+
+    name = "base"
+
+    async def chat(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> str:
+        raise NotImplementedError
+
+    async def generate(
+        self,
+        model: str,
+        prompt: str,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> str:
+        raise NotImplementedError
+
+    async def stream_chat(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> TokenStream:
+        raise NotImplementedError
+
+    async def list_models(self) -> List[ModelInfo]:
+        """Models installed on the Ollama host."""
+        raise NotImplementedError
+
+    def pull(self, model: str) -> AsyncIterator[Dict[str, object]]:
+        """
+        Download a model. Yields Ollama-style progress events:
+        {"status", "digest"?, "total"?, "completed"?}.
+        """
+        raise NotImplementedError
+
+    async def remove(self, model: str) -> None:
+        """Delete an installed model."""
+        raise NotImplementedError
+
+    async def running_models(self) -> List[str]:
+        """Models currently loaded in memory (`/api/ps`)."""
+        raise NotImplementedError
+
+    async def resident_models(self) -> List[Dict[str, object]]:
+        """Loaded models with their memory use: {"name", "size", "size_vram", "expires_at"}."""
+        return [{"name": name} for name in await self.running_models()]
+
+    async def load(self, model: str, keep_alive: Optional[str] = None) -> float:
+        """Load a model into memory (or extend its keep_alive); returns the load time in seconds."""
+        raise NotImplementedError
+
+    async def unload(self, model: str) -> None:
+        """Free the memory of a loaded model."""
+        raise NotImplementedError
+
+    async def aclose(self) -> None:
+        pass
+
+
+class CLIBackend(InferenceBackend):
+    """Runs `ollama run` for every request (one process per completion)."""
+
+    name = "cli"
+
+    def __init__(self, cmd: str = OLLAMA_CMD, timeout: float = OLLAMA_READ_TIMEOUT):
+        self.cmd = cmd
+        self.timeout = timeout
+
+    def _command(
+        self,
+        model: str,
+        prompt: str,
+        temperature: Optional[float],
+        max_tokens: Optional[int],
+    ) -> List[str]:
+        # Формируем команду: ollama run <model> <prompt> [--temperature X] [--max-tokens Y]
+        cmd = [self.cmd, "run", model, prompt]
+        if temperature is not None:
+            cmd.extend(["--temperature", str(temperature)])
+        if max_tokens is not None:
+            cmd.extend(["--max-tokens", str(max_tokens)])
+        return cmd
+
+    async def generate(
+        self,
+        model: str,
+        prompt: str,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> str:
+        cmd = self._command(model, prompt, temperature, max_tokens)
+        try:
+            returncode, out, err = await run_command(cmd, timeout=self.timeout)
+        except RuntimeError as e:
+            raise RuntimeError(f"Error during chat with model '{model}': {e}")
+        if returncode != 0:
+            raise RuntimeError(
+                f"Error during chat with model '{model}': {_decode_output(err).strip()}"
+            )
+        return _decode_output(out).strip()
+
+    async def chat(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> str:
+        # CLI не принимает историю, отправляем только последнее сообщение
+        prompt = messages[-1]["content"] if messages else ""
+        return await self.generate(model, prompt, temperature, max_tokens)
+
+    async def stream_chat(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> TokenStream:
+        prompt = messages[-1]["content"] if messages else ""
+        cmd = self._command(model, prompt, temperature, max_tokens)
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+            )
+        except FileNotFoundError:
+            raise RuntimeError(f"Error during chat with model '{model}': '{self.cmd}' not found")
+        except NotImplementedError:
+            # Цикл событий без поддержки подпроцессов: отдаём ответ одним куском
+            text = await self.generate(model, prompt, temperature, max_tokens)
+            return TokenStream(_single(text), _noop)
+
+        async def chunks() -> AsyncIterator[str]:
+            decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+            try:
+                while True:
+                    raw = await asyncio.wait_for(proc.stdout.read(4096), self.timeout)
+                    if not raw:
+                        break
+                    text = decoder.decode(raw)
+                    if text:
+                        yield text
+                if await proc.wait() != 0:
+                    err = _decode_output(await proc.stderr.read())
+                    raise RuntimeError(f"Error during chat with model '{model}': {err.strip()}")
+            except asyncio.TimeoutError:
+                raise RuntimeError(
+                    f"Error during chat with model '{model}': timed out after {self.timeout:g}s"
+                )
+            finally:
+                if proc.returncode is None:
+                    proc.kill()
+
+        async def kill() -> None:
+            if proc.returncode is None:
+                proc.kill()
+
+        return TokenStream(chunks(), kill)
+
+    async def list_models(self) -> List[ModelInfo]:
+        returncode, out, err = await run_command([self.cmd, "list"], timeout=60)
+        if returncode != 0:
+            raise RuntimeError(f"Error listing installed models: {_decode_output(err).strip()}")
+        return parse_ollama_list(_decode_output(out))
+
+    async def pull(self, model: str) -> AsyncIterator[Dict[str, object]]:
+        try:
+            proc = await asyncio.create_subprocess_exec(
+                self.cmd, "pull", model,
+                stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.STDOUT,
+            )
+        except FileNotFoundError:
+            raise RuntimeError(f"Error installing model '{model}': '{self.cmd}' not found")
+        decoder = codecs.getincrementaldecoder("utf-8")(errors="ignore")
+        buffer, last = "", ""
+        try:
+            while True:
+                raw = await proc.stdout.read(4096)
+                if not raw:
+                    break
+                # Прогресс-бар перерисовывается через \r, строки — через \n
+                buffer += decoder.decode(raw)
+                *lines, buffer = re.split(r"[\r\n]", buffer)
+                for line in lines:
+                    line = re.sub(r"\x1b\[[0-9;?]*[A-Za-z]", "", line).strip()
+                    if line:
+                        last = line
+                        yield parse_pull_line(line)
+            if await proc.wait() != 0:
+                raise RuntimeError(f"Error installing model '{model}': {last}")
+            yield {"status": "success"}
+        finally:
+            if proc.returncode is None:
+                proc.kill()
+
+    async def remove(self, model: str) -> None:
+        # Короткий алиас, затем полная форма команды
+        returncode, _, _ = await run_command([self.cmd, "rm", model], timeout=60)
+        if returncode != 0:
+            returncode, _, err = await run_command([self.cmd, "remove", model], timeout=60)
+            if returncode != 0:
+                raise RuntimeError(f"Error removing model '{model}': {_decode_output(err).strip()}")
+
+    async def running_models(self) -> List[str]:
+        returncode, out, err = await run_command([self.cmd, "ps"], timeout=60)
+        if returncode != 0:
+            raise RuntimeError(f"Error listing running models: {_decode_output(err).strip()}")
+        return [m.name for m in parse_ollama_list(_decode_output(out))]
+
+    async def unload(self, model: str) -> None:
+        returncode, _, err = await run_command([self.cmd, "stop", model], timeout=60)
+        if returncode != 0:
+            raise RuntimeError(f"Error unloading model '{model}': {_decode_output(err).strip()}")
+
+
+async def _single(text: str) -> AsyncIterator[str]:
+    yield text
+
+
+async def _noop() -> None:
+    pass
+
+
+class HTTPBackend(InferenceBackend):
+    """Talks to the Ollama REST API over a pooled keep-alive client."""
+
+    name = "http"
+
+    def __init__(
+        self,
+        host: str = OLLAMA_HOST,
+        connect_timeout: float = OLLAMA_CONNECT_TIMEOUT,
+        read_timeout: float = OLLAMA_READ_TIMEOUT,
+        pool_size: int = OLLAMA_POOL_SIZE,
+        fallback: Optional[InferenceBackend] = None,
+    ):
+        if httpx is None:
+            raise RuntimeError("Missing dependency for the HTTP backend: httpx")
+        self.host = host.rstrip("/")
+        self.fallback = fallback
+        self.client = httpx.AsyncClient(
+            base_url=self.host,
+            timeout=httpx.Timeout(read_timeout, connect=connect_timeout),
+            limits=httpx.Limits(
+                max_connections=pool_size,
+                max_keepalive_connections=pool_size,
+            ),
+        )
+
+    @staticmethod
+    def _error_text(resp) -> str:
+        try:
+            return resp.json().get("error", resp.text)
+        except ValueError:
+            return resp.text
+
+    async def _post(self, path: str, body: dict) -> dict:
+        return await self._request("POST", path, json=body)
+
+    async def _request(self, method: str, path: str, **kwargs) -> dict:
+        try:
+            resp = await self.client.request(method, path, **kwargs)
+        except httpx.TimeoutException as e:
+            metrics.BACKEND_ERRORS.labels("http", "timeout").inc()
+            raise RuntimeError(f"Ollama request {path} timed out: {e}")
+        except httpx.TransportError as e:
+            metrics.BACKEND_ERRORS.labels("http", "unreachable").inc()
+            raise ConnectionError(f"Ollama is unreachable at {self.host}: {e}")
+        if resp.status_code != 200:
+            metrics.BACKEND_ERRORS.labels("http", "status").inc()
+            raise RuntimeError(
+                f"Ollama request {path} failed ({resp.status_code}): {self._error_text(resp)}"
+            )
+        return resp.json()
+
+    async def _stream(self, path: str, body: dict):
+        """Open a streaming POST; the caller owns (and must close) the response."""
+        request = self.client.build_request("POST", path, json=body)
+        try:
+            resp = await self.client.send(request, stream=True)
+        except httpx.TimeoutException as e:
+            metrics.BACKEND_ERRORS.labels("http", "timeout").inc()
+            raise RuntimeError(f"Ollama request {path} timed out: {e}")
+        except httpx.TransportError as e:
+            metrics.BACKEND_ERRORS.labels("http", "unreachable").inc()
+            raise ConnectionError(f"Ollama is unreachable at {self.host}: {e}")
+        if resp.status_code != 200:
+            metrics.BACKEND_ERRORS.labels("http", "status").inc()
+            await resp.aread()
+            await resp.aclose()
+            raise RuntimeError(
+                f"Ollama request {path} failed ({resp.status_code}): {self._error_text(resp)}"
+            )
+        return resp
+
+    @staticmethod
+    async def _iter_ndjson(resp, field: str) -> AsyncIterator[str]:
+        """Yield token text from an Ollama NDJSON stream."""
+        try:
+            async for line in resp.aiter_lines():
+                if not line:
+                    continue
+                data = json.loads(line)
+                if data.get("error"):
+                    metrics.BACKEND_ERRORS.labels("http", "stream").inc()
+                    raise RuntimeError(f"Ollama stream error: {data['error']}")
+                if field == "message":
+                    token = data.get("message", {}).get("content", "")
+                else:
+                    token = data.get(field, "")
+                if token:
+                    yield token
+                if data.get("done"):
+                    break
+        except httpx.TimeoutException as e:
+            metrics.BACKEND_ERRORS.labels("http", "timeout").inc()
+            raise RuntimeError(f"Ollama stream timed out: {e}")
+        except httpx.TransportError as e:
+            # Соединение оборвалось посреди ответа — на другой хост уже не переключиться
+            metrics.BACKEND_ERRORS.labels("http", "stream").inc()
+            raise RuntimeError(f"Ollama stream interrupted: {e}")
+        except ValueError as e:
+            metrics.BACKEND_ERRORS.labels("http", "stream").inc()
+            raise RuntimeError(f"Ollama stream returned invalid JSON: {e}")
+        finally:
+            with anyio.CancelScope(shield=True):
+                await resp.aclose()
+
+    async def chat(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> str:
+        body = {
+            "model": model,
+            "messages": messages,
+            "stream": False,
+            "options": build_options(temperature, max_tokens),
+        }
+        _with_keep_alive(body)
+        try:
+            data = await self._post("/api/chat", body)
+        except ConnectionError:
+            if self.fallback is None:
+                raise BackendUnavailable(f"Error during chat with model '{model}': Ollama is unreachable")
+            return await self.fallback.chat(model, messages, temperature, max_tokens)
+        return data.get("message", {}).get("content", "").strip()
+
+    async def generate(
+        self,
+        model: str,
+        prompt: str,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> str:
+        body = {
+            "model": model,
+            "prompt": prompt,
+            "stream": False,
+            "options": build_options(temperature, max_tokens),
+        }
+        _with_keep_alive(body)
+        try:
+            data = await self._post("/api/generate", body)
+        except ConnectionError:
+            if self.fallback is None:
+                raise BackendUnavailable(f"Error during chat with model '{model}': Ollama is unreachable")
+            return await self.fallback.generate(model, prompt, temperature, max_tokens)
+        return data.get("response", "").strip()
+
+    async def stream_chat(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> TokenStream:
+        body = {
+            "model": model,
+            "messages": messages,
+            "stream": True,
+            "options": build_options(temperature, max_tokens),
+        }
+        _with_keep_alive(body)
+        try:
+            resp = await self._stream("/api/chat", body)
+        except ConnectionError:
+            if self.fallback is None:
+                raise BackendUnavailable(f"Error during chat with model '{model}': Ollama is unreachable")
+            return await self.fallback.stream_chat(model, messages, temperature, max_tokens)
+        return TokenStream(self._iter_ndjson(resp, "message"), resp.aclose)
+
+    async def list_models(self) -> List[ModelInfo]:
+        try:
+            data = await self._request("GET", "/api/tags")
+        except ConnectionError:
+            if self.fallback is None:
+                raise BackendUnavailable("Error listing installed models: Ollama is unreachable")
+            return await self.fallback.list_models()
+        return [
+            ModelInfo(
+                name=m.get("name", ""),
+                size=m.get("size", 0),
+                digest=m.get("digest", ""),
+                modified=m.get("modified_at", ""),
+            )
+            for m in data.get("models", [])
+        ]
+
+    async def pull(self, model: str) -> AsyncIterator[Dict[str, object]]:
+        try:
+            resp = await self._stream("/api/pull", {"model": model, "stream": True})
+        except ConnectionError:
+            if self.fallback is None:
+                raise BackendUnavailable(f"Error installing model '{model}': Ollama is unreachable")
+            async for event in self.fallback.pull(model):
+                yield event
+            return
+        try:
+            async for line in resp.aiter_lines():
+                if not line:
+                    continue
+                event = json.loads(line)
+                if event.get("error"):
+                    raise RuntimeError(f"Error installing model '{model}': {event['error']}")
+                yield event
+        except httpx.TimeoutException as e:
+            raise RuntimeError(f"Error installing model '{model}': timed out: {e}")
+        finally:
+            with anyio.CancelScope(shield=True):
+                await resp.aclose()
+
+    async def remove(self, model: str) -> None:
+        try:
+            await self._request("DELETE", "/api/delete", json={"model": model})
+        except ConnectionError:
+            if self.fallback is None:
+                raise BackendUnavailable(f"Error removing model '{model}': Ollama is unreachable")
+            await self.fallback.remove(model)
+        except RuntimeError as e:
+            raise RuntimeError(f"Error removing model '{model}': {e}")
+
+    async def running_models(self) -> List[str]:
+        try:
+            data = await self._request("GET", "/api/ps")
+        except ConnectionError:
+            raise BackendUnavailable("Error listing running models: Ollama is unreachable")
+        return [m.get("name", "") for m in data.get("models", [])]
+
+    async def resident_models(self) -> List[Dict[str, object]]:
+        try:
+            data = await self._request("GET", "/api/ps")
+        except ConnectionError:
+            raise BackendUnavailable("Error listing running models: Ollama is unreachable")
+        return [
+            {
+                "name": m.get("name", ""),
+                "size": m.get("size", 0),
+                "size_vram": m.get("size_vram", 0),
+                "expires_at": m.get("expires_at", ""),
+            }
+            for m in data.get("models", [])
+        ]
+
+    async def load(self, model: str, keep_alive: Optional[str] = None) -> float:
+        # Запрос без промпта только загружает модель
+        body = {"model": model, "stream": False}
+        if keep_alive is not None:
+            body["keep_alive"] = keep_alive
+        started = time.perf_counter()
+        try:
+            data = await self._post("/api/generate", body)
+        except ConnectionError:
+            raise BackendUnavailable(f"Error loading model '{model}': Ollama is unreachable")
+        except RuntimeError as e:
+            raise RuntimeError(f"Error loading model '{model}': {e}")
+        if data.get("load_duration") is not None:
+            return data["load_duration"] / 1e9
+        return time.perf_counter() - started
+
+    async def unload(self, model: str) -> None:
+        try:
+            await self._post("/api/generate", {"model": model, "keep_alive": 0, "stream": False})
+        except ConnectionError:
+            raise BackendUnavailable(f"Error unloading model '{model}': Ollama is unreachable")
+        except RuntimeError as e:
+            raise RuntimeError(f"Error unloading model '{model}': {e}")
+
+    async def aclose(self) -> None:
+        await self.client.aclose()
+
+
+_backend: Optional[InferenceBackend] = None
+_backend_lock = threading.Lock()
+
+
+def create_backend(kind: str = OLLAMA_BACKEND) -> InferenceBackend:
+    """Build a backend by name ("http" or "cli"); "http" with OLLAMA_HOSTS builds a pool."""
+    if kind == "http" and OLLAMA_HOSTS:
+        from app.utils.pool import PoolBackend
+        return PoolBackend(OLLAMA_HOSTS)
+    if kind == "cli":
+        return CLIBackend()
+    if kind == "http":
+        fallback = CLIBackend() if OLLAMA_CLI_FALLBACK else None
+        return HTTPBackend(fallback=fallback)
+    raise RuntimeError(f"Unknown OLLAMA_BACKEND '{kind}', expected 'http' or 'cli'")
+
+
+def get_backend() -> InferenceBackend:
+    """Return the process-wide backend, creating it on first use."""
+    global _backend
+    if _backend is None:
+        with _backend_lock:
+            if _backend is None:
+                _backend = create_backend()
+    return _backend
+
+
+def set_backend(backend: Optional[InferenceBackend]) -> Optional[InferenceBackend]:
+    """Replace the process-wide backend; returns the previous one for the caller to close."""
+    global _backend
+    with _backend_lock:
+        previous, _backend = _backend, backend
+    return previous
+
+
+async def close_backend() -> None:
+    """Close the process-wide backend (called on application shutdown)."""
+    previous = set_backend(None)
+    if previous is not None:
+        await previous.aclose()
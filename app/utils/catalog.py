@@ -0,0 +1,274 @@
+# app/utils/catalog.py
+"""
+Cached catalog of models available from the Ollama library (ollama.com).
+
+The catalog is kept in memory and mirrored to a JSON file
+(CATALOG_CACHE_PATH) so it survives restarts. Reads never wait on the
+network once the catalog is populated: stale data is served while a
+background task refreshes it every CATALOG_TTL seconds. Refreshes use
+conditional requests (ETag / Last-Modified), and variant pages are fetched
+concurrently, at most CATALOG_CONCURRENCY at a time. A variant page that
+could not be fetched is not cached: it is retried after
+CATALOG_FAILURE_TTL seconds.
+
+Parsing is split into pure functions (parse_base_models, parse_variants) and
+the HTTP transport can be injected, so the scraper can be exercised against
+saved HTML pages.
+"""
+import asyncio
+import json
+import logging
+import os
+import re
+import time
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+# Optional imports for remote model listing
+try:
+    import httpx
+    from bs4 import BeautifulSoup
+except ImportError:
+    httpx = None
+    BeautifulSoup = None
+
+from app.utils.concurrency import run_blocking
+
+load_dotenv()
+
+LIBRARY_URL = "https://ollama.com/library"
+CATALOG_CACHE_PATH = os.getenv("CATALOG_CACHE_PATH", os.path.join(os.getcwd(), "catalog_cache.json"))
+CATALOG_TTL = float(os.getenv("CATALOG_TTL", "3600"))
+CATALOG_CONCURRENCY = int(os.getenv("CATALOG_CONCURRENCY", "8"))
+CATALOG_TIMEOUT = float(os.getenv("CATALOG_TIMEOUT", "30"))
+CATALOG_FAILURE_TTL = float(os.getenv("CATALOG_FAILURE_TTL", "60"))
+
+logger = logging.getLogger(__name__)
+
+
+def parse_base_models(html: str) -> List[str]:
+    """Extract base model names from the library index page."""
+    soup = BeautifulSoup(html, "html.parser")
+
+    base_models: List[str] = []
+    for a in soup.find_all("a", href=True):
+        href = a["href"]
+
+        if href.startswith("/library/") and ":" not in href:
+
+            name = href.split("/")[-1]
+            if name and name not in base_models:
+                base_models.append(name)
+
+    return base_models
+
+
+def parse_variants(name: str, html: str) -> List[str]:
+    """Extract `name:tag` variants from a model page."""
+    pattern = rf"{re.escape(name)}:[^\"'\s<]+"
+    matches = set(re.findall(pattern, html, flags=re.IGNORECASE))
+    return sorted(matches)
+
+
+class ModelCatalog:
+    def __init__(
+        self,
+        path: Optional[str] = CATALOG_CACHE_PATH,
+        ttl: float = CATALOG_TTL,
+        concurrency: int = CATALOG_CONCURRENCY,
+        base_url: str = LIBRARY_URL,
+        transport=None,
+        failure_ttl: float = CATALOG_FAILURE_TTL,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.failure_ttl = failure_ttl
+        self.concurrency = concurrency
+        self.base_url = base_url
+        self.transport = transport
+        self.base: List[str] = []
+        self.variants: Dict[str, List[str]] = {}
+        self.fetched_at: Dict[str, float] = {}
+        self.validators: Dict[str, Dict[str, str]] = {}
+        # Неудачные загрузки страниц вариантов: не кэшируются, повтор через failure_ttl
+        self.failed_at: Dict[str, float] = {}
+        self._index_lock = asyncio.Lock()
+        self._refresh_task: Optional[asyncio.Task] = None
+        self._loop_task: Optional[asyncio.Task] = None
+
+    # ---- persistence -------------------------------------------------------
+    def load(self) -> None:
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            logger.warning("Ignoring unreadable catalog cache %s", self.path)
+            return
+        self.base = data.get("base", [])
+        self.variants = data.get("variants", {})
+        self.fetched_at = data.get("fetched_at", {})
+        self.validators = data.get("validators", {})
+
+    def save(self) -> None:
+        if not self.path:
+            return
+        data = {
+            "base": self.base,
+            "variants": self.variants,
+            "fetched_at": self.fetched_at,
+            "validators": self.validators,
+        }
+        tmp = f"{self.path}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.path)
+        except OSError:
+            logger.warning("Could not write catalog cache %s", self.path)
+
+    # ---- fetching ----------------------------------------------------------
+    def _client(self):
+        if not httpx or not BeautifulSoup:
+            raise RuntimeError(
+                "Missing dependencies for remote model listing: httpx, beautifulsoup4"
+            )
+        return httpx.AsyncClient(
+            timeout=CATALOG_TIMEOUT,
+            transport=self.transport,
+            limits=httpx.Limits(max_connections=self.concurrency),
+            follow_redirects=True,
+        )
+
+    async def _fetch(self, client, url: str) -> Optional[str]:
+        """GET with conditional headers. Returns the body, or None when unchanged (304)."""
+        headers = {}
+        validator = self.validators.get(url, {})
+        if validator.get("etag"):
+            headers["If-None-Match"] = validator["etag"]
+        if validator.get("last_modified"):
+            headers["If-Modified-Since"] = validator["last_modified"]
+        resp = await client.get(url, headers=headers)
+        if resp.status_code == 304:
+            self.fetched_at[url] = time.time()
+            return None
+        if resp.status_code != 200:
+            raise RuntimeError(f"Error fetching {url}: status {resp.status_code}")
+        self.validators[url] = {
+            "etag": resp.headers.get("ETag", ""),
+            "last_modified": resp.headers.get("Last-Modified", ""),
+        }
+        self.fetched_at[url] = time.time()
+        return resp.text
+
+    async def _refresh_index(self, client) -> None:
+        try:
+            html = await self._fetch(client, self.base_url)
+        except httpx.HTTPError as e:
+            raise RuntimeError(f"Error fetching remote models page: {e}")
+        if html is not None:
+            self.base = await run_blocking(parse_base_models, html)
+
+    async def _refresh_variant(self, client, name: str, semaphore: asyncio.Semaphore) -> None:
+        async with semaphore:
+            try:
+                html = await self._fetch(client, f"{self.base_url}/{name}")
+            except (RuntimeError, httpx.HTTPError) as e:
+                # Старые данные (если есть) остаются, новых пустых не заводим
+                logger.warning("Catalog: cannot fetch variants of %s: %s", name, e)
+                self.failed_at[name] = time.time()
+                return
+        self.failed_at.pop(name, None)
+        if html is not None:
+            self.variants[name] = await run_blocking(parse_variants, name, html)
+
+    def _recently_failed(self, name: str) -> bool:
+        return time.time() - self.failed_at.get(name, 0) < self.failure_ttl
+
+    async def refresh(self) -> None:
+        """Refresh the index and every variant page (conditionally), then persist."""
+        async with self._client() as client:
+            async with self._index_lock:
+                await self._refresh_index(client)
+            semaphore = asyncio.Semaphore(self.concurrency)
+            await asyncio.gather(*(self._refresh_variant(client, n, semaphore) for n in self.base))
+        self.save()
+
+    def is_stale(self, url: Optional[str] = None) -> bool:
+        return time.time() - self.fetched_at.get(url or self.base_url, 0) > self.ttl
+
+    def _refresh_in_background(self) -> None:
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.create_task(self._safe_refresh())
+
+    async def _safe_refresh(self) -> None:
+        try:
+            await self.refresh()
+        except Exception:
+            logger.exception("Catalog refresh failed, serving cached data")
+
+    # ---- reads -------------------------------------------------------------
+    async def base_models(self) -> List[str]:
+        """Base model names; only the very first call waits for the network."""
+        if not self.base:
+            async with self._index_lock:
+                if not self.base:
+                    async with self._client() as client:
+                        await self._refresh_index(client)
+                    self.save()
+        if self.is_stale():
+            self._refresh_in_background()
+        return list(self.base)
+
+    async def model_variants(self, name: str) -> List[str]:
+        """Variants of one model; an unknown model is fetched once and cached."""
+        if name not in self.variants and not self._recently_failed(name):
+            async with self._client() as client:
+                await self._refresh_variant(client, name, asyncio.Semaphore(1))
+            self.save()
+        elif self.is_stale(f"{self.base_url}/{name}"):
+            self._refresh_in_background()
+        return list(self.variants.get(name, []))
+
+    async def all_models(self) -> List[str]:
+        """All models including variants; missing variant pages are fetched concurrently."""
+        base = await self.base_models()
+        missing = [n for n in base if n not in self.variants and not self._recently_failed(n)]
+        if missing:
+            async with self._client() as client:
+                semaphore = asyncio.Semaphore(self.concurrency)
+                await asyncio.gather(*(self._refresh_variant(client, n, semaphore) for n in missing))
+            self.save()
+        models: List[str] = []
+        for name in base:
+            models.extend(self.variants.get(name) or [name])
+        return models
+
+    # ---- lifecycle ---------------------------------------------------------
+    async def _run(self) -> None:
+        while True:
+            if self.base and self.is_stale():
+                await self._safe_refresh()
+            await asyncio.sleep(min(self.ttl, 300))
+
+    async def start(self) -> None:
+        """Load the on-disk cache and start the periodic background refresh."""
+        self.load()
+        if self._loop_task is None:
+            self._loop_task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        for task in (self._loop_task, self._refresh_task):
+            if task is not None and not task.done():
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._loop_task = None
+        self._refresh_task = None
+
+
+model_catalog = ModelCatalog()
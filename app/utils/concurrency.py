@@ -0,0 +1,76 @@
+# app/utils/concurrency.py
+"""
+Helpers for keeping blocking work off the event loop.
+
+run_blocking() runs a sync callable in a bounded thread pool
+(BLOCKING_POOL_SIZE in .env), so CPU-bound parsing or legacy sync calls
+cannot exhaust threads or freeze the loop. run_command() runs a subprocess
+asynchronously, falling back to the pool on event loops without
+subprocess support (e.g. the selector loop on Windows).
+"""
+import asyncio
+import functools
+import os
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, List, Optional, Tuple, TypeVar
+
+from dotenv import load_dotenv
+
+from app.utils import metrics
+
+load_dotenv()
+
+BLOCKING_POOL_SIZE = int(os.getenv("BLOCKING_POOL_SIZE", "8"))
+
+T = TypeVar("T")
+
+_executor = ThreadPoolExecutor(max_workers=BLOCKING_POOL_SIZE, thread_name_prefix="blocking")
+
+
+async def run_blocking(func: Callable[..., T], *args, **kwargs) -> T:
+    """Run a blocking callable in the bounded thread pool."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(_executor, functools.partial(func, *args, **kwargs))
+
+
+async def run_command(cmd: List[str], timeout: Optional[float] = None) -> Tuple[int, bytes, bytes]:
+    """
+    Run a command without blocking the loop.
+    Returns (returncode, stdout, stderr); raises RuntimeError on timeout
+    or when the executable is missing.
+    """
+    try:
+        proc = await asyncio.create_subprocess_exec(
+            *cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE
+        )
+    except NotImplementedError:
+        try:
+            result = await run_blocking(subprocess.run, cmd, capture_output=True, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            metrics.BACKEND_ERRORS.labels("subprocess", "timeout").inc()
+            raise RuntimeError(f"Command '{' '.join(cmd[:2])}' timed out after {timeout:g}s")
+        except FileNotFoundError:
+            metrics.BACKEND_ERRORS.labels("subprocess", "missing").inc()
+            raise RuntimeError(f"'{cmd[0]}' not found")
+        if result.returncode != 0:
+            metrics.BACKEND_ERRORS.labels("subprocess", "exit").inc()
+        return result.returncode, result.stdout, result.stderr
+    except FileNotFoundError:
+        metrics.BACKEND_ERRORS.labels("subprocess", "missing").inc()
+        raise RuntimeError(f"'{cmd[0]}' not found")
+
+    try:
+        out, err = await asyncio.wait_for(proc.communicate(), timeout)
+    except asyncio.TimeoutError:
+        proc.kill()
+        await proc.wait()
+        metrics.BACKEND_ERRORS.labels("subprocess", "timeout").inc()
+        raise RuntimeError(f"Command '{' '.join(cmd[:2])}' timed out after {timeout:g}s")
+    except asyncio.CancelledError:
+        if proc.returncode is None:
+            proc.kill()
+        raise
+    if proc.returncode != 0:
+        metrics.BACKEND_ERRORS.labels("subprocess", "exit").inc()
+    return proc.returncode, out, err
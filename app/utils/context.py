@@ -0,0 +1,161 @@
+# app/utils/context.py
+"""
+Windowed conversation context for multi-turn chats.
+
+Prior turns of a session are kept in a per-process LRU cache and trimmed to
+a per-model token budget before being sent to the backend. On a cache miss
+only the newest CONTEXT_MAX_TURNS rows are read from `messages`, so a long
+session costs the same per turn as a short one.
+
+Настройки (.env):
+    CONTEXT_TOKEN_BUDGET   — бюджет токенов по умолчанию
+    CONTEXT_TOKEN_BUDGETS  — бюджеты по моделям: "llama3:8192,mistral:4096"
+    CONTEXT_MAX_TURNS      — сколько последних реплик держать на сессию
+    CONTEXT_CACHE_SESSIONS — сколько сессий держать в кэше
+"""
+import os
+import threading
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, List, Optional, Sequence
+
+from dotenv import load_dotenv
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Message
+
+load_dotenv()
+
+CONTEXT_TOKEN_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "2048"))
+CONTEXT_MAX_TURNS = int(os.getenv("CONTEXT_MAX_TURNS", "64"))
+CONTEXT_CACHE_SESSIONS = int(os.getenv("CONTEXT_CACHE_SESSIONS", "1024"))
+
+
+def _parse_budgets(raw: str) -> Dict[str, int]:
+    budgets: Dict[str, int] = {}
+    for item in raw.split(","):
+        name, sep, value = item.strip().rpartition(":")
+        if sep and name and value.isdigit():
+            budgets[name] = int(value)
+    return budgets
+
+
+CONTEXT_TOKEN_BUDGETS = _parse_budgets(os.getenv("CONTEXT_TOKEN_BUDGETS", ""))
+
+
+def estimate_tokens(text: str) -> int:
+    """Cheap token estimate (~4 characters per token)."""
+    return max(1, len(text) // 4)
+
+
+def token_budget(model: str) -> int:
+    """Budget for a model: exact name first, then the base name without a tag."""
+    if model in CONTEXT_TOKEN_BUDGETS:
+        return CONTEXT_TOKEN_BUDGETS[model]
+    return CONTEXT_TOKEN_BUDGETS.get(model.split(":")[0], CONTEXT_TOKEN_BUDGET)
+
+
+class _Entry:
+    __slots__ = ("last_id", "turns")
+
+    def __init__(self, last_id: Optional[int], turns: Deque[dict]):
+        self.last_id = last_id
+        self.turns = turns
+
+
+class ContextCache:
+    """LRU cache of the most recent turns of each session."""
+
+    def __init__(self, max_sessions: int = CONTEXT_CACHE_SESSIONS, max_turns: int = CONTEXT_MAX_TURNS):
+        self.max_sessions = max_sessions
+        self.max_turns = max_turns
+        self._entries: "OrderedDict[str, _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        # Источник ещё не записанных реплик (очередь write-behind), см. app/utils/writer.py
+        self.pending_source: Optional[Callable[[str], Sequence[dict]]] = None
+
+    async def _load(self, db: AsyncSession, session_id: str) -> _Entry:
+        result = await db.execute(
+            select(Message.id, Message.role, Message.content)
+            .where(Message.session_id == session_id)
+            .order_by(Message.id.desc())
+            .limit(self.max_turns)
+        )
+        rows = result.all()
+        turns: Deque[dict] = deque(maxlen=self.max_turns)
+        for row in reversed(rows):
+            turns.append({"role": row.role, "content": row.content, "tokens": estimate_tokens(row.content)})
+        return _Entry(rows[0].id if rows else None, turns)
+
+    async def turns(self, db: AsyncSession, session_id: str) -> List[dict]:
+        """
+        Return cached turns of a session, reloading them if another process
+        wrote to the session since they were cached (checked by max(id)).
+        """
+        latest = await db.scalar(
+            select(func.max(Message.id)).where(Message.session_id == session_id)
+        )
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is not None and entry.last_id == latest:
+                self._entries.move_to_end(session_id)
+                return list(entry.turns)
+        entry = await self._load(db, session_id)
+        with self._lock:
+            self._entries[session_id] = entry
+            self._entries.move_to_end(session_id)
+            while len(self._entries) > self.max_sessions:
+                self._entries.popitem(last=False)
+        return list(entry.turns)
+
+    def append(self, session_id: str, previous_id: Optional[int], message_id: int, role: str, content: str) -> None:
+        """
+        Append a freshly written turn; sessions not in the cache load lazily.
+        `previous_id` is the session's max(id) before the write: if the cached
+        entry stopped short of it (another process wrote in between), the
+        entry is dropped and reloaded on the next read instead.
+        """
+        with self._lock:
+            entry = self._entries.get(session_id)
+            if entry is None:
+                return
+            if entry.last_id != previous_id:
+                del self._entries[session_id]
+                return
+            entry.turns.append({"role": role, "content": content, "tokens": estimate_tokens(content)})
+            entry.last_id = message_id
+
+    def invalidate(self, session_id: Optional[str] = None) -> None:
+        """Drop one session (or everything when session_id is None)."""
+        with self._lock:
+            if session_id is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(session_id, None)
+
+    async def window(self, db: AsyncSession, session_id: str, model: str, prompt: str) -> List[Dict[str, str]]:
+        """
+        Build the messages list for the backend: as many of the newest prior
+        turns (including queued, not yet committed ones) as fit into the
+        model's token budget, followed by the prompt.
+        """
+        budget = token_budget(model) - estimate_tokens(prompt)
+        turns = await self.turns(db, session_id)
+        # Без await после turns(): запись не может завершиться между двумя чтениями
+        if self.pending_source is not None:
+            turns.extend(
+                {"role": m["role"], "content": m["content"], "tokens": estimate_tokens(m["content"])}
+                for m in self.pending_source(session_id)
+            )
+        selected: List[Dict[str, str]] = []
+        for turn in reversed(turns):
+            budget -= turn["tokens"]
+            if budget < 0:
+                break
+            selected.append({"role": turn["role"], "content": turn["content"]})
+        selected.reverse()
+        selected.append({"role": "user", "content": prompt})
+        return selected
+
+
+context_cache = ContextCache()
@@ -0,0 +1,133 @@
+# app/utils/inventory.py
+"""
+In-process inventory of models installed on the Ollama host.
+
+The inventory is filled from the backend (`/api/tags`, or `ollama list` for
+the CLI backend) and then kept current by install_model / remove_model. A
+background task reconciles it with the backend every
+INVENTORY_RECONCILE_INTERVAL seconds, which also picks up models pulled or
+removed by another process. Reads are served from memory.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from app.utils.backends import ModelInfo, get_backend
+
+load_dotenv()
+
+INVENTORY_RECONCILE_INTERVAL = float(os.getenv("INVENTORY_RECONCILE_INTERVAL", "60"))
+# Промах по имени модели перепроверяется у бэкенда не чаще, чем раз в N секунд
+INVENTORY_MISS_RECHECK = float(os.getenv("INVENTORY_MISS_RECHECK", "5"))
+
+logger = logging.getLogger(__name__)
+
+
+def model_aliases(name: str) -> List[str]:
+    """`llama3` and `llama3:latest` name the same model."""
+    if ":" not in name:
+        return [name, f"{name}:latest"]
+    if name.endswith(":latest"):
+        return [name, name[: -len(":latest")]]
+    return [name]
+
+
+class ModelInventory:
+    def __init__(
+        self,
+        interval: float = INVENTORY_RECONCILE_INTERVAL,
+        miss_recheck: float = INVENTORY_MISS_RECHECK,
+    ):
+        self.interval = interval
+        self.miss_recheck = miss_recheck
+        self._models: Dict[str, ModelInfo] = {}
+        self.synced_at: Optional[float] = None
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def loaded(self) -> bool:
+        return self.synced_at is not None
+
+    async def reconcile(self) -> None:
+        """Replace the inventory with what the backend reports."""
+        async with self._lock:
+            await self._reconcile()
+
+    async def _reconcile(self) -> None:
+        models = await get_backend().list_models()
+        self._models = {m.name: m for m in models}
+        self.synced_at = time.monotonic()
+
+    async def _ensure_loaded(self) -> None:
+        if not self.loaded:
+            await self.reconcile()
+
+    async def models(self) -> List[ModelInfo]:
+        await self._ensure_loaded()
+        return list(self._models.values())
+
+    async def names(self) -> List[str]:
+        await self._ensure_loaded()
+        return list(self._models)
+
+    def get(self, name: str) -> Optional[ModelInfo]:
+        for alias in model_aliases(name):
+            info = self._models.get(alias)
+            if info is not None:
+                return info
+        return None
+
+    async def contains(self, name: str) -> bool:
+        """
+        Whether the model is installed. A miss is re-checked against the
+        backend at most once per INVENTORY_MISS_RECHECK seconds; if the backend
+        cannot be asked, the model is assumed to exist and the backend decides.
+        """
+        if self.get(name) is not None:
+            return True
+        if self.loaded and time.monotonic() - self.synced_at < self.miss_recheck:
+            return False
+        seen = self.synced_at
+        try:
+            async with self._lock:
+                # Пока ждали блокировку, инвентарь мог обновить другой запрос —
+                # одна сверка с бэкендом на всех ожидающих
+                if self.synced_at == seen:
+                    await self._reconcile()
+        except RuntimeError:
+            return True
+        return self.get(name) is not None
+
+    def discard(self, name: str) -> None:
+        """Forget a model that has just been removed."""
+        for alias in model_aliases(name):
+            self._models.pop(alias, None)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.reconcile()
+            except Exception:
+                logger.warning("Model inventory reconcile failed", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+model_inventory = ModelInventory()
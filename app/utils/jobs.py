@@ -0,0 +1,313 @@
+# app/utils/jobs.py
+"""
+Background model pulls.
+
+install requests become jobs that a bounded pool of PULL_WORKERS workers
+runs in the background, so the HTTP request returns immediately with a job
+id. A second request for a model that is already queued or being pulled
+attaches to the existing job instead of starting another download. Progress
+(bytes and percent, summed over all layers) is exposed as a snapshot and as
+a stream of updates; queued and running jobs can be cancelled.
+
+Job state lives in the `model_pulls` table, so all API workers behind the
+supervisor see the same jobs: any of them can report, stream or cancel a job
+that another one runs. The worker that accepted the install request runs the
+download and writes its progress every PULL_SYNC_INTERVAL seconds. A partial
+unique index allows one unfinished job per model across all workers. A job
+owned by another worker is cancelled through a flag that its owner polls. A
+job whose owner has not touched it for PULL_JOB_STALE seconds (the worker
+died) is reported as failed.
+"""
+import asyncio
+import logging
+import os
+import socket
+import time
+import uuid
+from typing import AsyncIterator, Dict, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, insert, select, update
+from sqlalchemy.exc import IntegrityError
+
+from app.database import async_engine
+from app.models import ModelPull
+from app.utils.ollama import install_model
+
+load_dotenv()
+
+PULL_WORKERS = int(os.getenv("PULL_WORKERS", "2"))
+PULL_JOB_HISTORY = int(os.getenv("PULL_JOB_HISTORY", "100"))
+PULL_SYNC_INTERVAL = float(os.getenv("PULL_SYNC_INTERVAL", "0.5"))
+PULL_JOB_STALE = float(os.getenv("PULL_JOB_STALE", "60"))
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+COMPLETED = "completed"
+FAILED = "failed"
+CANCELLED = "cancelled"
+ACTIVE = (QUEUED, RUNNING)
+FINISHED = (COMPLETED, FAILED, CANCELLED)
+
+
+def snapshot(row) -> Dict[str, object]:
+    """Public view of a `model_pulls` row."""
+    if row.status == COMPLETED:
+        percent = 100.0
+    else:
+        percent = round(100.0 * row.completed / row.total, 1) if row.total else 0.0
+    return {
+        "job_id": row.id,
+        "model": row.model,
+        "status": row.status,
+        "detail": row.detail,
+        "total": row.total,
+        "completed": row.completed,
+        "percent": percent,
+        "error": row.error,
+        "created_at": row.created_at,
+        "finished_at": row.finished_at,
+    }
+
+
+class LocalPull:
+    """A job accepted by this process: its layers and the download task."""
+
+    def __init__(self, job_id: str, model: str):
+        self.id = job_id
+        self.model = model
+        self.detail = ""
+        self.layers: Dict[str, List[int]] = {}
+        self.task: Optional[asyncio.Task] = None
+        self.done = asyncio.Event()
+
+    @property
+    def total(self) -> int:
+        return sum(total for total, _ in self.layers.values())
+
+    @property
+    def completed(self) -> int:
+        return sum(done for _, done in self.layers.values())
+
+    def progress(self, event: Dict[str, object]) -> None:
+        """Apply an Ollama pull progress event (written out by the sync loop)."""
+        self.detail = str(event.get("status", ""))
+        if event.get("total"):
+            digest = str(event.get("digest", ""))
+            self.layers[digest] = [int(event["total"]), int(event.get("completed") or 0)]
+
+
+class PullJobManager:
+    def __init__(
+        self,
+        workers: int = PULL_WORKERS,
+        history: int = PULL_JOB_HISTORY,
+        sync_interval: float = PULL_SYNC_INTERVAL,
+        stale: float = PULL_JOB_STALE,
+    ):
+        self.workers = workers
+        self.history = history
+        self.sync_interval = sync_interval
+        self.stale = stale
+        self.owner = ""
+        self._local: Dict[str, LocalPull] = {}
+        self._queue: Optional[asyncio.Queue] = None
+        self._tasks: List[asyncio.Task] = []
+
+    # ---- state in the database ------------------------------------------------
+    async def _update(self, job_id: str, *conditions, **values) -> bool:
+        stmt = update(ModelPull).where(ModelPull.id == job_id, *conditions).values(**values)
+        async with async_engine.begin() as conn:
+            result = await conn.execute(stmt)
+        return result.rowcount > 0
+
+    async def _expire_stale(self, conn, *conditions) -> None:
+        """Fail unfinished jobs whose owner stopped updating them."""
+        now = time.time()
+        await conn.execute(
+            update(ModelPull)
+            .where(ModelPull.status.in_(ACTIVE), ModelPull.updated_at < now - self.stale, *conditions)
+            .values(status=FAILED, error="The worker running the job has stopped", finished_at=now)
+        )
+
+    async def _active(self, model: str):
+        async with async_engine.begin() as conn:
+            await self._expire_stale(conn, ModelPull.model == model)
+            return (await conn.execute(
+                select(ModelPull).where(ModelPull.model == model, ModelPull.status.in_(ACTIVE))
+            )).first()
+
+    async def _trim(self) -> None:
+        keep = select(ModelPull.id).order_by(ModelPull.created_at.desc()).limit(self.history)
+        async with async_engine.begin() as conn:
+            await conn.execute(
+                delete(ModelPull).where(ModelPull.status.in_(FINISHED), ModelPull.id.not_in(keep))
+            )
+
+    # ---- API ------------------------------------------------------------------
+    async def submit(self, model: str) -> Dict[str, object]:
+        """Queue a pull, or return the job already pulling this model (in any worker)."""
+        if self._queue is None:
+            raise RuntimeError("Pull job manager is not running")
+        while True:
+            row = await self._active(model)
+            if row is not None:
+                return snapshot(row)
+            now = time.time()
+            job_id = uuid.uuid4().hex
+            try:
+                async with async_engine.begin() as conn:
+                    await conn.execute(insert(ModelPull).values(
+                        id=job_id, model=model, status=QUEUED, detail="", total=0, completed=0,
+                        owner=self.owner, cancel_requested=False, created_at=now, updated_at=now,
+                    ))
+            except IntegrityError:
+                # Другой воркер только что поставил эту модель — берём его задание
+                continue
+            break
+        self._local[job_id] = LocalPull(job_id, model)
+        self._queue.put_nowait(job_id)
+        await self._trim()
+        return await self.get(job_id)
+
+    async def get(self, job_id: str) -> Optional[Dict[str, object]]:
+        async with async_engine.begin() as conn:
+            await self._expire_stale(conn, ModelPull.id == job_id)
+            row = (await conn.execute(select(ModelPull).where(ModelPull.id == job_id))).first()
+        return snapshot(row) if row is not None else None
+
+    async def jobs(self) -> List[Dict[str, object]]:
+        """Jobs of all workers, newest first."""
+        async with async_engine.begin() as conn:
+            await self._expire_stale(conn)
+            rows = (await conn.execute(
+                select(ModelPull).order_by(ModelPull.created_at.desc()).limit(self.history)
+            )).all()
+        return [snapshot(row) for row in rows]
+
+    async def cancel(self, job_id: str) -> Optional[Dict[str, object]]:
+        pull = self._local.get(job_id)
+        if pull is not None and pull.task is not None:
+            pull.task.cancel()
+            await pull.done.wait()
+        elif not await self._update(
+            job_id, ModelPull.status == QUEUED, status=CANCELLED, finished_at=time.time(),
+        ):
+            # Качает другой воркер: он увидит флаг в своём цикле синхронизации
+            await self._update(job_id, ModelPull.status == RUNNING, cancel_requested=True)
+        return await self.get(job_id)
+
+    async def updates(self, job_id: str, interval: float = 15.0) -> AsyncIterator[Dict[str, object]]:
+        """
+        Yield a snapshot now and after every change until the job finishes.
+        Without changes for `interval` seconds the snapshot is repeated (keep-alive).
+        """
+        last, sent_at = None, 0.0
+        while True:
+            current = await self.get(job_id)
+            if current is None:
+                return
+            if current != last or time.monotonic() - sent_at >= interval:
+                last, sent_at = current, time.monotonic()
+                yield current
+            if current["status"] in FINISHED:
+                return
+            await asyncio.sleep(self.sync_interval)
+
+    # ---- running jobs of this process -----------------------------------------------
+    async def _run_job(self, pull: LocalPull) -> None:
+        now = time.time()
+        # Задание могли отменить, пока оно ждало в очереди
+        if not await self._update(pull.id, ModelPull.status == QUEUED, status=RUNNING, updated_at=now):
+            return
+        pull.task = asyncio.create_task(install_model(pull.model, progress=pull.progress))
+        status, error = COMPLETED, None
+        try:
+            await pull.task
+        except asyncio.CancelledError:
+            status = CANCELLED
+            # Отменили сам воркер (остановка приложения), а не задание
+            if not pull.task.cancelled():
+                raise
+        except Exception as e:
+            logger.warning("Pull of %s failed: %s", pull.model, e)
+            status, error = FAILED, str(e)
+        finally:
+            await self._update(
+                pull.id, status=status, error=error, detail=pull.detail, total=pull.total,
+                completed=pull.completed, updated_at=time.time(), finished_at=time.time(),
+            )
+
+    async def _worker(self) -> None:
+        while True:
+            job_id = await self._queue.get()
+            pull = self._local.get(job_id)
+            try:
+                if pull is not None:
+                    await self._run_job(pull)
+            except Exception:
+                logger.exception("Pull job %s failed", job_id)
+            finally:
+                if pull is not None:
+                    self._local.pop(job_id, None)
+                    pull.done.set()
+                self._queue.task_done()
+
+    async def _sync(self) -> None:
+        """Write progress of local jobs (also a heartbeat) and pick up cancel requests."""
+        while True:
+            await asyncio.sleep(self.sync_interval)
+            if not self._local:
+                continue
+            try:
+                now = time.time()
+                async with async_engine.begin() as conn:
+                    for pull in list(self._local.values()):
+                        values = {"updated_at": now}
+                        if pull.task is not None:
+                            values.update(detail=pull.detail, total=pull.total, completed=pull.completed)
+                        await conn.execute(
+                            update(ModelPull)
+                            .where(ModelPull.id == pull.id, ModelPull.status.in_(ACTIVE))
+                            .values(**values)
+                        )
+                    cancelled = (await conn.execute(
+                        select(ModelPull.id).where(
+                            ModelPull.owner == self.owner,
+                            ModelPull.cancel_requested.is_(True),
+                            ModelPull.status == RUNNING,
+                        )
+                    )).scalars().all()
+                for job_id in cancelled:
+                    pull = self._local.get(job_id)
+                    if pull is not None and pull.task is not None:
+                        pull.task.cancel()
+            except Exception:
+                logger.warning("Pull job sync failed", exc_info=True)
+
+    async def start(self) -> None:
+        if self._queue is None:
+            self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+            self._queue = asyncio.Queue()
+            self._tasks = [asyncio.create_task(self._worker()) for _ in range(self.workers)]
+            self._tasks.append(asyncio.create_task(self._sync()))
+
+    async def stop(self) -> None:
+        """Cancel the pulls of this process and stop the workers."""
+        for pull in list(self._local.values()):
+            await self.cancel(pull.id)
+        for task in self._tasks:
+            task.cancel()
+        for task in self._tasks:
+            try:
+                await task
+            except asyncio.CancelledError:
+                pass
+        self._tasks = []
+        self._local = {}
+        self._queue = None
+
+
+pull_jobs = PullJobManager()
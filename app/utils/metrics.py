@@ -0,0 +1,211 @@
+# app/utils/metrics.py
+"""
+Prometheus metrics for the API and admin apps.
+
+`GET /metrics` (registered by install()) serves the text exposition format.
+With several API worker processes every worker writes its samples to
+PROMETHEUS_MULTIPROC_DIR (the supervisor sets it for its workers) and
+/metrics, whichever worker answers it, aggregates all of them: counters
+and histograms are summed, in-flight gauges are summed over live
+processes.
+
+What is measured:
+- every HTTP request: count, latency histogram and in-flight gauge per
+  route template (`/history/{session_id}`, not the concrete URL);
+- inference per model: queue wait, time to first token, total generation
+  time, generated tokens and tokens per second;
+- every SQL statement (by kind: select/insert/...) and the commits of the
+  write paths;
+- rejections (daily limit, model queue) and backend errors (HTTP and
+  subprocess);
+- response cache lookups and single-flight joins.
+"""
+import os
+import time
+from contextlib import contextmanager
+from typing import Iterator, Optional
+
+from prometheus_client import (
+    CONTENT_TYPE_LATEST,
+    CollectorRegistry,
+    Counter,
+    Gauge,
+    Histogram,
+    generate_latest,
+)
+from prometheus_client import multiprocess
+from sqlalchemy import event
+from starlette.requests import Request
+from starlette.responses import Response
+
+from app.database import async_engine, engine
+
+MULTIPROC_DIR = os.getenv("PROMETHEUS_MULTIPROC_DIR")
+
+# Секунды: от быстрых запросов к БД до долгих генераций
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300)
+DB_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5)
+RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 75, 100, 150, 200, 300, 500)
+
+HTTP_REQUESTS = Counter(
+    "http_requests_total", "HTTP requests", ["app", "method", "route", "status"]
+)
+HTTP_LATENCY = Histogram(
+    "http_request_duration_seconds", "HTTP request latency (until the last byte of the body)",
+    ["app", "method", "route"], buckets=LATENCY_BUCKETS,
+)
+HTTP_IN_FLIGHT = Gauge(
+    "http_requests_in_flight", "HTTP requests being served", ["app"], multiprocess_mode="livesum"
+)
+
+QUEUE_WAIT = Histogram(
+    "inference_queue_wait_seconds", "Time a chat request waited for a model slot",
+    ["model"], buckets=LATENCY_BUCKETS,
+)
+QUEUE_DEPTH = Gauge(
+    "inference_queue_depth", "Chat requests waiting for a model slot", ["model"],
+    multiprocess_mode="livesum",
+)
+INFERENCE_RUNNING = Gauge(
+    "inference_running", "Generations running", ["model"], multiprocess_mode="livesum"
+)
+INFERENCE_TTFT = Histogram(
+    "inference_time_to_first_token_seconds", "Time from starting a generation to its first token",
+    ["model"], buckets=LATENCY_BUCKETS,
+)
+INFERENCE_DURATION = Histogram(
+    "inference_duration_seconds", "Total generation time", ["model", "outcome"], buckets=LATENCY_BUCKETS,
+)
+INFERENCE_TOKENS = Counter("inference_tokens_total", "Generated tokens", ["model"])
+INFERENCE_TOKEN_RATE = Histogram(
+    "inference_tokens_per_second", "Generation speed after the first token", ["model"], buckets=RATE_BUCKETS,
+)
+
+DB_QUERY = Histogram(
+    "db_query_duration_seconds", "SQL statement execution time", ["engine", "statement"], buckets=DB_BUCKETS,
+)
+DB_COMMIT = Histogram(
+    "db_commit_duration_seconds", "Commit time of the write paths", ["component"], buckets=DB_BUCKETS,
+)
+
+REJECTIONS = Counter("chat_rejections_total", "Rejected chat requests", ["reason"])
+BACKEND_ERRORS = Counter(
+    "backend_errors_total", "Errors talking to Ollama", ["transport", "kind"]
+)
+CACHE_LOOKUPS = Counter("response_cache_lookups_total", "Response cache lookups", ["result"])
+SINGLEFLIGHT_JOINS = Counter("singleflight_joins_total", "Chat requests attached to a running generation")
+
+
+@contextmanager
+def timed(histogram: Histogram, *labels: str) -> Iterator[None]:
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        histogram.labels(*labels).observe(time.perf_counter() - started)
+
+
+# ---- SQL ---------------------------------------------------------------------
+def _statement_kind(statement: str) -> str:
+    word = statement.lstrip().split(None, 1)[0].lower() if statement.strip() else ""
+    return word if word in ("select", "insert", "update", "delete", "with", "pragma") else "other"
+
+
+_engines_instrumented = False
+
+
+def instrument_engine(engine, name: str) -> None:
+    """Time every statement executed through a (sync) SQLAlchemy engine."""
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = conn.info["metrics_started"].pop()
+        DB_QUERY.labels(name, _statement_kind(statement)).observe(time.perf_counter() - started)
+
+    @event.listens_for(engine, "handle_error")
+    def _error(context):
+        # Оборвавшийся запрос: снимаем его отметку времени
+        stack = context.connection.info.get("metrics_started") if context.connection is not None else None
+        if stack:
+            stack.pop()
+
+
+# ---- HTTP --------------------------------------------------------------------
+def _route_template(scope) -> str:
+    """`/history/{session_id}` for `/history/abc`; "unmatched" for unknown URLs."""
+    template = getattr(scope.get("route"), "path", None)
+    if template is None:
+        return "unmatched"
+    # Новые версии FastAPI кладут в scope маршрут без префикса роутера:
+    # префикс — это начало фактического пути до сегментов шаблона
+    parts = scope.get("path", "").split("/")
+    depth = template.count("/")
+    prefix = "/".join(parts[:len(parts) - depth]) if depth else "/".join(parts)
+    return prefix + template
+
+
+class MetricsMiddleware:
+    """ASGI middleware: count and time requests by route template."""
+
+    def __init__(self, app, app_name: str):
+        self.app = app
+        self.app_name = app_name
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or scope.get("path") == "/metrics":
+            await self.app(scope, receive, send)
+            return
+        status = {"code": 500}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                status["code"] = message["status"]
+            await send(message)
+
+        in_flight = HTTP_IN_FLIGHT.labels(self.app_name)
+        in_flight.inc()
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            in_flight.dec()
+            path = _route_template(scope)
+            method = scope.get("method", "")
+            HTTP_LATENCY.labels(self.app_name, method, path).observe(time.perf_counter() - started)
+            HTTP_REQUESTS.labels(self.app_name, method, path, str(status["code"])).inc()
+
+
+def registry():
+    """The registry to expose: all worker processes in multiprocess mode."""
+    if MULTIPROC_DIR:
+        collected = CollectorRegistry()
+        multiprocess.MultiProcessCollector(collected)
+        return collected
+    from prometheus_client import REGISTRY
+    return REGISTRY
+
+
+async def metrics_endpoint(request: Request) -> Response:
+    return Response(generate_latest(registry()), media_type=CONTENT_TYPE_LATEST)
+
+
+def install(app, app_name: str) -> None:
+    """Add the middleware and `GET /metrics` to a FastAPI app; time SQL of both engines."""
+    global _engines_instrumented
+    if not _engines_instrumented:
+        instrument_engine(engine, "sync")
+        instrument_engine(async_engine.sync_engine, "async")
+        _engines_instrumented = True
+    app.add_middleware(MetricsMiddleware, app_name=app_name)
+    app.add_route("/metrics", metrics_endpoint, methods=["GET"], include_in_schema=False)
+
+
+def mark_process_dead(pid: int, path: Optional[str] = None) -> None:
+    """Drop the live gauges of an exited worker (multiprocess mode)."""
+    path = path or MULTIPROC_DIR
+    if path:
+        multiprocess.mark_process_dead(pid, path)
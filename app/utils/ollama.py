@@ -1,181 +1,86 @@
 # app/utils/ollama.py
 """
-Wrapper for invoking Ollama CLI commands and scraping to manage and chat with models.
-"""
-import subprocess
-import re
-from typing import List, Optional
-
-# Optional imports for remote model listing
-try:
-    import requests
-    from bs4 import BeautifulSoup
-except ImportError:
-    requests = None
-    BeautifulSoup = None
-
-OLLAMA_CMD = "ollama"
-
-
-
-def list_remote_base_models() -> List[str]:
-    """Return base model names available from the Ollama library."""
+Wrapper for invoking Ollama (through the configured backend) and scraping to manage and chat with models.
 
-    if not requests or not BeautifulSoup:
-        raise RuntimeError(
-            "Missing dependencies for remote model listing: requests, beautifulsoup4"
-        )
-    url = "https://ollama.com/library"
-    resp = requests.get(url)
-    if resp.status_code != 200:
-        raise RuntimeError(
-            f"Error fetching remote models page: status {resp.status_code}"
-        )
-    soup = BeautifulSoup(resp.text, "html.parser")
-
-    base_models: List[str] = []
-    for a in soup.find_all("a", href=True):
-        href = a["href"]
-
-        if href.startswith("/library/") and ":" not in href:
-
-            name = href.split("/")[-1]
-            if name and name not in base_models:
-                base_models.append(name)
+All functions are coroutines: subprocesses and HTTP requests run asynchronously.
+Remote listings are served from the cached catalog (app.utils.catalog).
+"""
+from typing import Callable, Dict, List, Optional
 
+from app.utils.backends import TokenStream, get_backend
+from app.utils.catalog import model_catalog
+from app.utils.inventory import model_aliases, model_inventory
+from app.utils.response_cache import response_cache
 
-    return base_models
 
+async def list_remote_base_models() -> List[str]:
+    """Return base model names available from the Ollama library (cached catalog)."""
+    return await model_catalog.base_models()
 
-def list_model_variants(name: str) -> List[str]:
-    """Return available parameter variants for a given model name."""
-    if not requests or not BeautifulSoup:
-        raise RuntimeError(
-            "Missing dependencies for remote model listing: requests, beautifulsoup4"
-        )
-    url = f"https://ollama.com/library/{name}"
-    resp = requests.get(url)
-    if resp.status_code != 200:
-        return []
 
-    text = resp.text
-    pattern = rf"{re.escape(name)}:[^\"'\s<]+"
-    matches = set(re.findall(pattern, text, flags=re.IGNORECASE))
-    return sorted(matches)
+async def list_model_variants(name: str) -> List[str]:
+    """Return available parameter variants for a given model name (cached catalog)."""
+    return await model_catalog.model_variants(name)
 
 
-def list_remote_models() -> List[str]:
+async def list_remote_models() -> List[str]:
     """Return all models from the Ollama registry including parameter variations."""
+    return await model_catalog.all_models()
 
-    base_models = list_remote_base_models()
-
-    models: List[str] = []
-    for name in base_models:
-        variants = list_model_variants(name)
 
-        if variants:
-            models.extend(variants)
-        else:
-            models.append(name)
-
-    return models
-
-
-def list_installed_models() -> List[str]:
+async def list_installed_models() -> List[str]:
     """
-    List models currently installed locally via Ollama CLI.
-    Returns a list of model names.
+    List models currently installed locally.
+    Served from the in-process inventory; no process is spawned.
     """
-    result = subprocess.run(
-        [OLLAMA_CMD, "list"],
-        capture_output=True,
-        text=True,
-    )
-    if result.returncode != 0:
-        raise RuntimeError(f"Error listing installed models: {result.stderr.strip()}")
-
-    models: List[str] = []
-    for line in result.stdout.splitlines():
-        parts = line.strip().split()
-        if not parts or parts[0].lower() == "name":
-            continue
-        models.append(parts[0])
-    return models
-
-
-def install_model(name: str) -> None:
+    return await model_inventory.names()
+
+
+async def install_model(
+    name: str,
+    progress: Optional[Callable[[Dict[str, object]], None]] = None,
+) -> None:
     """
     Install a model from the public registry by its name.
+    `progress` is called with every progress event reported by the backend.
     Raises RuntimeError on failure.
     """
-    result = subprocess.run(
-        [OLLAMA_CMD, "pull", name],
-        capture_output=True,
-        text=True,
-    )
-    if result.returncode != 0:
-        raise RuntimeError(f"Error installing model '{name}': {result.stderr.strip()}")
+    async for event in get_backend().pull(name):
+        if progress is not None:
+            progress(event)
+    # Размер и digest новой модели берём у бэкенда
+    try:
+        await model_inventory.reconcile()
+    except RuntimeError:
+        pass
 
 
-def remove_model(name: str) -> None:
+async def remove_model(name: str) -> None:
     """
-    Remove an installed model by its name.
-    Tries `ollama rm` then `ollama remove`.
+    Remove an installed model by its name (on every host of a backend pool).
     Raises RuntimeError on failure.
     """
-    # Try short alias
-    result = subprocess.run(
-        [OLLAMA_CMD, "rm", name],
-        capture_output=True,
-        text=True,
-    )
-    if result.returncode == 0:
-        return
-    # Fallback
-    result = subprocess.run(
-        [OLLAMA_CMD, "remove", name],
-        capture_output=True,
-        text=True,
-    )
-    if result.returncode != 0:
-        raise RuntimeError(f"Error removing model '{name}': {result.stderr.strip()}")
-
-
-def chat(
+    await get_backend().remove(name)
+    model_inventory.discard(name)
+    # Под тем же именем позже может появиться другая модель
+    await response_cache.clear(model_aliases(name))
+
+
+async def chat_stream(
     session_id: str,
     model: str,
     prompt: str,
     temperature: Optional[float] = None,
     max_tokens: Optional[int] = None,
-) -> str:
-
-    # Формируем команду: ollama run <model> <prompt> [--temperature X] [--max-tokens Y]
-    cmd = [OLLAMA_CMD, "run", model, prompt]
-    if temperature is not None:
-        cmd.extend(["--temperature", str(temperature)])
-    if max_tokens is not None:
-        cmd.extend(["--max-tokens", str(max_tokens)])
-
-    # Запускаем процесс и получаем сырые байты
-    result = subprocess.run(cmd, capture_output=True)
-    if result.returncode != 0:
-        # Декодируем stderr с учётом возможной кодировки
-        try:
-            err = result.stderr.decode("utf-8")
-        except:
-            err = result.stderr.decode("cp866", errors="ignore")
-        raise RuntimeError(f"Error during chat with model '{model}': {err.strip()}")
-
-    # Пытаемся декодировать stdout: сначала UTF-8, затем cp866, затем cp1251
-    out_bytes = result.stdout
-    for enc in ("utf-8", "cp866", "cp1251"):
-        try:
-            output = out_bytes.decode(enc)
-            break
-        except:
-            continue
-    else:
-        output = out_bytes.decode("utf-8", errors="ignore")
-
-    return output.strip()
-
+    messages: Optional[List[Dict[str, str]]] = None,
+) -> TokenStream:
+    """
+    Send a prompt to the model through the configured inference backend
+    (HTTP API by default, `ollama run` as a fallback) and return a
+    cancellable async iterator over tokens as the backend produces them.
+    `messages` is the full conversation window to send; defaults to the prompt alone.
+    Raises RuntimeError on failure.
+    """
+    if messages is None:
+        messages = [{"role": "user", "content": prompt}]
+    return await get_backend().stream_chat(model, messages, temperature, max_tokens)
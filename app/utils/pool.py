@@ -0,0 +1,377 @@
+# app/utils/pool.py
+"""
+Backend pool: one Ollama HTTP backend per host in OLLAMA_HOSTS.
+
+Routing. A chat request goes to a host that has the model loaded in memory
+(`/api/ps`), then to one that has it installed (`/api/tags`), and among
+those to the host with the fewest outstanding requests; ties rotate.
+
+Health. Every POOL_HEALTH_INTERVAL seconds each host is asked for its
+loaded and installed models. A host that cannot be reached, either by the
+health check or by a request, is ejected for POOL_EJECT_SECONDS (doubling
+on repeated failures, up to POOL_EJECT_MAX). A request that failed to
+connect was not processed, so it is retried on the next host. Timeouts and
+errors returned by Ollama are not retried. An ejected host rejoins after a
+successful health check.
+
+Model management spans the pool: list_models() is the union of all hosts,
+pull() downloads on every available host at once, and remove() deletes
+from every host that has the model.
+"""
+import asyncio
+import itertools
+import logging
+import os
+import time
+from typing import AsyncIterator, Dict, List, Optional, Set
+
+import anyio
+from dotenv import load_dotenv
+
+from app.utils.backends import (
+    BackendUnavailable,
+    HTTPBackend,
+    InferenceBackend,
+    ModelInfo,
+    TokenStream,
+)
+
+load_dotenv()
+
+POOL_HEALTH_INTERVAL = float(os.getenv("POOL_HEALTH_INTERVAL", "10"))
+POOL_EJECT_SECONDS = float(os.getenv("POOL_EJECT_SECONDS", "5"))
+POOL_EJECT_MAX = float(os.getenv("POOL_EJECT_MAX", "120"))
+
+logger = logging.getLogger(__name__)
+
+
+def _key(name: str) -> str:
+    """`llama3` and `llama3:latest` route the same way."""
+    return name if ":" in name else f"{name}:latest"
+
+
+class PoolMember:
+    def __init__(self, host: str, backend: InferenceBackend):
+        self.host = host
+        self.backend = backend
+        self.outstanding = 0
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.last_error: Optional[str] = None
+        self.loaded: Set[str] = set()
+        self.installed: Optional[Set[str]] = None  # None — ещё не опрошен
+
+    @property
+    def available(self) -> bool:
+        return time.monotonic() >= self.ejected_until
+
+    def eject(self, error: Exception) -> None:
+        self.failures += 1
+        delay = min(POOL_EJECT_MAX, POOL_EJECT_SECONDS * 2 ** (self.failures - 1))
+        self.ejected_until = time.monotonic() + delay
+        self.last_error = str(error)
+        logger.warning("Ollama host %s ejected for %.0fs: %s", self.host, delay, error)
+
+    def restore(self) -> None:
+        if self.failures:
+            logger.info("Ollama host %s is back", self.host)
+        self.failures = 0
+        self.ejected_until = 0.0
+        self.last_error = None
+
+    def status(self) -> Dict[str, object]:
+        return {
+            "host": self.host,
+            "available": self.available,
+            "outstanding": self.outstanding,
+            "failures": self.failures,
+            "last_error": self.last_error,
+            "loaded": sorted(self.loaded),
+            "installed": sorted(self.installed) if self.installed is not None else None,
+        }
+
+
+class PoolBackend(InferenceBackend):
+    """Spreads requests over several Ollama hosts (see module docstring)."""
+
+    name = "pool"
+
+    def __init__(self, hosts: List[str], interval: float = POOL_HEALTH_INTERVAL):
+        if not hosts:
+            raise RuntimeError("Backend pool needs at least one host (OLLAMA_HOSTS)")
+        self.members = [PoolMember(host, HTTPBackend(host)) for host in hosts]
+        self.interval = interval
+        self._rotation = itertools.count()
+        self._task: Optional[asyncio.Task] = None
+
+    # ---- health ------------------------------------------------------------
+    async def _probe(self, member: PoolMember) -> None:
+        try:
+            loaded = await member.backend.running_models()
+            installed = await member.backend.list_models()
+        except BackendUnavailable as e:
+            member.eject(e)
+            return
+        except RuntimeError as e:
+            # Хост отвечает, но с ошибкой — маршрутизировать на него можно
+            member.last_error = str(e)
+            return
+        member.loaded = {_key(name) for name in loaded}
+        member.installed = {_key(m.name) for m in installed}
+        member.restore()
+
+    async def check(self) -> None:
+        """Probe every host once."""
+        await asyncio.gather(*(self._probe(m) for m in self.members))
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                await self.check()
+            except Exception:
+                logger.warning("Backend pool health check failed", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    def _ensure_started(self) -> None:
+        # Пул создаётся лениво в get_backend(), проверки запускаются при первом запросе
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    # ---- routing -----------------------------------------------------------
+    def route(self, model: str) -> List[PoolMember]:
+        """Available hosts in the order they should be tried for `model`."""
+        self._ensure_started()
+        key = _key(model)
+        members = [m for m in self.members if m.available]
+        if not members:
+            # Все выброшены: пробуем все, начиная с давно упавших
+            members = sorted(self.members, key=lambda m: m.ejected_until)
+        start = next(self._rotation)
+        rotated = [members[(start + i) % len(members)] for i in range(len(members))]
+        return sorted(rotated, key=lambda m: (
+            key not in m.loaded,
+            m.installed is not None and key not in m.installed,
+            m.outstanding,
+        ))
+
+    async def _call(self, model: str, method: str, *args):
+        last: Optional[Exception] = None
+        for member in self.route(model):
+            member.outstanding += 1
+            try:
+                result = await getattr(member.backend, method)(model, *args)
+            except BackendUnavailable as e:
+                member.eject(e)
+                last = e
+                continue
+            finally:
+                member.outstanding -= 1
+            member.loaded.add(_key(model))
+            return result
+        raise BackendUnavailable(f"Error during chat with model '{model}': no Ollama host is reachable ({last})")
+
+    async def chat(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> str:
+        return await self._call(model, "chat", messages, temperature, max_tokens)
+
+    async def generate(
+        self,
+        model: str,
+        prompt: str,
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> str:
+        return await self._call(model, "generate", prompt, temperature, max_tokens)
+
+    async def stream_chat(
+        self,
+        model: str,
+        messages: List[Dict[str, str]],
+        temperature: Optional[float] = None,
+        max_tokens: Optional[int] = None,
+    ) -> TokenStream:
+        last: Optional[Exception] = None
+        for member in self.route(model):
+            member.outstanding += 1
+            try:
+                tokens = await member.backend.stream_chat(model, messages, temperature, max_tokens)
+            except BackendUnavailable as e:
+                member.outstanding -= 1
+                member.eject(e)
+                last = e
+                continue
+            except BaseException:
+                member.outstanding -= 1
+                raise
+            member.loaded.add(_key(model))
+            return _tracked(tokens, member)
+        raise BackendUnavailable(f"Error during chat with model '{model}': no Ollama host is reachable ({last})")
+
+    # ---- model management --------------------------------------------------
+    def _reachable(self) -> List[PoolMember]:
+        self._ensure_started()
+        return [m for m in self.members if m.available] or list(self.members)
+
+    async def list_models(self) -> List[ModelInfo]:
+        members = self._reachable()
+        results = await asyncio.gather(
+            *(m.backend.list_models() for m in members), return_exceptions=True
+        )
+        models: Dict[str, ModelInfo] = {}
+        errors = []
+        for member, result in zip(members, results):
+            if isinstance(result, BaseException):
+                if isinstance(result, BackendUnavailable):
+                    member.eject(result)
+                errors.append(f"{member.host}: {result}")
+                continue
+            member.installed = {_key(m.name) for m in result}
+            for info in result:
+                models.setdefault(info.name, info)
+        if errors and len(errors) == len(members):
+            raise BackendUnavailable("Error listing installed models: " + "; ".join(errors))
+        return list(models.values())
+
+    async def pull(self, model: str) -> AsyncIterator[Dict[str, object]]:
+        members = self._reachable()
+        events: asyncio.Queue = asyncio.Queue()
+        errors: Dict[str, str] = {}
+
+        async def pull_one(member: PoolMember) -> None:
+            try:
+                async for event in member.backend.pull(model):
+                    if event.get("status") == "success":
+                        continue
+                    event = dict(event)
+                    # Слои разных хостов считаются отдельно
+                    if event.get("digest"):
+                        event["digest"] = f"{member.host}/{event['digest']}"
+                    event["host"] = member.host
+                    events.put_nowait(event)
+                if member.installed is not None:
+                    member.installed.add(_key(model))
+            except BackendUnavailable as e:
+                member.eject(e)
+                errors[member.host] = str(e)
+            except RuntimeError as e:
+                errors[member.host] = str(e)
+            finally:
+                events.put_nowait(None)
+
+        tasks = [asyncio.create_task(pull_one(m)) for m in members]
+        remaining = len(tasks)
+        try:
+            while remaining:
+                event = await events.get()
+                if event is None:
+                    remaining -= 1
+                    continue
+                yield event
+        finally:
+            for task in tasks:
+                task.cancel()
+            with anyio.CancelScope(shield=True):
+                await asyncio.gather(*tasks, return_exceptions=True)
+        if errors:
+            failed = ", ".join(f"{host} ({error})" for host, error in errors.items())
+            raise RuntimeError(f"Error installing model '{model}' on {failed}")
+        yield {"status": "success"}
+
+    async def remove(self, model: str) -> None:
+        members = self._reachable()
+        key = _key(model)
+        results = await asyncio.gather(
+            *(m.backend.remove(model) for m in members), return_exceptions=True
+        )
+        removed = 0
+        errors = []
+        for member, result in zip(members, results):
+            if isinstance(result, BaseException):
+                if isinstance(result, BackendUnavailable):
+                    member.eject(result)
+                errors.append(f"{member.host}: {result}")
+                continue
+            removed += 1
+            member.loaded.discard(key)
+            if member.installed is not None:
+                member.installed.discard(key)
+        if not removed:
+            raise RuntimeError(f"Error removing model '{model}': " + "; ".join(errors))
+
+    async def running_models(self) -> List[str]:
+        await self.check()
+        return sorted({name for m in self.members for name in m.loaded})
+
+    async def resident_models(self) -> List[Dict[str, object]]:
+        members = self._reachable()
+        results = await asyncio.gather(
+            *(m.backend.resident_models() for m in members), return_exceptions=True
+        )
+        resident = []
+        for member, result in zip(members, results):
+            if isinstance(result, BaseException):
+                if isinstance(result, BackendUnavailable):
+                    member.eject(result)
+                continue
+            member.loaded = {_key(m["name"]) for m in result}
+            resident.extend({**m, "host": member.host} for m in result)
+        return resident
+
+    async def load(self, model: str, keep_alive: Optional[str] = None) -> float:
+        # Как и запрос чата — на хост, выбранный маршрутизацией
+        return await self._call(model, "load", keep_alive)
+
+    async def unload(self, model: str) -> None:
+        key = _key(model)
+        members = [m for m in self._reachable() if key in m.loaded]
+        results = await asyncio.gather(*(m.backend.unload(model) for m in members), return_exceptions=True)
+        errors = []
+        for member, result in zip(members, results):
+            if isinstance(result, BaseException):
+                errors.append(f"{member.host}: {result}")
+            else:
+                member.loaded.discard(key)
+        if errors:
+            raise RuntimeError(f"Error unloading model '{model}': " + "; ".join(errors))
+
+    def status(self) -> List[Dict[str, object]]:
+        return [m.status() for m in self.members]
+
+    async def aclose(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        for member in self.members:
+            await member.backend.aclose()
+
+
+def _tracked(tokens: TokenStream, member: PoolMember) -> TokenStream:
+    """Keep the host's outstanding count up until the stream ends or is cancelled."""
+    state = {"open": True}
+
+    def done() -> None:
+        if state["open"]:
+            state["open"] = False
+            member.outstanding -= 1
+
+    async def chunks() -> AsyncIterator[str]:
+        try:
+            async for token in tokens:
+                yield token
+        finally:
+            done()
+
+    async def cancel() -> None:
+        done()
+        await tokens.cancel()
+
+    return TokenStream(chunks(), cancel)
@@ -0,0 +1,243 @@
+# app/utils/ratelimit.py
+"""
+Daily request limits.
+
+Two interchangeable limiters, selected by RATE_LIMIT_BACKEND in .env:
+
+- "memory" (default): an in-process counter per (user, day). Check and
+  increment happen without an await in between, so they are atomic on the
+  event loop; the request path issues no DB writes. Deltas are flushed to
+  `rate_limits` in the background (RATE_LIMIT_FLUSH_INTERVAL seconds) with
+  one multi-row UPSERT. Exact for a single API process.
+  When the admin panel resets counters (forget(): clearing the database
+  or deleting a user) it rewrites RATE_LIMIT_RESET_PATH; every process
+  notices the new file on its next request and drops the cached counters
+  and unwritten deltas, which are then re-read from `rate_limits`.
+- "db": a single conditional UPSERT ... RETURNING per request against
+  `rate_limits`. The database serialises concurrent increments, so the limit
+  is exact across any number of API workers and can never be overshot.
+"""
+import asyncio
+import logging
+import os
+import secrets
+from datetime import datetime
+from typing import Dict, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import select
+
+from app.database import async_engine, upsert
+from app.models import RateLimit
+from app.utils import metrics
+from app.utils.auth_cache import CachedUser
+
+load_dotenv()
+
+RATE_LIMIT_BACKEND = os.getenv("RATE_LIMIT_BACKEND", "memory").lower()
+RATE_LIMIT_FLUSH_INTERVAL = float(os.getenv("RATE_LIMIT_FLUSH_INTERVAL", "5"))
+RATE_LIMIT_RESET_PATH = os.getenv("RATE_LIMIT_RESET_PATH", os.path.join(os.getcwd(), ".ratelimit_reset"))
+
+logger = logging.getLogger(__name__)
+
+
+class RateLimitExceeded(Exception):
+    """The user has used up today's quota."""
+
+
+def today() -> str:
+    return datetime.now().strftime("%Y-%m-%d")
+
+
+class MemoryRateLimiter:
+    name = "memory"
+
+    def __init__(
+        self,
+        flush_interval: float = RATE_LIMIT_FLUSH_INTERVAL,
+        reset_path: Optional[str] = RATE_LIMIT_RESET_PATH,
+    ):
+        self.flush_interval = flush_interval
+        self.reset_path = reset_path
+        self._counts: Dict[Tuple[str, str], int] = {}
+        self._pending: Dict[Tuple[str, str], int] = {}
+        # Запись дельт и сброс не пересекаются; сброшенные во время записи ("*" — все) не пишутся
+        self._lock = asyncio.Lock()
+        self._forgotten: Set[str] = set()
+        self._task: Optional[asyncio.Task] = None
+        self._reset = self._read_reset()
+
+    def _read_reset(self) -> Optional[Tuple[int, int]]:
+        if not self.reset_path:
+            return None
+        try:
+            st = os.stat(self.reset_path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_mtime_ns
+
+    async def _check_reset(self) -> None:
+        """Apply a reset published by another process (see forget())."""
+        reset = self._read_reset()
+        if reset == self._reset:
+            return
+        self._reset = reset
+        try:
+            with open(self.reset_path) as f:
+                username = f.read().split(maxsplit=1)[1].strip()
+        except (OSError, IndexError):
+            username = "*"
+        await self._drop(None if username == "*" else username)
+
+    async def _drop(self, username: Optional[str]) -> None:
+        # Строки rate_limits уже удалены: несброшенные дельты не нужны, а идущая
+        # сейчас запись не должна вернуть их в таблицу
+        mark = username or "*"
+        self._forgotten.add(mark)
+        async with self._lock:
+            self._forgotten.discard(mark)
+            for table in (self._counts, self._pending):
+                for key in [k for k in table if username is None or k[0] == username]:
+                    del table[key]
+
+    async def _load(self, username: str, date: str) -> int:
+        async with async_engine.connect() as conn:
+            count = await conn.scalar(
+                select(RateLimit.count).where(
+                    RateLimit.username == username, RateLimit.date == date
+                )
+            )
+        return count or 0
+
+    async def hit(self, user: CachedUser) -> int:
+        """Count one request; raises RateLimitExceeded when the quota is used up."""
+        await self._check_reset()
+        key = (user.username, today())
+        if key not in self._counts:
+            # Первое обращение за день: подтягиваем счётчик из БД один раз
+            count = await self._load(*key)
+            self._counts.setdefault(key, count)
+        # Проверка и инкремент без await между ними — атомарны в event loop
+        count = self._counts[key]
+        if count >= user.daily_limit:
+            raise RateLimitExceeded()
+        self._counts[key] = count + 1
+        self._pending[key] = self._pending.get(key, 0) + 1
+        return count + 1
+
+    async def flush(self) -> None:
+        """Write accumulated deltas with one multi-row UPSERT."""
+        async with self._lock:
+            await self._flush()
+
+    def _live(self, pending: Dict[Tuple[str, str], int]) -> Dict[Tuple[str, str], int]:
+        if "*" in self._forgotten:
+            return {}
+        return {key: n for key, n in pending.items() if key[0] not in self._forgotten}
+
+    async def _flush(self) -> None:
+        pending, self._pending = self._pending, {}
+        if not pending:
+            return
+        stmt = upsert(RateLimit)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[RateLimit.username, RateLimit.date],
+            set_={"count": RateLimit.count + stmt.excluded.count},
+        )
+        try:
+            with metrics.timed(metrics.DB_COMMIT, "ratelimit"):
+                async with async_engine.begin() as conn:
+                    # Пока ждали соединение, админка могла сбросить счётчики
+                    pending = self._live(pending)
+                    if pending:
+                        rows = [{"username": u, "date": d, "count": n} for (u, d), n in pending.items()]
+                        await conn.execute(stmt, rows)
+        except Exception:
+            # Вернуть дельты, чтобы не потерять их при следующем сбросе
+            for key, n in self._live(pending).items():
+                self._pending[key] = self._pending.get(key, 0) + n
+            raise
+        # Счётчики прошлых дней больше не нужны
+        current = today()
+        for key in [k for k in self._counts if k[1] != current]:
+            del self._counts[key]
+
+    async def _run(self) -> None:
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logger.exception("Rate limit flush failed")
+
+    async def forget(self, username: Optional[str] = None) -> None:
+        """
+        Drop the cached counters and unwritten deltas of one user (or
+        everyone) here and in every other process, after their rate_limits
+        rows were deleted. Waits for a flush in progress, which skips them.
+        """
+        await self._drop(username)
+        if self.reset_path:
+            tmp = f"{self.reset_path}.{os.getpid()}.tmp"
+            try:
+                with open(tmp, "w") as f:
+                    f.write(f"{secrets.token_hex(8)} {username or '*'}\n")
+                os.replace(tmp, self.reset_path)
+            except OSError:
+                logger.warning("Cannot publish a rate limit reset to %s", self.reset_path, exc_info=True)
+            self._reset = self._read_reset()
+
+    async def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+
+class DBRateLimiter:
+    name = "db"
+
+    async def hit(self, user: CachedUser) -> int:
+        if user.daily_limit <= 0:
+            raise RateLimitExceeded()
+        stmt = upsert(RateLimit).values(username=user.username, date=today(), count=1)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[RateLimit.username, RateLimit.date],
+            set_={"count": RateLimit.count + 1},
+            where=RateLimit.count < user.daily_limit,
+        ).returning(RateLimit.count)
+        with metrics.timed(metrics.DB_COMMIT, "ratelimit"):
+            async with async_engine.begin() as conn:
+                count = await conn.scalar(stmt)
+        if count is None:
+            raise RateLimitExceeded()
+        return count
+
+    async def forget(self, username: Optional[str] = None) -> None:
+        # Счётчики только в БД — сбрасывать нечего
+        pass
+
+    async def start(self) -> None:
+        pass
+
+    async def stop(self) -> None:
+        pass
+
+
+def create_rate_limiter(kind: str = RATE_LIMIT_BACKEND):
+    if kind == "memory":
+        return MemoryRateLimiter()
+    if kind == "db":
+        return DBRateLimiter()
+    raise RuntimeError(f"Unknown RATE_LIMIT_BACKEND '{kind}', expected 'memory' or 'db'")
+
+
+rate_limiter = create_rate_limiter()
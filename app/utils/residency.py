@@ -0,0 +1,468 @@
+# app/utils/residency.py
+"""
+Model residency: which models stay loaded in Ollama's memory.
+
+Hot models are the pinned ones (RESIDENCY_HOT_MODELS) plus the
+RESIDENCY_POPULAR most used installed models. Usage is the number of
+assistant messages per model over the last RESIDENCY_USAGE_DAYS days
+(`messages.model`, re-read every RESIDENCY_USAGE_REFRESH seconds) plus the
+requests counted live since then (touch()).
+
+- When the API starts the hot models are loaded, so the first chat does
+  not pay the load time.
+- During business hours (BUSINESS_HOURS, e.g. "08:00-20:00", on
+  BUSINESS_DAYS, e.g. "mon-fri"; empty = always) every hot model is
+  re-warmed each RESIDENCY_INTERVAL seconds with a keep_alive of
+  RESIDENCY_HOT_KEEP_ALIVE, which outlives the interval, so a popular
+  model is never unloaded by Ollama in between. Outside business hours
+  hot models get the normal keep_alive and unload when idle.
+- Every chat request carries a keep_alive for its model: the hot one,
+  a per-model value from MODEL_KEEP_ALIVE_OVERRIDES ("llama3=24h,phi3=10m")
+  or MODEL_KEEP_ALIVE (empty = Ollama's default).
+- When more than RESIDENCY_MAX_MODELS models are loaded, or their memory
+  (`size_vram` from /api/ps) exceeds RESIDENCY_MEMORY_BUDGET ("24G"), the
+  least used models are unloaded. Pinned models are never evicted, hot
+  ones not during business hours.
+
+With several API workers only one of them (holding a lock next to
+RESIDENCY_STATE_PATH) loads and evicts; all of them send keep_alive. The
+others retry the lock every check, so after a rolling restart one of the
+new workers takes over and preloads the hot models. So
+that the leader does not unload a model another worker is using, every
+worker writes its activity (models with running or queued generations,
+last request per model) to its own file in `RESIDENCY_STATE_PATH.activity/`
+every RESIDENCY_ACTIVITY_INTERVAL seconds. Eviction skips models that are
+busy in any worker or were requested within RESIDENCY_IDLE_SECONDS; files
+not refreshed for three intervals (a worker that died) are ignored. The
+state (resident models, memory, load times, usage) is written to
+RESIDENCY_STATE_PATH, which the admin panel shows.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Set, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import func, select
+
+from app.database import AsyncSessionLocal
+from app.models import Message
+from app.utils.backends import BackendUnavailable, get_backend, set_keep_alive_policy
+from app.utils.inventory import model_inventory
+from app.utils.scheduler import inference_scheduler
+
+# Блокировка файла для выбора ведущего воркера (нет на Windows)
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+load_dotenv()
+
+RESIDENCY = os.getenv("RESIDENCY", "1").lower() not in ("0", "false", "no", "off")
+RESIDENCY_HOT_MODELS = [m.strip() for m in os.getenv("RESIDENCY_HOT_MODELS", "").split(",") if m.strip()]
+RESIDENCY_POPULAR = int(os.getenv("RESIDENCY_POPULAR", "2"))
+RESIDENCY_USAGE_DAYS = float(os.getenv("RESIDENCY_USAGE_DAYS", "7"))
+RESIDENCY_USAGE_REFRESH = float(os.getenv("RESIDENCY_USAGE_REFRESH", "600"))
+RESIDENCY_INTERVAL = float(os.getenv("RESIDENCY_INTERVAL", "60"))
+RESIDENCY_HOT_KEEP_ALIVE = os.getenv("RESIDENCY_HOT_KEEP_ALIVE", "")
+RESIDENCY_MAX_MODELS = int(os.getenv("RESIDENCY_MAX_MODELS", "0"))
+RESIDENCY_MEMORY_BUDGET = os.getenv("RESIDENCY_MEMORY_BUDGET", "0")
+RESIDENCY_ACTIVITY_INTERVAL = float(os.getenv("RESIDENCY_ACTIVITY_INTERVAL", "5"))
+RESIDENCY_IDLE_SECONDS = float(os.getenv("RESIDENCY_IDLE_SECONDS", "30"))
+RESIDENCY_STATE_PATH = os.getenv("RESIDENCY_STATE_PATH", os.path.join(os.getcwd(), "residency.json"))
+MODEL_KEEP_ALIVE = os.getenv("MODEL_KEEP_ALIVE", "")
+MODEL_KEEP_ALIVE_OVERRIDES = os.getenv("MODEL_KEEP_ALIVE_OVERRIDES", "")
+BUSINESS_HOURS = os.getenv("BUSINESS_HOURS", "08:00-20:00")
+BUSINESS_DAYS = os.getenv("BUSINESS_DAYS", "mon-fri")
+
+DAYS = ["mon", "tue", "wed", "thu", "fri", "sat", "sun"]
+
+logger = logging.getLogger(__name__)
+
+
+def parse_size(text: str) -> int:
+    """"24G" -> bytes; plain numbers are bytes."""
+    text = text.strip().upper().rstrip("B")
+    units = {"K": 1024, "M": 1024 ** 2, "G": 1024 ** 3, "T": 1024 ** 4}
+    if text[-1:] in units:
+        return int(float(text[:-1]) * units[text[-1]])
+    return int(float(text or 0))
+
+
+def parse_overrides(spec: str) -> Dict[str, str]:
+    """"llama3=24h, phi3=10m" -> {"llama3": "24h", "phi3": "10m"}."""
+    values: Dict[str, str] = {}
+    for item in spec.split(","):
+        name, sep, value = item.strip().rpartition("=")
+        if sep and name:
+            values[name.strip()] = value.strip()
+    return values
+
+
+def parse_days(spec: str) -> Set[int]:
+    """"mon-fri" / "mon,wed,sat" -> weekday numbers (Monday = 0)."""
+    days: Set[int] = set()
+    for item in spec.lower().split(","):
+        first, _, last = item.strip().partition("-")
+        if first not in DAYS:
+            continue
+        start = DAYS.index(first)
+        end = DAYS.index(last) if last in DAYS else start
+        days.update(d % 7 for d in range(start, end + 1 if end >= start else end + 8))
+    return days
+
+
+def _key(name: str) -> str:
+    return name if ":" in name else f"{name}:latest"
+
+
+class ResidencyManager:
+    def __init__(
+        self,
+        hot_models: Optional[List[str]] = None,
+        popular: int = RESIDENCY_POPULAR,
+        interval: float = RESIDENCY_INTERVAL,
+        max_models: int = RESIDENCY_MAX_MODELS,
+        memory_budget: int = parse_size(RESIDENCY_MEMORY_BUDGET),
+        state_path: str = RESIDENCY_STATE_PATH,
+        enabled: bool = RESIDENCY,
+        activity_interval: float = RESIDENCY_ACTIVITY_INTERVAL,
+        idle_seconds: float = RESIDENCY_IDLE_SECONDS,
+    ):
+        self.pinned = [_key(m) for m in (RESIDENCY_HOT_MODELS if hot_models is None else hot_models)]
+        self.popular = popular
+        self.interval = interval
+        self.max_models = max_models
+        self.memory_budget = memory_budget
+        self.state_path = state_path
+        self.enabled = enabled
+        self.activity_interval = activity_interval
+        self.idle_seconds = idle_seconds
+        self.activity_dir = f"{state_path}.activity"
+        self.activity_path = os.path.join(self.activity_dir, f"{os.getpid()}.json")
+        self.hot_keep_alive = RESIDENCY_HOT_KEEP_ALIVE or f"{int(interval * 3)}s"
+        self.keep_alive = MODEL_KEEP_ALIVE or None
+        self.overrides = {_key(k): v for k, v in parse_overrides(MODEL_KEEP_ALIVE_OVERRIDES).items()}
+        self.hours = self._parse_hours(BUSINESS_HOURS)
+        self.days = parse_days(BUSINESS_DAYS) if BUSINESS_DAYS.strip() else set(range(7))
+        # Использование: из БД за окно + живые счётчики с последнего обновления
+        self.usage: Dict[str, int] = {}
+        self.live: Dict[str, int] = {}
+        self.last_used: Dict[str, float] = {}
+        self.loads: Dict[str, Dict[str, object]] = {}
+        self.resident: List[Dict[str, object]] = []
+        self.evicted: List[Dict[str, object]] = []
+        self._usage_at = 0.0
+        self._hot: List[str] = list(self.pinned)
+        self._lock_file = None
+        self._task: Optional[asyncio.Task] = None
+        self._activity_task: Optional[asyncio.Task] = None
+
+    @staticmethod
+    def _parse_hours(spec: str):
+        spec = spec.strip()
+        if not spec:
+            return None
+        start, _, end = spec.partition("-")
+        h1, m1 = (int(x) for x in start.strip().split(":"))
+        h2, m2 = (int(x) for x in end.strip().split(":"))
+        return h1 * 60 + m1, h2 * 60 + m2
+
+    # ---- usage -----------------------------------------------------------------
+    def touch(self, model: str) -> None:
+        """Count a chat request for `model` (called on the request path)."""
+        key = _key(model)
+        self.live[key] = self.live.get(key, 0) + 1
+        self.last_used[key] = time.time()
+
+    def score(self, model: str) -> int:
+        return self.usage.get(model, 0) + self.live.get(model, 0)
+
+    async def refresh_usage(self) -> None:
+        cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=RESIDENCY_USAGE_DAYS)
+        stmt = (
+            select(Message.model, func.count())
+            .where(Message.role == "assistant", Message.timestamp >= cutoff)
+            .group_by(Message.model)
+        )
+        async with AsyncSessionLocal() as db:
+            rows = (await db.execute(stmt)).all()
+        usage: Dict[str, int] = {}
+        for model, count in rows:
+            usage[_key(model)] = usage.get(_key(model), 0) + count
+        # Живые счётчики уже учтены в БД — начинаем их заново
+        self.usage, self.live = usage, {}
+        self._usage_at = time.monotonic()
+
+    # ---- policy ----------------------------------------------------------------
+    def business_hours(self, now: Optional[datetime] = None) -> bool:
+        now = now or datetime.now()
+        if now.weekday() not in self.days:
+            return False
+        if self.hours is None:
+            return True
+        minute = now.hour * 60 + now.minute
+        start, end = self.hours
+        return start <= minute < end if start <= end else minute >= start or minute < end
+
+    def hot_models(self) -> List[str]:
+        """Pinned models plus the most used installed ones."""
+        hot = list(self.pinned)
+        ranked = sorted((m for m in set(self.usage) | set(self.live) if self.score(m) > 0),
+                        key=self.score, reverse=True)
+        for model in ranked:
+            if len(hot) >= len(self.pinned) + self.popular:
+                break
+            if model not in hot and model_inventory.get(model) is not None:
+                hot.append(model)
+        return hot
+
+    def keep_alive_for(self, model: str) -> Optional[str]:
+        key = _key(model)
+        if key in self._hot and self.business_hours():
+            return self.hot_keep_alive
+        return self.overrides.get(key, self.keep_alive)
+
+    # ---- loading and eviction ----------------------------------------------------
+    async def warm(self, model: str) -> None:
+        """Load a model (or extend its keep_alive) and remember how long a cold load took."""
+        cold = model not in {_key(m["name"]) for m in self.resident}
+        try:
+            seconds = await get_backend().load(model, self.keep_alive_for(model))
+        except (RuntimeError, NotImplementedError) as e:
+            logger.warning("Cannot load model %s: %s", model, e)
+            return
+        if cold:
+            entry = self.loads.setdefault(model, {"count": 0})
+            entry.update(count=entry["count"] + 1, seconds=round(seconds, 3),
+                         at=datetime.now().isoformat(timespec="seconds"))
+            logger.info("Model %s loaded in %.1fs", model, seconds)
+
+    @staticmethod
+    def _local_busy() -> List[str]:
+        """Models with generations running or queued in this process."""
+        return sorted({
+            _key(name) for name, queue in inference_scheduler._queues.items() if queue.running or queue.waiting
+        })
+
+    # ---- activity shared between workers -------------------------------------------------
+    def publish_activity(self) -> None:
+        """Write this worker's busy models and recent requests for the leader."""
+        cutoff = time.time() - self.idle_seconds
+        data = {
+            "busy": self._local_busy(),
+            "last_used": {m: at for m, at in self.last_used.items() if at >= cutoff},
+        }
+        tmp = f"{self.activity_path}.tmp"
+        try:
+            os.makedirs(self.activity_dir, exist_ok=True)
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(data, f)
+            os.replace(tmp, self.activity_path)
+        except OSError:
+            logger.warning("Cannot write residency activity to %s", self.activity_path, exc_info=True)
+
+    def activity(self) -> Tuple[Set[str], Dict[str, float]]:
+        """Busy models and the last request per model across all live workers."""
+        busy = set(self._local_busy())
+        last_used = dict(self.last_used)
+        try:
+            names = os.listdir(self.activity_dir)
+        except OSError:
+            names = []
+        stale = time.time() - 3 * self.activity_interval
+        for name in names:
+            path = os.path.join(self.activity_dir, name)
+            if not name.endswith(".json") or path == self.activity_path:
+                continue
+            try:
+                if os.path.getmtime(path) < stale:
+                    # Воркер остановлен или завис — его активность не учитываем
+                    continue
+                with open(path, encoding="utf-8") as f:
+                    data = json.load(f)
+            except (OSError, ValueError):
+                continue
+            busy.update(data.get("busy", []))
+            for model, at in data.get("last_used", {}).items():
+                last_used[model] = max(last_used.get(model, 0.0), at)
+        return busy, last_used
+
+    async def _publish(self) -> None:
+        while True:
+            self.publish_activity()
+            await asyncio.sleep(self.activity_interval)
+
+    def _over_budget(self, resident: List[Dict[str, object]]) -> bool:
+        if self.max_models and len(resident) > self.max_models:
+            return True
+        if self.memory_budget:
+            return sum(int(m.get("size_vram") or m.get("size") or 0) for m in resident) > self.memory_budget
+        return False
+
+    async def evict(self) -> None:
+        """Unload the least used models while over RESIDENCY_MAX_MODELS / RESIDENCY_MEMORY_BUDGET."""
+        resident = list(self.resident)
+        if not self._over_budget(resident):
+            return
+        protected = set(self.pinned) | (set(self._hot) if self.business_hours() else set())
+        # Модели, занятые или недавно запрошенные в любом воркере, не выгружаем
+        busy, last_used = self.activity()
+        recent = {m for m, at in last_used.items() if at >= time.time() - self.idle_seconds}
+        protected |= busy | recent
+        candidates = sorted(
+            (m for m in resident if _key(m["name"]) not in protected),
+            key=lambda m: (self.score(_key(m["name"])), last_used.get(_key(m["name"]), 0.0)),
+        )
+        for model in candidates:
+            if not self._over_budget(resident):
+                break
+            name = _key(model["name"])
+            try:
+                await get_backend().unload(name)
+            except (RuntimeError, NotImplementedError) as e:
+                logger.warning("Cannot unload model %s: %s", name, e)
+                continue
+            resident.remove(model)
+            self.evicted = (self.evicted + [{
+                "name": name, "at": datetime.now().isoformat(timespec="seconds"), "usage": self.score(name),
+            }])[-20:]
+            logger.info("Model %s unloaded to free memory", name)
+        self.resident = resident
+
+    async def _refresh_resident(self) -> None:
+        try:
+            self.resident = await get_backend().resident_models()
+        except (RuntimeError, NotImplementedError) as e:
+            logger.warning("Cannot list loaded models: %s", e)
+
+    async def step(self, preload: bool = False) -> None:
+        """One pass: usage, warm-up of hot models, eviction, snapshot."""
+        if time.monotonic() - self._usage_at >= RESIDENCY_USAGE_REFRESH:
+            await self.refresh_usage()
+        self._hot = self.hot_models()
+        await self._refresh_resident()
+        if preload or self.business_hours():
+            for model in self._hot:
+                await self.warm(model)
+            await self._refresh_resident()
+        await self.evict()
+        self.write_snapshot()
+
+    # ---- state for the admin panel ---------------------------------------------------
+    def snapshot(self) -> Dict[str, object]:
+        resident = {_key(m["name"]): m for m in self.resident}
+        names = sorted(set(resident) | set(self._hot) | set(self.loads) | set(self.usage) | set(self.live))
+        return {
+            "updated_at": datetime.now().isoformat(timespec="seconds"),
+            "business_hours": self.business_hours(),
+            "memory_used": sum(int(m.get("size_vram") or m.get("size") or 0) for m in self.resident),
+            "memory_budget": self.memory_budget,
+            "max_models": self.max_models,
+            "models": [
+                {
+                    "name": name,
+                    "resident": name in resident,
+                    "host": resident.get(name, {}).get("host"),
+                    "size_vram": resident.get(name, {}).get("size_vram"),
+                    "expires_at": resident.get(name, {}).get("expires_at"),
+                    "hot": "pinned" if name in self.pinned else ("popular" if name in self._hot else ""),
+                    "usage": self.score(name),
+                    "keep_alive": self.keep_alive_for(name),
+                    "load_seconds": self.loads.get(name, {}).get("seconds"),
+                    "loaded_at": self.loads.get(name, {}).get("at"),
+                    "loads": self.loads.get(name, {}).get("count", 0),
+                }
+                for name in names
+            ],
+            "evicted": self.evicted,
+        }
+
+    def write_snapshot(self) -> None:
+        tmp = f"{self.state_path}.tmp"
+        try:
+            with open(tmp, "w", encoding="utf-8") as f:
+                json.dump(self.snapshot(), f, ensure_ascii=False, indent=2)
+            os.replace(tmp, self.state_path)
+        except OSError:
+            logger.warning("Cannot write residency state to %s", self.state_path, exc_info=True)
+
+    # ---- lifecycle ---------------------------------------------------------------------
+    def _acquire(self) -> bool:
+        """Only one process per host loads and evicts."""
+        if fcntl is None:
+            return True
+        try:
+            self._lock_file = open(f"{self.state_path}.lock", "w")
+            fcntl.flock(self._lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            if self._lock_file is not None:
+                self._lock_file.close()
+                self._lock_file = None
+            return False
+        return True
+
+    async def _run(self) -> None:
+        leader = False
+        preload = True
+        while True:
+            if not leader:
+                # Лидер мог смениться после перезапуска воркеров — пробуем взять блокировку снова
+                leader = self._acquire()
+                if leader:
+                    logger.info("Residency leadership acquired by pid %d", os.getpid())
+            try:
+                if leader:
+                    await self.step(preload=preload)
+                    preload = False
+                else:
+                    # Остальные воркеры только выбирают keep_alive для своих запросов
+                    if time.monotonic() - self._usage_at >= RESIDENCY_USAGE_REFRESH:
+                        await self.refresh_usage()
+                    self._hot = self.hot_models()
+            except BackendUnavailable as e:
+                logger.warning("Residency check skipped: %s", e)
+            except Exception:
+                logger.warning("Residency check failed", exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    async def start(self) -> None:
+        if not self.enabled or self._task is not None:
+            return
+        set_keep_alive_policy(self.keep_alive_for)
+        self._task = asyncio.create_task(self._run())
+        self._activity_task = asyncio.create_task(self._publish())
+
+    async def stop(self) -> None:
+        for task in (self._task, self._activity_task):
+            if task is not None:
+                task.cancel()
+                try:
+                    await task
+                except asyncio.CancelledError:
+                    pass
+        self._task = self._activity_task = None
+        try:
+            os.remove(self.activity_path)
+        except OSError:
+            pass
+        set_keep_alive_policy(None)
+        if self._lock_file is not None:
+            self._lock_file.close()
+            self._lock_file = None
+
+
+def read_snapshot(path: str = RESIDENCY_STATE_PATH) -> Optional[Dict[str, object]]:
+    """State written by the API process (None before the first pass)."""
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+residency_manager = ResidencyManager()
@@ -0,0 +1,293 @@
+# app/utils/response_cache.py
+"""
+Completion cache for deterministic chat requests.
+
+Opt-in with RESPONSE_CACHE=1. Only requests sent with `"temperature": 0`
+are cached: the same model, options and effective context (the windowed
+history plus the prompt) then produce the same answer. The key is a
+SHA-256 of exactly those inputs, see completion_key().
+
+Two tiers:
+- an in-process LRU of RESPONSE_CACHE_MEMORY_ENTRIES answers;
+- a SQLite file (RESPONSE_CACHE_PATH) shared by all API workers and kept
+  across restarts, trimmed to RESPONSE_CACHE_MAX_BYTES by least recent use.
+Entries older than RESPONSE_CACHE_TTL seconds are ignored and purged.
+
+clear() drops every answer, or only those of one model (a removed model
+may be reinstalled with other weights under the same name), from both
+tiers. The other processes drop their memory tier when the file
+RESPONSE_CACHE_EVICT_PATH changes (the same scheme as the rate limiter
+resets).
+
+Per request, `Cache-Control: no-cache` skips the lookup but stores the new
+answer, and `Cache-Control: no-store` bypasses the cache completely.
+SQLite calls run in the bounded thread pool (run_blocking).
+"""
+import hashlib
+import json
+import logging
+import os
+import secrets
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+from app.utils import metrics
+from app.utils.concurrency import run_blocking
+
+load_dotenv()
+
+RESPONSE_CACHE = os.getenv("RESPONSE_CACHE", "0").lower() in ("1", "true", "yes", "on")
+RESPONSE_CACHE_PATH = os.getenv(
+    "RESPONSE_CACHE_PATH", os.path.join(os.getcwd(), "response_cache.db")
+)
+RESPONSE_CACHE_TTL = float(os.getenv("RESPONSE_CACHE_TTL", "86400"))
+RESPONSE_CACHE_MEMORY_ENTRIES = int(os.getenv("RESPONSE_CACHE_MEMORY_ENTRIES", "1024"))
+RESPONSE_CACHE_MAX_BYTES = int(os.getenv("RESPONSE_CACHE_MAX_BYTES", str(256 * 1024 * 1024)))
+RESPONSE_CACHE_EVICT_PATH = os.getenv(
+    "RESPONSE_CACHE_EVICT_PATH", os.path.join(os.getcwd(), ".response_cache_evict")
+)
+
+# Размер файла проверяется не на каждой записи, а раз в N записей
+TRIM_EVERY = 100
+
+logger = logging.getLogger(__name__)
+
+
+def completion_key(model: str, options: Dict[str, object], messages: List[Dict[str, str]]) -> str:
+    """Hash of everything that determines the answer."""
+    data = json.dumps(
+        {"model": model, "options": options, "messages": messages},
+        ensure_ascii=False, sort_keys=True, separators=(",", ":"),
+    )
+    return hashlib.sha256(data.encode("utf-8")).hexdigest()
+
+
+def cache_mode(cache_control: str) -> Tuple[bool, bool]:
+    """(lookup, store) for a request's Cache-Control header."""
+    directives = {d.strip().lower() for d in cache_control.split(",")}
+    if "no-store" in directives:
+        return False, False
+    if "no-cache" in directives:
+        return False, True
+    return True, True
+
+
+class ResponseCache:
+    def __init__(
+        self,
+        path: str = RESPONSE_CACHE_PATH,
+        ttl: float = RESPONSE_CACHE_TTL,
+        memory_entries: int = RESPONSE_CACHE_MEMORY_ENTRIES,
+        max_bytes: int = RESPONSE_CACHE_MAX_BYTES,
+        enabled: bool = RESPONSE_CACHE,
+        evict_path: Optional[str] = RESPONSE_CACHE_EVICT_PATH,
+    ):
+        self.path = path
+        self.ttl = ttl
+        self.memory_entries = memory_entries
+        self.max_bytes = max_bytes
+        self.enabled = enabled
+        self.evict_path = evict_path
+        # key -> (model, response, created_at)
+        self._memory: "OrderedDict[str, Tuple[str, str, float]]" = OrderedDict()
+        self._conn: Optional[sqlite3.Connection] = None
+        self._lock = threading.Lock()
+        self._writes = 0
+        self.memory_hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.stores = 0
+        self.evictions = 0
+        self._evict = self._read_evict()
+
+    # ---- SQLite tier (в пуле потоков) ---------------------------------------
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, model TEXT NOT NULL, response TEXT NOT NULL, "
+                "size INTEGER NOT NULL, created_at REAL NOT NULL, used_at REAL NOT NULL)"
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS ix_responses_used_at ON responses (used_at)")
+            self._conn = conn
+        return self._conn
+
+    def _disk_get(self, key: str) -> Optional[Tuple[str, str, float]]:
+        now = time.time()
+        with self._lock:
+            db = self._db()
+            row = db.execute(
+                "SELECT model, response, created_at FROM responses WHERE key = ? AND created_at > ?",
+                (key, now - self.ttl),
+            ).fetchone()
+            if row is not None:
+                db.execute("UPDATE responses SET used_at = ? WHERE key = ?", (now, key))
+                db.commit()
+        return tuple(row) if row is not None else None
+
+    def _disk_put(self, key: str, model: str, response: str, created_at: float) -> None:
+        with self._lock:
+            db = self._db()
+            db.execute(
+                "INSERT OR REPLACE INTO responses (key, model, response, size, created_at, used_at) "
+                "VALUES (?, ?, ?, ?, ?, ?)",
+                (key, model, response, len(response.encode("utf-8")) + len(key), created_at, created_at),
+            )
+            db.commit()
+            self._writes += 1
+            if self._writes % TRIM_EVERY == 0:
+                self._trim(db)
+
+    def _trim(self, db: sqlite3.Connection) -> None:
+        """Drop expired entries, then the least recently used beyond max_bytes."""
+        removed = db.execute(
+            "DELETE FROM responses WHERE created_at <= ?", (time.time() - self.ttl,)
+        ).rowcount
+        total = db.execute("SELECT COALESCE(SUM(size), 0) FROM responses").fetchone()[0]
+        if total > self.max_bytes:
+            excess = total - self.max_bytes
+            keys = []
+            for key, size in db.execute("SELECT key, size FROM responses ORDER BY used_at"):
+                keys.append((key,))
+                excess -= size
+                if excess <= 0:
+                    break
+            db.executemany("DELETE FROM responses WHERE key = ?", keys)
+            removed += len(keys)
+        db.commit()
+        self.evictions += removed
+
+    def _disk_clear(self, models: Optional[List[str]]) -> None:
+        with self._lock:
+            db = self._db()
+            if models is None:
+                db.execute("DELETE FROM responses")
+            else:
+                db.executemany("DELETE FROM responses WHERE model = ?", [(m,) for m in models])
+            db.commit()
+
+    # ---- memory tier ---------------------------------------------------------
+    def _remember(self, key: str, model: str, response: str, created_at: float) -> None:
+        self._memory[key] = (model, response, created_at)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    def _forget(self, models: Optional[List[str]]) -> None:
+        if models is None:
+            self._memory.clear()
+            return
+        for key in [k for k, entry in self._memory.items() if entry[0] in models]:
+            del self._memory[key]
+
+    # ---- eviction across processes -------------------------------------------
+    def _read_evict(self) -> Optional[Tuple[int, int]]:
+        if not self.evict_path:
+            return None
+        try:
+            st = os.stat(self.evict_path)
+        except OSError:
+            return None
+        return st.st_ino, st.st_mtime_ns
+
+    def _check_evict(self) -> None:
+        """Apply a clear() published by another process."""
+        evict = self._read_evict()
+        if evict == self._evict:
+            return
+        self._evict = evict
+        try:
+            with open(self.evict_path) as f:
+                models = f.read().split()[1:]
+        except OSError:
+            models = []
+        self._forget(None if not models or models == ["*"] else models)
+
+    def _publish(self, models: Optional[List[str]]) -> None:
+        tmp = f"{self.evict_path}.{os.getpid()}.tmp"
+        try:
+            with open(tmp, "w") as f:
+                f.write(" ".join([secrets.token_hex(8), *(models or ["*"])]) + "\n")
+            os.replace(tmp, self.evict_path)
+        except OSError:
+            logger.warning("Cannot publish a response cache eviction to %s", self.evict_path, exc_info=True)
+        self._evict = self._read_evict()
+
+    # ---- API -------------------------------------------------------------------
+    async def get(self, key: str) -> Optional[str]:
+        self._check_evict()
+        entry = self._memory.get(key)
+        if entry is not None:
+            if time.time() - entry[2] < self.ttl:
+                self._memory.move_to_end(key)
+                self.memory_hits += 1
+                metrics.CACHE_LOOKUPS.labels("memory_hit").inc()
+                return entry[1]
+            del self._memory[key]
+        try:
+            entry = await run_blocking(self._disk_get, key)
+        except sqlite3.Error:
+            logger.warning("Response cache read failed", exc_info=True)
+            entry = None
+        if entry is None:
+            self.misses += 1
+            metrics.CACHE_LOOKUPS.labels("miss").inc()
+            return None
+        self.disk_hits += 1
+        metrics.CACHE_LOOKUPS.labels("disk_hit").inc()
+        self._remember(key, *entry)
+        return entry[1]
+
+    async def put(self, key: str, model: str, response: str) -> None:
+        created_at = time.time()
+        self._remember(key, model, response, created_at)
+        self.stores += 1
+        try:
+            await run_blocking(self._disk_put, key, model, response, created_at)
+        except sqlite3.Error:
+            logger.warning("Response cache write failed", exc_info=True)
+
+    def stats(self) -> Dict[str, object]:
+        hits = self.memory_hits + self.disk_hits
+        lookups = hits + self.misses
+        return {
+            "enabled": self.enabled,
+            "memory_entries": len(self._memory),
+            "memory_hits": self.memory_hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_ratio": round(hits / lookups, 3) if lookups else 0.0,
+            "stores": self.stores,
+            "evictions": self.evictions,
+        }
+
+    async def clear(self, models: Optional[Iterable[str]] = None) -> None:
+        """Drop every answer, or the answers of `models`, here and in every other process."""
+        if not self.enabled:
+            return
+        models = list(models) if models is not None else None
+        self._forget(models)
+        try:
+            await run_blocking(self._disk_clear, models)
+        except sqlite3.Error:
+            logger.warning("Response cache clear failed", exc_info=True)
+        if self.evict_path:
+            self._publish(models)
+
+    def close(self) -> None:
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+response_cache = ResponseCache()
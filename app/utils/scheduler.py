@@ -0,0 +1,274 @@
+# app/utils/scheduler.py
+"""
+Inference scheduler: per-model concurrency limits with fair queuing.
+
+Every chat request takes a slot on its model before talking to the
+backend. A model runs at most SCHED_MODEL_CONCURRENCY generations at once
+(per-model overrides in SCHED_MODEL_LIMITS, e.g. "llama3:70b=1,phi3=4");
+further requests wait in a bounded queue.
+
+Waiting requests are kept per user and served round-robin across users,
+so a user with many queued requests cannot starve the others. Requests of
+admins form a separate queue that is always served first.
+
+Backpressure is immediate: a request is rejected before it waits when the
+model queue already holds SCHED_QUEUE_SIZE requests (QueueFull, 503) or
+the user already has SCHED_USER_QUEUE requests queued for the model
+(UserQueueFull, 429). A request that waits longer than SCHED_QUEUE_TIMEOUT
+seconds is rejected as well. Rejections carry a Retry-After estimate based
+on the recent generation time.
+
+`llama3` and `llama3:latest` share one queue (and one limit): names
+without a tag are keyed as `name:latest`, as Ollama resolves them.
+
+Limits are per API process; with several workers the effective limit on
+the Ollama host is the per-process limit times the number of workers.
+"""
+import asyncio
+import math
+import os
+import time
+from collections import OrderedDict, deque
+from typing import Deque, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from app.utils import metrics
+
+load_dotenv()
+
+SCHED_MODEL_CONCURRENCY = int(os.getenv("SCHED_MODEL_CONCURRENCY", "2"))
+SCHED_MODEL_LIMITS = os.getenv("SCHED_MODEL_LIMITS", "")
+SCHED_QUEUE_SIZE = int(os.getenv("SCHED_QUEUE_SIZE", "32"))
+SCHED_USER_QUEUE = int(os.getenv("SCHED_USER_QUEUE", "4"))
+SCHED_QUEUE_TIMEOUT = float(os.getenv("SCHED_QUEUE_TIMEOUT", "120"))
+
+# Сколько последних ожиданий хранить для перцентилей
+WAIT_SAMPLES = 500
+
+
+def model_key(name: str) -> str:
+    """Queue key of a model: `llama3` -> `llama3:latest`."""
+    return name if ":" in name else f"{name}:latest"
+
+
+def parse_limits(spec: str) -> Dict[str, int]:
+    """"llama3:70b=1, phi3=4" -> {"llama3:70b": 1, "phi3:latest": 4}."""
+    limits: Dict[str, int] = {}
+    for item in spec.split(","):
+        name, sep, value = item.strip().rpartition("=")
+        if sep and name:
+            limits[model_key(name.strip())] = max(1, int(value))
+    return limits
+
+
+class SchedulerRejected(Exception):
+    """The request was not admitted; retry after `retry_after` seconds."""
+
+    status_code = 503
+
+    def __init__(self, message: str, retry_after: int):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class QueueFull(SchedulerRejected):
+    status_code = 503
+
+
+class UserQueueFull(SchedulerRejected):
+    status_code = 429
+
+
+class QueueTimeout(SchedulerRejected):
+    status_code = 503
+
+
+class Ticket:
+    """A place in a model queue; becomes a running slot once granted."""
+
+    def __init__(self, queue: "ModelQueue", user: str, admin: bool):
+        self.queue = queue
+        self.user = user
+        self.admin = admin
+        self.enqueued_at = time.monotonic()
+        self.granted_at: Optional[float] = None
+        self.released = False
+        self._future: asyncio.Future = asyncio.get_running_loop().create_future()
+
+    @property
+    def waited(self) -> float:
+        end = self.granted_at if self.granted_at is not None else time.monotonic()
+        return end - self.enqueued_at
+
+    async def wait(self, timeout: Optional[float] = SCHED_QUEUE_TIMEOUT) -> None:
+        """Wait until the slot is granted; raises QueueTimeout."""
+        try:
+            await asyncio.wait_for(asyncio.shield(self._future), timeout)
+        except asyncio.TimeoutError:
+            self.release()
+            self.queue.rejected += 1
+            metrics.REJECTIONS.labels("queue_timeout").inc()
+            raise QueueTimeout(
+                f"Model '{self.queue.model}' is busy, waited {timeout:g}s",
+                self.queue.retry_after(),
+            )
+        except asyncio.CancelledError:
+            # Клиент ушёл: освобождаем место (или уже выданный слот)
+            self.release()
+            raise
+
+    def release(self) -> None:
+        if not self.released:
+            self.released = True
+            self.queue._release(self)
+
+
+class ModelQueue:
+    def __init__(self, model: str, limit: int, size: int, user_size: int):
+        self.model = model
+        self.limit = limit
+        self.size = size
+        self.user_size = user_size
+        self.running = 0
+        self.waiting = 0
+        self._admin: Deque[Ticket] = deque()
+        # Очереди пользователей в порядке обхода round-robin
+        self._users: "OrderedDict[str, Deque[Ticket]]" = OrderedDict()
+        self.served = 0
+        self.rejected = 0
+        self._waits: Deque[float] = deque(maxlen=WAIT_SAMPLES)
+        self._service: Optional[float] = None
+
+    def retry_after(self) -> int:
+        """Seconds until a new request would likely get a slot."""
+        service = self._service or 10.0
+        return max(1, math.ceil(service * (self.waiting + 1) / self.limit))
+
+    def enqueue(self, user: str, admin: bool) -> Ticket:
+        if not admin:
+            if self.waiting >= self.size:
+                self.rejected += 1
+                metrics.REJECTIONS.labels("queue_full").inc()
+                raise QueueFull(f"Model '{self.model}' queue is full", self.retry_after())
+            if len(self._users.get(user, ())) >= self.user_size:
+                self.rejected += 1
+                metrics.REJECTIONS.labels("user_queue_full").inc()
+                raise UserQueueFull(
+                    f"Too many queued requests for model '{self.model}'", self.retry_after()
+                )
+        ticket = Ticket(self, user, admin)
+        if admin:
+            self._admin.append(ticket)
+        else:
+            self._users.setdefault(user, deque()).append(ticket)
+        self.waiting += 1
+        self._dispatch()
+        self._gauges()
+        return ticket
+
+    def _next(self) -> Optional[Ticket]:
+        if self._admin:
+            return self._admin.popleft()
+        if not self._users:
+            return None
+        user, tickets = self._users.popitem(last=False)
+        ticket = tickets.popleft()
+        if tickets:
+            # Пользователь с оставшимися запросами уходит в конец круга
+            self._users[user] = tickets
+        return ticket
+
+    def _dispatch(self) -> None:
+        while self.running < self.limit:
+            ticket = self._next()
+            if ticket is None:
+                return
+            self.waiting -= 1
+            ticket.granted_at = time.monotonic()
+            self._waits.append(ticket.waited)
+            self.running += 1
+            self.served += 1
+            metrics.QUEUE_WAIT.labels(self.model).observe(ticket.waited)
+            ticket._future.set_result(None)
+
+    def _release(self, ticket: Ticket) -> None:
+        if ticket.granted_at is None:
+            # Ещё в очереди — просто убираем
+            queue = self._admin if ticket.admin else self._users.get(ticket.user)
+            if queue is not None and ticket in queue:
+                queue.remove(ticket)
+                self.waiting -= 1
+                if not ticket.admin and not queue:
+                    del self._users[ticket.user]
+            ticket._future.cancel()
+            self._gauges()
+            return
+        self.running -= 1
+        elapsed = time.monotonic() - ticket.granted_at
+        self._service = elapsed if self._service is None else 0.8 * self._service + 0.2 * elapsed
+        self._dispatch()
+        self._gauges()
+
+    def _gauges(self) -> None:
+        metrics.QUEUE_DEPTH.labels(self.model).set(self.waiting)
+        metrics.INFERENCE_RUNNING.labels(self.model).set(self.running)
+
+    def stats(self) -> Dict[str, object]:
+        waits = sorted(self._waits)
+
+        def pct(p: float) -> float:
+            return round(waits[min(len(waits) - 1, int(p * len(waits)))], 3) if waits else 0.0
+
+        return {
+            "model": self.model,
+            "limit": self.limit,
+            "running": self.running,
+            "queued": self.waiting,
+            "queued_users": len(self._users),
+            "queued_admin": len(self._admin),
+            "served": self.served,
+            "rejected": self.rejected,
+            "wait_p50": pct(0.50),
+            "wait_p95": pct(0.95),
+            "wait_max": round(waits[-1], 3) if waits else 0.0,
+            "avg_generation": round(self._service, 3) if self._service is not None else None,
+        }
+
+
+class InferenceScheduler:
+    def __init__(
+        self,
+        concurrency: int = SCHED_MODEL_CONCURRENCY,
+        limits: Optional[Dict[str, int]] = None,
+        queue_size: int = SCHED_QUEUE_SIZE,
+        user_queue: int = SCHED_USER_QUEUE,
+    ):
+        self.concurrency = concurrency
+        if limits is None:
+            limits = parse_limits(SCHED_MODEL_LIMITS)
+        self.limits = {model_key(name): limit for name, limit in limits.items()}
+        self.queue_size = queue_size
+        self.user_queue = user_queue
+        self._queues: Dict[str, ModelQueue] = {}
+
+    def queue(self, model: str) -> ModelQueue:
+        model = model_key(model)
+        queue = self._queues.get(model)
+        if queue is None:
+            limit = self.limits.get(model, self.concurrency)
+            queue = self._queues[model] = ModelQueue(model, limit, self.queue_size, self.user_queue)
+        return queue
+
+    def enqueue(self, model: str, user: str, admin: bool = False) -> Ticket:
+        """
+        Take a place in the model queue without waiting. Raises
+        SchedulerRejected right away if the request cannot be queued.
+        """
+        return self.queue(model).enqueue(user, admin)
+
+    def stats(self) -> List[Dict[str, object]]:
+        return [queue.stats() for queue in self._queues.values()]
+
+
+inference_scheduler = InferenceScheduler()
@@ -0,0 +1,244 @@
+# app/utils/search.py
+"""
+Full-text search over messages.content with SQLite FTS5.
+
+`messages_fts` is an external-content FTS5 table: it stores only the
+inverted index and reads the text back from `messages` by rowid (= id), so
+the history is not stored twice. Triggers on `messages` keep it in sync on
+every INSERT / UPDATE / DELETE, whichever path writes (write-behind queue,
+import, admin clear). Turns still waiting in the write-behind queue are not
+searchable until they are flushed.
+
+migrate() creates the table and the triggers. A database that already holds
+up to SEARCH_AUTO_INDEX_LIMIT messages is indexed right away; larger ones
+are indexed with `python cli.py reindex` (also repairs a damaged index).
+
+Queries are built from plain text (see match_query): every word must occur,
+"quoted phrases" match as a phrase, `word*` matches a prefix. Results are
+ranked by bm25 and carry an HTML-escaped snippet with the matches wrapped
+in <mark>.
+
+Only sessions with an owner (sessions.username) are found by a user's own
+search. Sessions created before the column existed have no record of who
+started them, so migrate() cannot backfill it; they stay visible to
+administrators searching across all sessions.
+
+Other databases (PostgreSQL) have no messages_fts; the endpoint answers 501.
+"""
+import html
+import logging
+import os
+import re
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import column, func, literal_column, select, table, text
+from sqlalchemy.engine import Connection, Engine
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.models import Message, Session as SessionModel
+
+load_dotenv()
+
+SEARCH_AUTO_INDEX_LIMIT = int(os.getenv("SEARCH_AUTO_INDEX_LIMIT", "200000"))
+SNIPPET_TOKENS = int(os.getenv("SEARCH_SNIPPET_TOKENS", "16"))
+SNIPPET_OPEN, SNIPPET_CLOSE, SNIPPET_ELLIPSIS = "<mark>", "</mark>", "…"
+# snippet() вставляет маркеры в сырой текст: сначала экранируем его, потом меняем маркеры на теги
+_MARK_OPEN, _MARK_CLOSE = "\x02", "\x03"
+
+FTS_TABLE = "messages_fts"
+
+logger = logging.getLogger(__name__)
+
+# unicode61 с remove_diacritics 2 — регистр и диакритика не важны, кириллица тоже
+CREATE_TABLE = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {FTS_TABLE} USING fts5("
+    "content, content='messages', content_rowid='id', "
+    "tokenize='unicode61 remove_diacritics 2')"
+)
+
+TRIGGERS = {
+    "messages_fts_insert": (
+        "AFTER INSERT ON messages BEGIN "
+        f"INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content); END"
+    ),
+    "messages_fts_delete": (
+        "AFTER DELETE ON messages BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content); END"
+    ),
+    "messages_fts_update": (
+        "AFTER UPDATE OF content ON messages BEGIN "
+        f"INSERT INTO {FTS_TABLE}({FTS_TABLE}, rowid, content) VALUES ('delete', old.id, old.content); "
+        f"INSERT INTO {FTS_TABLE}(rowid, content) VALUES (new.id, new.content); END"
+    ),
+}
+
+_available = False
+
+
+def fts5_supported(conn: Connection) -> bool:
+    if conn.dialect.name != "sqlite":
+        return False
+    return conn.execute(text(
+        "SELECT 1 FROM pragma_compile_options WHERE compile_options = 'ENABLE_FTS5'"
+    )).first() is not None
+
+
+def fts_exists(conn: Connection) -> bool:
+    return conn.execute(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": FTS_TABLE}
+    ).first() is not None
+
+
+def create_triggers(conn: Connection) -> None:
+    for name, body in TRIGGERS.items():
+        conn.execute(text(f"CREATE TRIGGER IF NOT EXISTS {name} {body}"))
+
+
+def drop_triggers(conn: Connection) -> None:
+    for name in TRIGGERS:
+        conn.execute(text(f"DROP TRIGGER IF EXISTS {name}"))
+
+
+def rebuild_index(conn: Connection) -> None:
+    """Re-read every message into the index and merge its segments."""
+    conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('rebuild')"))
+    conn.execute(text(f"INSERT INTO {FTS_TABLE}({FTS_TABLE}) VALUES ('optimize')"))
+
+
+def create_fts(conn: Connection) -> None:
+    """Create messages_fts and its triggers (idempotent; used by migrate())."""
+    if not fts5_supported(conn):
+        return
+    created = not fts_exists(conn)
+    conn.execute(text(CREATE_TABLE))
+    create_triggers(conn)
+    if not created:
+        return
+    count = conn.execute(text("SELECT COUNT(*) FROM messages")).scalar()
+    if count <= SEARCH_AUTO_INDEX_LIMIT:
+        rebuild_index(conn)
+    else:
+        logger.warning(
+            "Full-text index created empty: %d messages exceed SEARCH_AUTO_INDEX_LIMIT, "
+            "run `python cli.py reindex`", count,
+        )
+
+
+def reindex(engine: Engine) -> Tuple[int, float]:
+    """Create (if needed) and rebuild the index; returns (messages, seconds)."""
+    started = time.perf_counter()
+    with engine.begin() as conn:
+        if not fts5_supported(conn):
+            raise RuntimeError("Full-text search needs SQLite with FTS5")
+        conn.execute(text(CREATE_TABLE))
+        create_triggers(conn)
+        rebuild_index(conn)
+        count = conn.execute(text("SELECT COUNT(*) FROM messages")).scalar()
+    return count, time.perf_counter() - started
+
+
+async def available(db: AsyncSession) -> bool:
+    """
+    Whether messages_fts exists. Only a positive answer is remembered: the
+    index may be created later (`python cli.py reindex`) without a restart.
+    """
+    global _available
+    if _available:
+        return True
+    if db.bind.dialect.name != "sqlite":
+        return False
+    found = await db.scalar(
+        text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = :name"), {"name": FTS_TABLE}
+    )
+    _available = found is not None
+    return _available
+
+
+_TERM = re.compile(r'"([^"]*)"|(\S+)')
+
+
+def match_query(q: str) -> str:
+    """
+    Plain text -> FTS5 query. Every term is quoted, so FTS5 operators and
+    punctuation in the input are never a syntax error.
+    """
+    terms = []
+    for phrase, word in _TERM.findall(q):
+        value = phrase or word
+        prefix = not phrase and value.endswith("*")
+        value = value.rstrip("*") if prefix else value
+        # Только разделители (пунктуация) — не ищем
+        if not re.search(r"\w", value):
+            continue
+        value = value.replace('"', '""')
+        terms.append(f'"{value}"*' if prefix else f'"{value}"')
+    return " ".join(terms)
+
+
+def highlight(snippet: str) -> str:
+    """HTML-escape a snippet() result and turn its match markers into <mark> tags."""
+    return html.escape(snippet).replace(_MARK_OPEN, SNIPPET_OPEN).replace(_MARK_CLOSE, SNIPPET_CLOSE)
+
+
+def _utc(value: Optional[datetime]) -> Optional[datetime]:
+    # В БД время хранится в UTC без зоны
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+async def search_messages(
+    db: AsyncSession,
+    match: str,
+    username: Optional[str] = None,
+    model: Optional[str] = None,
+    role: Optional[str] = None,
+    session_id: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    limit: int = 20,
+    offset: int = 0,
+) -> List[Dict[str, object]]:
+    """
+    Messages matching `match` (see match_query), best first. `username`
+    limits the search to that user's sessions (sessions without an owner are
+    never matched). Returns up to `limit` rows.
+    """
+    fts = table(FTS_TABLE, column("rowid"))
+    fts_ref = literal_column(FTS_TABLE)
+    rank = func.bm25(fts_ref).label("rank")
+    query = (
+        select(
+            Message.id,
+            Message.session_id,
+            Message.role,
+            Message.model,
+            Message.timestamp,
+            func.snippet(fts_ref, -1, _MARK_OPEN, _MARK_CLOSE, SNIPPET_ELLIPSIS, SNIPPET_TOKENS).label("snippet"),
+            rank,
+        )
+        .select_from(fts)
+        .join(Message, Message.id == fts.c.rowid)
+        .where(fts_ref.op("MATCH")(match))
+    )
+    if username is not None:
+        query = query.join(SessionModel, SessionModel.session_id == Message.session_id).where(
+            SessionModel.username == username
+        )
+    if model is not None:
+        query = query.where(Message.model == model)
+    if role is not None:
+        query = query.where(Message.role == role)
+    if session_id is not None:
+        query = query.where(Message.session_id == session_id)
+    if since is not None:
+        query = query.where(Message.timestamp >= _utc(since))
+    if until is not None:
+        query = query.where(Message.timestamp < _utc(until))
+    # bm25 отрицателен: чем меньше, тем релевантнее; id — стабильный порядок страниц
+    query = query.order_by(rank, Message.id.desc()).limit(limit).offset(offset)
+    rows = (await db.execute(query)).all()
+    return [{**row._asdict(), "snippet": highlight(row.snippet)} for row in rows]
@@ -0,0 +1,207 @@
+# app/utils/singleflight.py
+"""
+Single-flight coalescing of identical in-flight generations.
+
+Deterministic chat requests (`"temperature": 0`, the same condition as
+for the response cache) with the same completion key (model, options,
+effective context and prompt, see app.utils.response_cache.completion_key)
+that arrive while a generation for that key is queued or running attach to it
+instead of starting their own. The generation runs in a background task
+owned by the Flight, not by the request that started it:
+
+- every subscriber gets the full token stream (tokens produced before it
+  joined are replayed first) or, in non-streaming mode, the final text;
+- a subscriber that disconnects only detaches; the generation is
+  cancelled when the last subscriber is gone;
+- errors (including a rejected queue slot) reach every subscriber.
+
+Each caller still records the turn in its own session. Disabled with
+SINGLEFLIGHT=0; a sampled request (any other temperature) or one with
+`Cache-Control: no-store` always gets a generation of its own.
+"""
+import asyncio
+import logging
+import os
+import time
+from typing import AsyncIterator, Awaitable, Callable, Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from app.utils import metrics
+from app.utils.backends import TokenStream
+
+load_dotenv()
+
+SINGLEFLIGHT = os.getenv("SINGLEFLIGHT", "1").lower() not in ("0", "false", "no", "off")
+
+logger = logging.getLogger(__name__)
+
+
+class Flight:
+    """One generation and the requests waiting for it."""
+
+    def __init__(self, key: str, model: str):
+        self.key = key
+        self.model = model
+        self.tokens: List[str] = []
+        self.opened = False
+        self.finished = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.started_at = time.monotonic()
+        self._task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    @property
+    def text(self) -> str:
+        return "".join(self.tokens).strip()
+
+    def _notify(self) -> None:
+        # Будим всех ожидающих и заводим новое событие для следующего обновления
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    async def wait_open(self) -> None:
+        """Wait until tokens start flowing; re-raises a failure to start."""
+        while not (self.opened or self.finished):
+            await self._changed.wait()
+        if not self.opened and self.error is not None:
+            raise self.error
+
+    async def result(self) -> str:
+        """Wait for the complete answer."""
+        while not self.finished:
+            await self._changed.wait()
+        if self.error is not None:
+            raise self.error
+        return self.text
+
+    async def _follow(self) -> AsyncIterator[str]:
+        sent = 0
+        while True:
+            changed = self._changed
+            while sent < len(self.tokens):
+                yield self.tokens[sent]
+                sent += 1
+            if self.finished:
+                if self.error is not None:
+                    raise self.error
+                return
+            await changed.wait()
+
+
+class SingleFlight:
+    def __init__(self, enabled: bool = SINGLEFLIGHT):
+        self.enabled = enabled
+        self._flights: Dict[str, Flight] = {}
+        self.started = 0
+        self.joined = 0
+
+    def join(self, key: str) -> Optional[Flight]:
+        """Attach to the generation running for `key`, if there is one."""
+        if not self.enabled:
+            return None
+        flight = self._flights.get(key)
+        if flight is None or flight.finished:
+            return None
+        flight.subscribers += 1
+        self.joined += 1
+        metrics.SINGLEFLIGHT_JOINS.inc()
+        return flight
+
+    def start(
+        self,
+        key: str,
+        model: str,
+        open_stream: Callable[[], Awaitable[TokenStream]],
+        on_complete: Optional[Callable[[str], Awaitable[None]]] = None,
+        on_finish: Optional[Callable[[], None]] = None,
+        share: bool = True,
+    ) -> Flight:
+        """
+        Start a generation in the background; the caller is its first subscriber.
+        `on_complete(text)` runs after a successful generation, `on_finish()`
+        always runs at the end (e.g. to release the model slot).
+        """
+        flight = Flight(key, model)
+        flight.subscribers = 1
+        if share and self.enabled:
+            self._flights[key] = flight
+        self.started += 1
+        flight._task = asyncio.create_task(self._run(flight, open_stream, on_complete, on_finish))
+        return flight
+
+    async def _run(self, flight, open_stream, on_complete, on_finish) -> None:
+        tokens: Optional[TokenStream] = None
+        outcome = "error"
+        started = first = None
+        try:
+            tokens = await open_stream()
+            # Время генерации считаем без ожидания в очереди модели
+            started = time.perf_counter()
+            flight.opened = True
+            flight._notify()
+            async for token in tokens:
+                if first is None:
+                    first = time.perf_counter()
+                    metrics.INFERENCE_TTFT.labels(flight.model).observe(first - started)
+                flight.tokens.append(token)
+                flight._notify()
+            outcome = "ok"
+            if on_complete is not None:
+                await on_complete(flight.text)
+        except asyncio.CancelledError:
+            outcome = "cancelled"
+            flight.error = RuntimeError(f"Generation with model '{flight.model}' was cancelled")
+        except Exception as e:
+            flight.error = e
+        finally:
+            if started is not None:
+                self._observe(flight, outcome, started, first)
+            if tokens is not None:
+                await tokens.cancel()
+            if on_finish is not None:
+                on_finish()
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+            flight.finished = True
+            flight._notify()
+
+    @staticmethod
+    def _observe(flight: Flight, outcome: str, started: float, first: Optional[float]) -> None:
+        finished = time.perf_counter()
+        count = len(flight.tokens)
+        metrics.INFERENCE_DURATION.labels(flight.model, outcome).observe(finished - started)
+        metrics.INFERENCE_TOKENS.labels(flight.model).inc(count)
+        if first is not None and count > 1 and finished > first:
+            metrics.INFERENCE_TOKEN_RATE.labels(flight.model).observe((count - 1) / (finished - first))
+
+    def leave(self, flight: Flight) -> None:
+        """Detach a subscriber; the last one out cancels an unfinished generation."""
+        flight.subscribers -= 1
+        if flight.subscribers <= 0 and not flight.finished and flight._task is not None:
+            flight._task.cancel()
+
+    def subscribe(self, flight: Flight) -> TokenStream:
+        """Token stream of the flight for one subscriber; cancel() detaches it."""
+        left = False
+
+        async def detach() -> None:
+            nonlocal left
+            if not left:
+                left = True
+                self.leave(flight)
+
+        return TokenStream(flight._follow(), detach)
+
+    def stats(self) -> Dict[str, object]:
+        return {
+            "enabled": self.enabled,
+            "in_flight": len(self._flights),
+            "subscribers": sum(f.subscribers for f in self._flights.values()),
+            "started": self.started,
+            "joined": self.joined,
+        }
+
+
+single_flight = SingleFlight()
@@ -0,0 +1,353 @@
+# app/utils/stub_ollama.py
+"""
+Local stub of the Ollama HTTP API for throughput and latency testing
+without a real model.
+
+Implements /api/chat, /api/generate (streaming and non-streaming),
+/api/tags, /api/ps, /api/pull and /api/delete with a configurable
+time-to-first-token and token rate; --drop-after cuts streaming replies
+short to simulate a lost connection. Models are "loaded" on first use (a
+cold start costs --load-seconds) and unloaded when their keep_alive runs
+out; /api/generate without a prompt only loads (or, with keep_alive 0,
+unloads) the model, as in Ollama.
+
+Запуск:
+    python -m app.utils.stub_ollama --port 11435 --latency 0.05 --tokens-per-sec 200
+"""
+import argparse
+import json
+import threading
+import time
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Dict, List, Optional
+
+
+class StubState:
+    """Mutable state shared by all handler threads."""
+
+    def __init__(
+        self,
+        latency: float = 0.0,
+        tokens_per_sec: float = 0.0,
+        reply_tokens: int = 16,
+        models: Optional[List[str]] = None,
+        load_seconds: float = 0.0,
+        drop_after: Optional[int] = None,
+    ):
+        self.latency = latency
+        self.tokens_per_sec = tokens_per_sec
+        self.reply_tokens = reply_tokens
+        self.load_seconds = load_seconds
+        # Оборвать потоковый ответ после стольких токенов (проверка обрыва соединения)
+        self.drop_after = drop_after
+        self.loads = 0
+        self.models: Dict[str, dict] = {}
+        self.loaded: Dict[str, dict] = {}
+        self.lock = threading.Lock()
+        self.requests = 0
+        # Принятые TCP-соединения: клиент с пулом keep-alive открывает их мало
+        self.connections = 0
+        for name in models or ["stub:latest"]:
+            self.add_model(name)
+
+    def add_model(self, name: str) -> None:
+        if ":" not in name:
+            name = f"{name}:latest"
+        self.models[name] = {
+            "name": name,
+            "model": name,
+            "size": 1024 * 1024,
+            "digest": f"{abs(hash(name)):064x}"[:64],
+            "modified_at": datetime.now(timezone.utc).isoformat(),
+        }
+
+    def find_model(self, name: str) -> Optional[str]:
+        if name in self.models:
+            return name
+        if f"{name}:latest" in self.models:
+            return f"{name}:latest"
+        return None
+
+    def resident(self) -> List[dict]:
+        """Loaded models whose keep_alive has not run out."""
+        now = time.time()
+        with self.lock:
+            for name in [n for n, m in self.loaded.items() if m["_expires"] is not None and m["_expires"] <= now]:
+                del self.loaded[name]
+            return [
+                {k: v for k, v in m.items() if not k.startswith("_")} for m in self.loaded.values()
+            ]
+
+    def load(self, name: str, keep_alive) -> float:
+        """Load (or refresh) a model; returns the simulated load time."""
+        self.resident()
+        seconds = parse_keep_alive(keep_alive)
+        with self.lock:
+            cold = name not in self.loaded
+        if cold and self.load_seconds:
+            time.sleep(self.load_seconds)
+        expires = None if seconds < 0 else time.time() + seconds
+        with self.lock:
+            if cold:
+                self.loads += 1
+            self.loaded[name] = {
+                **self.models[name],
+                "size_vram": self.models[name]["size"],
+                "expires_at": datetime.fromtimestamp(expires, timezone.utc).isoformat() if expires else "forever",
+                "_expires": expires,
+            }
+        return self.load_seconds if cold else 0.0
+
+    def unload(self, name: str) -> None:
+        with self.lock:
+            self.loaded.pop(name, None)
+
+    def reply_for(self, model: str, prompt: str) -> List[str]:
+        words = f"stub reply from {model} to: {prompt}".split()
+        tokens = [w + " " for w in words]
+        while len(tokens) < self.reply_tokens:
+            tokens.append("lorem ")
+        return tokens[: max(self.reply_tokens, 1)]
+
+
+def parse_keep_alive(value) -> float:
+    """Ollama keep_alive ("5m", "1h", "30s", seconds, negative = forever) in seconds."""
+    if value is None or value == "":
+        return 300.0
+    if isinstance(value, (int, float)):
+        return float(value)
+    units = {"s": 1, "m": 60, "h": 3600}
+    text = str(value).strip()
+    if text[-1:] in units:
+        return float(text[:-1]) * units[text[-1]]
+    return float(text)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True
+    state: StubState = None
+
+    def log_message(self, format, *args):  # noqa: A002 - stdlib signature
+        pass
+
+    def setup(self) -> None:
+        super().setup()
+        with self.state.lock:
+            self.state.connections += 1
+
+    # ---- helpers ----------------------------------------------------------
+    def _read_json(self) -> dict:
+        length = int(self.headers.get("Content-Length") or 0)
+        if not length:
+            return {}
+        try:
+            return json.loads(self.rfile.read(length))
+        except ValueError:
+            return {}
+
+    def _send_json(self, data: dict, status: int = 200) -> None:
+        body = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _start_stream(self) -> None:
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Transfer-Encoding", "chunked")
+        self.end_headers()
+
+    def _write_chunk(self, data: dict) -> None:
+        line = (json.dumps(data) + "\n").encode()
+        self.wfile.write(f"{len(line):x}\r\n".encode() + line + b"\r\n")
+        self.wfile.flush()
+
+    def _end_stream(self) -> None:
+        self.wfile.write(b"0\r\n\r\n")
+        self.wfile.flush()
+
+    # ---- routing -----------------------------------------------------------
+    def do_GET(self):
+        if self.path == "/":
+            body = b"Ollama is running"
+            self.send_response(200)
+            self.send_header("Content-Type", "text/plain")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+        elif self.path == "/api/tags":
+            self._send_json({"models": list(self.state.models.values())})
+        elif self.path == "/api/ps":
+            self._send_json({"models": self.state.resident()})
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_POST(self):
+        body = self._read_json()
+        if self.path == "/api/chat":
+            messages = body.get("messages") or [{}]
+            self._complete(body, messages[-1].get("content", ""), chat=True)
+        elif self.path == "/api/generate" and not body.get("prompt"):
+            self._load(body)
+        elif self.path == "/api/generate":
+            self._complete(body, body.get("prompt", ""), chat=False)
+        elif self.path == "/api/pull":
+            self._pull(body)
+        else:
+            self._send_json({"error": "not found"}, 404)
+
+    def do_DELETE(self):
+        body = self._read_json()
+        name = self.state.find_model(body.get("model") or body.get("name", ""))
+        if self.path != "/api/delete" or name is None:
+            self._send_json({"error": "model not found"}, 404)
+            return
+        with self.state.lock:
+            self.state.models.pop(name, None)
+            self.state.loaded.pop(name, None)
+        self._send_json({})
+
+    # ---- endpoints ---------------------------------------------------------
+    def _complete(self, body: dict, prompt: str, chat: bool) -> None:
+        model = body.get("model", "")
+        name = self.state.find_model(model)
+        if name is None:
+            self._send_json({"error": f"model '{model}' not found"}, 404)
+            return
+        with self.state.lock:
+            self.state.requests += 1
+        started = time.perf_counter()
+        # Как Ollama: модель загружается в память при первом запросе
+        self.state.load(name, body.get("keep_alive"))
+        tokens = self.state.reply_for(model, prompt)
+        num_predict = (body.get("options") or {}).get("num_predict")
+        if num_predict:
+            tokens = tokens[: int(num_predict)]
+        delay = 1.0 / self.state.tokens_per_sec if self.state.tokens_per_sec > 0 else 0.0
+        if self.state.latency:
+            time.sleep(self.state.latency)
+
+        def frame(text: str, done: bool) -> dict:
+            data = {"model": model, "created_at": datetime.now(timezone.utc).isoformat(), "done": done}
+            if chat:
+                data["message"] = {"role": "assistant", "content": text}
+            else:
+                data["response"] = text
+            if done:
+                data["total_duration"] = int((time.perf_counter() - started) * 1e9)
+                data["eval_count"] = len(tokens)
+            return data
+
+        if body.get("stream", True):
+            self._start_stream()
+            try:
+                for i, tok in enumerate(tokens):
+                    if self.state.drop_after is not None and i >= self.state.drop_after:
+                        self.close_connection = True
+                        return
+                    if delay:
+                        time.sleep(delay)
+                    self._write_chunk(frame(tok, False))
+                self._write_chunk(frame("", True))
+                self._end_stream()
+            except (BrokenPipeError, ConnectionResetError):
+                self.close_connection = True
+            return
+
+        if delay:
+            time.sleep(delay * len(tokens))
+        self._send_json(frame("".join(tokens).strip(), True))
+
+    def _load(self, body: dict) -> None:
+        model = body.get("model", "")
+        name = self.state.find_model(model)
+        if name is None:
+            self._send_json({"error": f"model '{model}' not found"}, 404)
+            return
+        data = {"model": model, "created_at": datetime.now(timezone.utc).isoformat(), "response": "", "done": True}
+        if parse_keep_alive(body.get("keep_alive")) == 0:
+            self.state.unload(name)
+            data["done_reason"] = "unload"
+        else:
+            data["load_duration"] = int(self.state.load(name, body.get("keep_alive")) * 1e9)
+            data["done_reason"] = "load"
+        self._send_json(data)
+
+    def _pull(self, body: dict) -> None:
+        name = body.get("model") or body.get("name", "")
+        total = 10 * 1024 * 1024
+        steps = 10
+        self._start_stream()
+        try:
+            self._write_chunk({"status": "pulling manifest"})
+            for i in range(1, steps + 1):
+                if self.state.latency:
+                    time.sleep(self.state.latency)
+                self._write_chunk({
+                    "status": f"pulling {name}",
+                    "digest": "sha256:stub",
+                    "total": total,
+                    "completed": total * i // steps,
+                })
+            with self.state.lock:
+                self.state.add_model(name)
+            self._write_chunk({"status": "success"})
+            self._end_stream()
+        except (BrokenPipeError, ConnectionResetError):
+            self.close_connection = True
+
+
+def make_server(
+    host: str = "127.0.0.1",
+    port: int = 11435,
+    state: Optional[StubState] = None,
+) -> ThreadingHTTPServer:
+    """Create (but do not start) a stub server; port 0 picks a free port."""
+    handler = type("BoundStubHandler", (StubHandler,), {"state": state or StubState()})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    return server
+
+
+def start_in_thread(**kwargs) -> ThreadingHTTPServer:
+    """Start a stub server in a daemon thread and return it."""
+    server = make_server(**kwargs)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Stub Ollama HTTP API")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=11435)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="Seconds before the first token")
+    parser.add_argument("--tokens-per-sec", type=float, default=0.0,
+                        help="Token rate, 0 = as fast as possible")
+    parser.add_argument("--reply-tokens", type=int, default=16)
+    parser.add_argument("--model", action="append", dest="models",
+                        help="Installed model name (repeatable)")
+    parser.add_argument("--load-seconds", type=float, default=0.0,
+                        help="Cold start time of a model that is not loaded")
+    parser.add_argument("--drop-after", type=int, default=None,
+                        help="Close streaming replies after this many tokens")
+    args = parser.parse_args()
+
+    state = StubState(args.latency, args.tokens_per_sec, args.reply_tokens, args.models, args.load_seconds,
+                      args.drop_after)
+    server = make_server(args.host, args.port, state)
+    print(f"Stub Ollama listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+# app/utils/supervisor.py
+"""
+Supervisor for the API worker processes (run by the admin app).
+
+API_WORKERS uvicorn processes (default: 1) serve `app.api_app:app` from one
+listening socket that the supervisor binds and passes to every worker with
+`--fd`; the kernel spreads connections between them. API_WORKERS=0 starts
+one worker per CPU.
+
+The default stays at one worker rather than one per CPU: part of the API
+state lives in each worker's memory, so with several workers it is either
+split between them or only eventually consistent. Set API_WORKERS only if
+the following is acceptable:
+
+- the write-behind queue (WRITE_BEHIND=1) and its read-your-writes merge
+  in /history: a turn still queued in one worker is not visible through
+  another until it is flushed;
+- the scheduler queues: per-model concurrency and queue limits, fairness
+  and admin priority apply per worker, so the backend sees up to
+  API_WORKERS times the configured concurrency;
+- single-flight: only identical requests that reach the same worker are
+  coalesced;
+- the counters of the memory rate limiter: each worker counts its own
+  requests, so use RATE_LIMIT_BACKEND=db with several workers;
+- the in-memory tier of the response cache: each worker warms its own
+  (evictions reach all of them, the SQLite tier is shared).
+
+Pull jobs, rate limit resets, credential cache invalidation and the model
+activity that residency protects from eviction are shared through the
+database or state files and work with any number of workers.
+
+Each worker touches a heartbeat file (WORKER_HEARTBEAT_FILE, set by the
+supervisor) once it has finished startup and then every
+WORKER_HEARTBEAT_INTERVAL seconds from its event loop. A worker is ready
+when the file exists, and unhealthy when its process has exited or the
+file has not been touched for WORKER_HEARTBEAT_TIMEOUT seconds (a blocked
+event loop stops the heartbeat too). Unhealthy workers are replaced.
+
+restart() is a rolling restart: a new worker is started and must become
+ready before one old worker gets SIGTERM. uvicorn then stops accepting,
+finishes in-flight requests (including streaming chats) for up to
+API_GRACEFUL_TIMEOUT seconds and exits. The other workers keep serving the
+socket the whole time. If the port changed, the new generation is started
+on a new socket and the old socket is closed after the last old worker.
+
+Workers write their Prometheus samples to PROMETHEUS_MULTIPROC_DIR
+(default: a `metrics` directory next to the heartbeat files), so /metrics
+of any worker reports the whole pool; the live gauges of a drained worker
+are dropped.
+
+On Windows sockets cannot be handed over by file descriptor, so a single
+worker is run with `--port` and a restart is stop-then-start.
+"""
+import asyncio
+import logging
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from typing import Dict, List, Optional
+
+from dotenv import load_dotenv
+
+from app.utils import metrics
+
+load_dotenv()
+
+API_APP = "app.api_app:app"
+API_HOST = os.getenv("API_HOST", "0.0.0.0")
+# 0 — по одному воркеру на CPU
+API_WORKERS = int(os.getenv("API_WORKERS", "1")) or os.cpu_count() or 1
+API_GRACEFUL_TIMEOUT = float(os.getenv("API_GRACEFUL_TIMEOUT", "30"))
+API_READY_TIMEOUT = float(os.getenv("API_READY_TIMEOUT", "60"))
+API_BACKLOG = int(os.getenv("API_BACKLOG", "2048"))
+WORKER_HEARTBEAT_INTERVAL = float(os.getenv("WORKER_HEARTBEAT_INTERVAL", "2"))
+WORKER_HEARTBEAT_TIMEOUT = float(os.getenv("WORKER_HEARTBEAT_TIMEOUT", "30"))
+
+HEARTBEAT_ENV = "WORKER_HEARTBEAT_FILE"
+CAN_SHARE_SOCKET = os.name != "nt"
+
+logger = logging.getLogger(__name__)
+
+
+class Worker:
+    def __init__(self, process: subprocess.Popen, heartbeat: str, port: int, generation: int):
+        self.process = process
+        self.heartbeat = heartbeat
+        self.port = port
+        self.generation = generation
+        self.started_at = time.time()
+        self.draining = False
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+
+    @property
+    def alive(self) -> bool:
+        return self.process.poll() is None
+
+    def heartbeat_age(self) -> Optional[float]:
+        try:
+            return time.time() - os.path.getmtime(self.heartbeat)
+        except OSError:
+            return None
+
+    @property
+    def ready(self) -> bool:
+        return self.alive and self.heartbeat_age() is not None
+
+    def healthy(self, timeout: float) -> bool:
+        if not self.alive:
+            return False
+        age = self.heartbeat_age()
+        # Пока воркер стартует, файла ещё нет — это не сбой
+        if age is None:
+            return time.time() - self.started_at < API_READY_TIMEOUT
+        return age < timeout
+
+    def status(self) -> Dict[str, object]:
+        age = self.heartbeat_age()
+        return {
+            "pid": self.pid,
+            "port": self.port,
+            "generation": self.generation,
+            "state": "draining" if self.draining else ("ready" if self.ready else "starting"),
+            "uptime": round(time.time() - self.started_at, 1),
+            "heartbeat_age": round(age, 1) if age is not None else None,
+        }
+
+
+class Supervisor:
+    def __init__(
+        self,
+        app: str = API_APP,
+        workers: int = API_WORKERS,
+        host: str = API_HOST,
+        graceful_timeout: float = API_GRACEFUL_TIMEOUT,
+        ready_timeout: float = API_READY_TIMEOUT,
+        heartbeat_timeout: float = WORKER_HEARTBEAT_TIMEOUT,
+    ):
+        self.app = app
+        self.workers = workers if CAN_SHARE_SOCKET else 1
+        self.host = host
+        self.graceful_timeout = graceful_timeout
+        self.ready_timeout = ready_timeout
+        self.heartbeat_timeout = heartbeat_timeout
+        self.port: Optional[int] = None
+        self._socket: Optional[socket.socket] = None
+        self._workers: List[Worker] = []
+        self._generation = 0
+        self._dir: Optional[str] = None
+        self._metrics_dir: Optional[str] = None
+        self._lock = threading.RLock()
+        self._stopping = threading.Event()
+        self._monitor: Optional[threading.Thread] = None
+        # Один перезапуск за раз: повторный запрос отклоняется, а не встаёт в очередь
+        self._restart_lock = threading.Lock()
+        self.restarting = False
+
+    @property
+    def running(self) -> bool:
+        return self.port is not None
+
+    def _bind(self, port: int) -> socket.socket:
+        sock = socket.create_server(
+            (self.host, port), backlog=API_BACKLOG,
+            family=socket.AF_INET6 if ":" in self.host else socket.AF_INET,
+        )
+        sock.set_inheritable(True)
+        return sock
+
+    def _env(self, heartbeat: str) -> Dict[str, str]:
+        env = dict(os.environ)
+        env[HEARTBEAT_ENV] = heartbeat
+        # Счётчик "memory" точен только в одном процессе
+        if self.workers > 1 and "RATE_LIMIT_BACKEND" not in os.environ:
+            env["RATE_LIMIT_BACKEND"] = "db"
+        env["PROMETHEUS_MULTIPROC_DIR"] = self._metrics_dir
+        return env
+
+    def _spawn(self) -> Worker:
+        heartbeat = os.path.join(self._dir, f"worker-{self._generation}-{time.monotonic_ns()}")
+        cmd = [
+            sys.executable, "-m", "uvicorn", self.app,
+            "--timeout-graceful-shutdown", str(int(self.graceful_timeout)),
+        ]
+        if CAN_SHARE_SOCKET:
+            fd = self._socket.fileno()
+            cmd += ["--fd", str(fd)]
+            process = subprocess.Popen(cmd, env=self._env(heartbeat), pass_fds=(fd,))
+        else:
+            cmd += ["--host", self.host, "--port", str(self.port)]
+            process = subprocess.Popen(cmd, env=self._env(heartbeat))
+        worker = Worker(process, heartbeat, self.port, self._generation)
+        logger.info("Started API worker pid=%s on port %s", worker.pid, self.port)
+        return worker
+
+    def _wait_ready(self, worker: Worker) -> bool:
+        deadline = time.monotonic() + self.ready_timeout
+        while time.monotonic() < deadline:
+            if not worker.alive:
+                return False
+            if worker.ready:
+                return True
+            time.sleep(0.1)
+        return False
+
+    def _drain(self, worker: Worker) -> None:
+        """SIGTERM: uvicorn finishes in-flight requests, then exits; kill after the grace period."""
+        worker.draining = True
+        if worker.alive:
+            worker.process.terminate()
+            try:
+                worker.process.wait(timeout=self.graceful_timeout + 5)
+            except subprocess.TimeoutExpired:
+                logger.warning("API worker pid=%s did not drain in time, killing", worker.pid)
+                worker.process.kill()
+                worker.process.wait()
+        try:
+            os.remove(worker.heartbeat)
+        except OSError:
+            pass
+        metrics.mark_process_dead(worker.pid, self._metrics_dir)
+
+    def start(self, port: int) -> None:
+        """Bind the port and start the first worker; the rest follow one by one."""
+        with self._lock:
+            if self.running:
+                return
+            self._stopping.clear()
+            self._dir = tempfile.mkdtemp(prefix="synapse-workers-")
+            self._metrics_dir = os.getenv("PROMETHEUS_MULTIPROC_DIR") or os.path.join(self._dir, "metrics")
+            os.makedirs(self._metrics_dir, exist_ok=True)
+            self.port = port
+            self._generation += 1
+            if CAN_SHARE_SOCKET:
+                self._socket = self._bind(port)
+            # Остальные воркеры добавляет _check(), по одному после готовности
+            # предыдущего: схема БД создаётся/мигрирует при импорте приложения
+            self._workers = [self._spawn()]
+        if self._monitor is None:
+            self._monitor = threading.Thread(target=self._watch, name="api-supervisor", daemon=True)
+            self._monitor.start()
+
+    def restart(self, port: Optional[int] = None) -> None:
+        """Rolling restart, one worker at a time; a new port gets a new socket."""
+        with self._lock:
+            if not self.running:
+                self.start(port or 8000)
+                return
+            port = port or self.port
+            self.restarting = True
+            try:
+                if not CAN_SHARE_SOCKET:
+                    # Без передачи сокета два процесса не слушают один порт
+                    for worker in self._workers:
+                        self._drain(worker)
+                    self.port = port
+                    self._generation += 1
+                    self._workers = [self._spawn()]
+                    return
+                old_socket = None
+                if port != self.port:
+                    old_socket, self._socket = self._socket, self._bind(port)
+                    self.port = port
+                self._generation += 1
+                for old in list(self._workers):
+                    new = self._spawn()
+                    self._workers.append(new)
+                    if not self._wait_ready(new):
+                        # Новый воркер не поднялся: старые продолжают работать
+                        logger.error("API worker pid=%s failed to start, restart aborted", new.pid)
+                        self._workers.remove(new)
+                        self._drain(new)
+                        if old_socket is not None:
+                            self._socket.close()
+                            self._socket, self.port = old_socket, old.port
+                        return
+                    self._drain(old)
+                    self._workers.remove(old)
+                if old_socket is not None:
+                    old_socket.close()
+            finally:
+                self.restarting = False
+
+    def restart_async(self, port: Optional[int] = None) -> Optional[threading.Thread]:
+        """
+        Run restart() in the background (a rolling restart takes a while).
+        Returns None without doing anything if a restart is already running.
+        """
+        if not self._restart_lock.acquire(blocking=False):
+            return None
+
+        def run() -> None:
+            try:
+                self.restart(port)
+            finally:
+                self._restart_lock.release()
+
+        thread = threading.Thread(target=run, name="api-restart", daemon=True)
+        thread.start()
+        return thread
+
+    def _check(self) -> None:
+        with self._lock:
+            if not self.running:
+                return
+            for worker in list(self._workers):
+                if worker.healthy(self.heartbeat_timeout):
+                    continue
+                logger.warning(
+                    "API worker pid=%s unhealthy (exit=%s, heartbeat=%s), replacing",
+                    worker.pid, worker.process.poll(), worker.heartbeat_age(),
+                )
+                self._workers.remove(worker)
+                self._drain(worker)
+            if len(self._workers) < self.workers and all(w.ready for w in self._workers):
+                self._workers.append(self._spawn())
+
+    def _watch(self) -> None:
+        while not self._stopping.wait(WORKER_HEARTBEAT_INTERVAL):
+            try:
+                self._check()
+            except Exception:
+                logger.exception("API supervisor check failed")
+
+    def stop(self) -> None:
+        """Drain all workers and release the socket."""
+        self._stopping.set()
+        with self._lock:
+            for worker in self._workers:
+                worker.draining = True
+                if worker.alive:
+                    worker.process.terminate()
+            for worker in self._workers:
+                self._drain(worker)
+            self._workers = []
+            if self._socket is not None:
+                self._socket.close()
+                self._socket = None
+            self.port = None
+        if self._monitor is not None:
+            self._monitor.join(timeout=WORKER_HEARTBEAT_INTERVAL + 1)
+            self._monitor = None
+
+    def status(self) -> List[Dict[str, object]]:
+        return [worker.status() for worker in list(self._workers)]
+
+
+class WorkerHeartbeat:
+    """Worker side: touches WORKER_HEARTBEAT_FILE from the event loop while the app runs."""
+
+    def __init__(self, interval: float = WORKER_HEARTBEAT_INTERVAL):
+        self.interval = interval
+        self.path = os.getenv(HEARTBEAT_ENV)
+        self._task: Optional[asyncio.Task] = None
+
+    def _touch(self) -> None:
+        with open(self.path, "a"):
+            pass
+        os.utime(self.path)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                self._touch()
+            except OSError:
+                logger.warning("Cannot write heartbeat %s", self.path, exc_info=True)
+            await asyncio.sleep(self.interval)
+
+    async def start(self) -> None:
+        if self.path and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        if self.path:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+
+
+supervisor = Supervisor()
+worker_heartbeat = WorkerHeartbeat()
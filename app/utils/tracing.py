@@ -0,0 +1,179 @@
+# app/utils/tracing.py
+"""
+Per-request phase timings.
+
+TracingMiddleware starts a RequestTrace for every HTTP request and keeps
+it in a context variable; code on the hot path wraps its steps in
+`with phase("name"):` (a no-op outside a request). The timings go out
+
+- in a `Server-Timing` response header (`auth;dur=1.2, rate_limit;dur=0.3,
+  ..., total;dur=41.0`, milliseconds) with the phases finished before the
+  headers were sent. `respond` is the time between the last phase and the
+  headers (serialization of the response);
+- into a structured slow-request log (logger `app.utils.tracing`, one JSON
+  object per line) for requests slower than SLOW_REQUEST_SECONDS. For a
+  streamed response the log is written after the last chunk and includes
+  `body`, the time spent streaming.
+
+Set SLOW_REQUEST_SECONDS=0 to log every request, TRACING=0 to disable.
+
+Optional sampling profiler: with TRACE_PROFILE=1 and pyinstrument installed
+a TRACE_PROFILE_SAMPLE fraction of requests runs under a profiler; for
+those that turn out slow the profile is saved to TRACE_PROFILE_DIR and its
+path is added to the log entry.
+"""
+import contextvars
+import json
+import logging
+import os
+import random
+import re
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from dotenv import load_dotenv
+
+try:
+    from pyinstrument import Profiler
+except ImportError:  # профилировщик необязателен
+    Profiler = None
+
+load_dotenv()
+
+TRACING = os.getenv("TRACING", "1").lower() not in ("0", "false", "no", "off")
+SLOW_REQUEST_SECONDS = float(os.getenv("SLOW_REQUEST_SECONDS", "5"))
+TRACE_PROFILE = os.getenv("TRACE_PROFILE", "0").lower() in ("1", "true", "yes", "on")
+TRACE_PROFILE_SAMPLE = float(os.getenv("TRACE_PROFILE_SAMPLE", "0.1"))
+TRACE_PROFILE_DIR = os.getenv("TRACE_PROFILE_DIR", os.path.join(os.getcwd(), "profiles"))
+TRACE_PROFILE_INTERVAL = float(os.getenv("TRACE_PROFILE_INTERVAL", "0.001"))
+
+logger = logging.getLogger(__name__)
+
+_current: contextvars.ContextVar[Optional["RequestTrace"]] = contextvars.ContextVar(
+    "request_trace", default=None
+)
+
+
+class RequestTrace:
+    """Phases of one request in the order they finished; repeated phases add up."""
+
+    def __init__(self, method: str, path: str):
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.mark = self.started
+        self.finished = False
+        self.phases: Dict[str, float] = {}
+
+    def add(self, name: str, seconds: float) -> None:
+        if self.finished:
+            # Фоновая задача, созданная запросом, может пережить его
+            return
+        self.phases[name] = self.phases.get(name, 0.0) + seconds
+        self.mark = time.perf_counter()
+
+    def elapsed(self) -> float:
+        return time.perf_counter() - self.started
+
+    def server_timing(self) -> str:
+        items: List[Tuple[str, float]] = list(self.phases.items())
+        items.append(("total", self.elapsed()))
+        return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in items)
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    """Time a step of the current request (if there is one)."""
+    trace = _current.get()
+    if trace is None:
+        yield
+        return
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        trace.add(name, time.perf_counter() - started)
+
+
+# ---- profiler ----------------------------------------------------------------
+def _start_profiler():
+    if not TRACE_PROFILE or Profiler is None or random.random() >= TRACE_PROFILE_SAMPLE:
+        return None
+    try:
+        profiler = Profiler(interval=TRACE_PROFILE_INTERVAL, async_mode="enabled")
+        profiler.start()
+    except RuntimeError:
+        # Уже идёт профилирование в этом потоке
+        return None
+    return profiler
+
+
+def _save_profile(profiler, trace: RequestTrace) -> Optional[str]:
+    name = re.sub(r"[^A-Za-z0-9_.-]+", "_", trace.path.strip("/")) or "root"
+    path = os.path.join(TRACE_PROFILE_DIR, f"{time.strftime('%Y%m%d-%H%M%S')}-{trace.method}-{name[:80]}.txt")
+    try:
+        os.makedirs(TRACE_PROFILE_DIR, exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            f.write(profiler.output_text(unicode=True, color=False))
+    except OSError:
+        logger.warning("Cannot save request profile to %s", path, exc_info=True)
+        return None
+    return path
+
+
+# ---- middleware --------------------------------------------------------------
+class TracingMiddleware:
+    """ASGI middleware: Server-Timing header and the slow-request log."""
+
+    def __init__(self, app, slow_seconds: float = SLOW_REQUEST_SECONDS):
+        self.app = app
+        self.slow_seconds = slow_seconds
+        if TRACE_PROFILE and Profiler is None:
+            logger.warning("TRACE_PROFILE is set but pyinstrument is not installed; profiling is off")
+
+    async def __call__(self, scope, receive, send):
+        if not TRACING or scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        trace = RequestTrace(scope.get("method", ""), scope.get("path", ""))
+        token = _current.set(trace)
+        profiler = _start_profiler()
+        state = {"status": 500, "headers_at": None}
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                trace.add("respond", time.perf_counter() - trace.mark)
+                state["status"] = message["status"]
+                state["headers_at"] = time.perf_counter()
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", trace.server_timing().encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            _current.reset(token)
+            if state["headers_at"] is not None:
+                trace.add("body", time.perf_counter() - state["headers_at"])
+            trace.finished = True
+            if profiler is not None:
+                profiler.stop()
+            total = trace.elapsed()
+            if total >= self.slow_seconds:
+                self._log(trace, state["status"], total, profiler)
+
+    @staticmethod
+    def _log(trace: RequestTrace, status: int, total: float, profiler) -> None:
+        entry = {
+            "event": "slow_request",
+            "method": trace.method,
+            "path": trace.path,
+            "status": status,
+            "total_ms": round(total * 1000, 1),
+            "phases_ms": {name: round(seconds * 1000, 1) for name, seconds in trace.phases.items()},
+        }
+        if profiler is not None:
+            entry["profile"] = _save_profile(profiler, trace)
+        logger.warning(json.dumps(entry, ensure_ascii=False))
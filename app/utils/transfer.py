@@ -0,0 +1,324 @@
+# app/utils/transfer.py
+"""
+Bulk export and import of chat history as NDJSON.
+
+One line per record: a session header followed by its messages,
+
+    {"type": "session", "session_id": ..., "username": ..., "created_at": ...}
+    {"type": "message", "id": ..., "session_id": ..., "role": ..., "model": ..., "content": ..., "timestamp": ...}
+
+Rows are read from a single query over messages ordered by (session_id, id)
+through a server-side cursor (yield_per), so memory use does not depend on
+the size of the history. Output can be gzip-compressed on the fly.
+
+Import reads the same format (plain or gzip) and writes it with batched
+executemany INSERTs, IMPORT_BATCH messages per transaction. Message ids are
+not kept; messages get new ids in file order. Sessions that already exist
+are appended to.
+"""
+import gzip
+import io
+import json
+import logging
+import os
+import time
+import zlib
+from datetime import datetime, timezone
+from typing import AsyncIterator, BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional
+
+from dotenv import load_dotenv
+from sqlalchemy import case, func, insert, select
+
+from app.database import AsyncSessionLocal, SessionLocal, engine, upsert
+from app.models import Message, Session as SessionModel
+from app.utils import search
+
+load_dotenv()
+
+EXPORT_BATCH = 1000
+IMPORT_BATCH = int(os.getenv("IMPORT_BATCH", "20000"))
+
+logger = logging.getLogger(__name__)
+
+
+def _utc(value: Optional[datetime]) -> Optional[datetime]:
+    # В БД время хранится в UTC без зоны
+    if value is not None and value.tzinfo is not None:
+        value = value.astimezone(timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def export_query(
+    username: Optional[str] = None,
+    since: Optional[datetime] = None,
+    until: Optional[datetime] = None,
+    model: Optional[str] = None,
+):
+    """Messages joined with their session, filtered and ordered for export."""
+    query = (
+        select(
+            SessionModel.session_id,
+            SessionModel.username,
+            SessionModel.created_at,
+            Message.id,
+            Message.role,
+            Message.model,
+            Message.content,
+            Message.timestamp,
+        )
+        .join(SessionModel, SessionModel.session_id == Message.session_id)
+        .order_by(Message.session_id, Message.id)
+    )
+    if username is not None:
+        query = query.where(SessionModel.username == username)
+    if since is not None:
+        query = query.where(Message.timestamp >= _utc(since))
+    if until is not None:
+        query = query.where(Message.timestamp < _utc(until))
+    if model is not None:
+        query = query.where(Message.model == model)
+    return query.execution_options(yield_per=EXPORT_BATCH)
+
+
+def _iso(value: Optional[datetime]) -> Optional[str]:
+    return value.isoformat() if value is not None else None
+
+
+class Exporter:
+    """Turns export rows into NDJSON, emitting a header line per session."""
+
+    def __init__(
+        self,
+        username: Optional[str] = None,
+        since: Optional[datetime] = None,
+        until: Optional[datetime] = None,
+        model: Optional[str] = None,
+    ):
+        self.query = export_query(username, since, until, model)
+        self._session_id = None
+        self.sessions = 0
+        self.messages = 0
+
+    def _lines(self, row) -> Iterator[str]:
+        session_id, username, created_at, msg_id, role, model, content, timestamp = row
+        if session_id != self._session_id:
+            self._session_id = session_id
+            self.sessions += 1
+            yield json.dumps({
+                "type": "session",
+                "session_id": session_id,
+                "username": username,
+                "created_at": _iso(created_at),
+            }, ensure_ascii=False) + "\n"
+        self.messages += 1
+        yield json.dumps({
+            "type": "message",
+            "id": msg_id,
+            "session_id": session_id,
+            "role": role,
+            "model": model,
+            "content": content,
+            "timestamp": _iso(timestamp),
+        }, ensure_ascii=False) + "\n"
+
+    def _encode(self, rows) -> bytes:
+        return "".join(line for row in rows for line in self._lines(row)).encode("utf-8")
+
+    def chunks(self) -> Iterator[bytes]:
+        """Synchronous export (CLI): one NDJSON chunk per batch of rows."""
+        with SessionLocal() as db:
+            for rows in db.execute(self.query).partitions():
+                yield self._encode(rows)
+
+    async def chunks_async(self) -> AsyncIterator[bytes]:
+        """Asynchronous export (HTTP) over the async engine."""
+        async with AsyncSessionLocal() as db:
+            result = await db.stream(self.query)
+            async for rows in result.partitions():
+                yield self._encode(rows)
+
+
+def gzip_chunks(chunks: Iterable[bytes]) -> Iterator[bytes]:
+    """Compress a stream of byte chunks into one gzip stream."""
+    compressor = zlib.compressobj(wbits=31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+async def gzip_chunks_async(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    compressor = zlib.compressobj(wbits=31)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+
+def _parse_time(value: Optional[str]) -> Optional[datetime]:
+    if not value:
+        return None
+    return _utc(datetime.fromisoformat(value))
+
+
+def _open_ndjson(fileobj: BinaryIO) -> io.TextIOWrapper:
+    """Text stream over plain or gzip-compressed NDJSON (detected by magic bytes)."""
+    if not hasattr(fileobj, "peek"):
+        fileobj = io.BufferedReader(fileobj)
+    if fileobj.peek(2)[:2] == b"\x1f\x8b":
+        fileobj = gzip.GzipFile(fileobj=fileobj, mode="rb")
+    return io.TextIOWrapper(fileobj, encoding="utf-8")
+
+
+class ImportStats:
+    def __init__(self):
+        self.sessions = 0
+        self.messages = 0
+        self.errors = 0
+        self.started = time.perf_counter()
+        self.seconds = 0.0
+
+    @property
+    def rows_per_sec(self) -> float:
+        return (self.sessions + self.messages) / self.seconds if self.seconds else 0.0
+
+    def as_dict(self) -> Dict[str, float]:
+        return {
+            "sessions": self.sessions,
+            "messages": self.messages,
+            "errors": self.errors,
+            "seconds": round(self.seconds, 3),
+            "rows_per_sec": round(self.rows_per_sec, 1),
+        }
+
+
+class Importer:
+    """
+    Loads NDJSON history through the sync engine. With defer_indexes the
+    secondary indexes of `messages` and the full-text index triggers are
+    dropped for the duration of the load and rebuilt once at the end (meant
+    for offline bulk loads).
+    """
+
+    def __init__(
+        self,
+        batch_size: int = IMPORT_BATCH,
+        defer_indexes: bool = False,
+        progress: Optional[Callable[[ImportStats], None]] = None,
+    ):
+        self.batch_size = batch_size
+        self.defer_indexes = defer_indexes
+        self.progress = progress
+        self.stats = ImportStats()
+        self._sessions: Dict[str, dict] = {}
+        self._messages: List[dict] = []
+        self._seen: set = set()
+
+    def _session(self, session_id: str) -> dict:
+        row = self._sessions.get(session_id)
+        if row is None:
+            row = self._sessions[session_id] = {
+                "session_id": session_id,
+                "username": None,
+                "created_at": None,
+                "message_count": 0,
+                "last_activity": None,
+            }
+        return row
+
+    def _add(self, record: dict) -> None:
+        kind = record.get("type", "message")
+        session = self._session(str(record["session_id"]))
+        # Записи одной сессии не обязаны идти подряд — считаем разные id
+        if session["session_id"] not in self._seen:
+            self._seen.add(session["session_id"])
+            self.stats.sessions += 1
+        if kind == "session":
+            session["username"] = record.get("username") or session["username"]
+            session["created_at"] = _parse_time(record.get("created_at")) or session["created_at"]
+        elif kind == "message":
+            timestamp = _parse_time(record.get("timestamp")) or datetime.now(timezone.utc).replace(tzinfo=None)
+            self._messages.append({
+                "session_id": session["session_id"],
+                "role": record["role"],
+                "model": record.get("model") or "",
+                "content": record["content"],
+                "timestamp": timestamp,
+            })
+            session["message_count"] += 1
+            if session["last_activity"] is None or timestamp > session["last_activity"]:
+                session["last_activity"] = timestamp
+            if session["created_at"] is None:
+                session["created_at"] = timestamp
+        else:
+            raise ValueError(f"unknown record type '{kind}'")
+
+    def _flush(self) -> None:
+        if not self._sessions:
+            return
+        now = datetime.now(timezone.utc).replace(tzinfo=None)
+        sessions = []
+        for row in self._sessions.values():
+            created = row["created_at"] or now
+            sessions.append({**row, "created_at": created, "last_activity": row["last_activity"] or created})
+        stmt = upsert(SessionModel)
+        newer = stmt.excluded.last_activity
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[SessionModel.session_id],
+            set_={
+                "message_count": SessionModel.message_count + stmt.excluded.message_count,
+                "last_activity": case(
+                    (SessionModel.last_activity.is_(None), newer),
+                    (newer > SessionModel.last_activity, newer),
+                    else_=SessionModel.last_activity,
+                ),
+                "username": func.coalesce(SessionModel.username, stmt.excluded.username),
+            },
+        )
+        # Одна транзакция на пачку: executemany по сессиям и по сообщениям
+        with engine.begin() as conn:
+            conn.execute(stmt, sessions)
+            if self._messages:
+                conn.execute(insert(Message.__table__), self._messages)
+        self.stats.messages += len(self._messages)
+        self._sessions = {}
+        self._messages = []
+        self.stats.seconds = time.perf_counter() - self.stats.started
+        if self.progress is not None:
+            self.progress(self.stats)
+
+    def run(self, fileobj: BinaryIO) -> ImportStats:
+        indexes = list(Message.__table__.indexes) if self.defer_indexes else []
+        for index in indexes:
+            index.drop(engine, checkfirst=True)
+        fts = False
+        if self.defer_indexes and engine.dialect.name == "sqlite":
+            with engine.begin() as conn:
+                fts = search.fts_exists(conn)
+                if fts:
+                    search.drop_triggers(conn)
+        try:
+            for lineno, line in enumerate(_open_ndjson(fileobj), 1):
+                if not line.strip():
+                    continue
+                try:
+                    self._add(json.loads(line))
+                except (ValueError, KeyError, TypeError) as e:
+                    self.stats.errors += 1
+                    logger.warning("Import: skipping line %d: %s", lineno, e)
+                    continue
+                if len(self._messages) >= self.batch_size:
+                    self._flush()
+            self._flush()
+        finally:
+            # Индексы строятся один раз по всем данным
+            for index in indexes:
+                index.create(engine, checkfirst=True)
+            if fts:
+                with engine.begin() as conn:
+                    search.create_triggers(conn)
+                    search.rebuild_index(conn)
+        self.stats.seconds = time.perf_counter() - self.stats.started
+        return self.stats
@@ -0,0 +1,233 @@
+# app/utils/writer.py
+"""
+Persistence of chat turns.
+
+A turn (session upsert + the user message + the assistant reply) is written
+in a single transaction. With WRITE_BEHIND=1 in .env turns are instead queued
+and a dedicated writer task group-commits them in batches
+(WRITE_BEHIND_BATCH turns or WRITE_BEHIND_DELAY seconds, whichever comes
+first). Queued turns stay visible through pending_messages() so /history
+can read its own writes, and stop() drains the queue on shutdown. A
+session deleted while its batch is being committed is deleted again once
+the batch is in.
+"""
+import asyncio
+import logging
+import os
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from dotenv import load_dotenv
+from sqlalchemy import delete, func, select
+
+from app.database import AsyncSessionLocal, upsert
+from app.models import Message, Session as SessionModel
+from app.utils import metrics
+from app.utils.context import context_cache
+from app.utils.tracing import phase
+
+load_dotenv()
+
+WRITE_BEHIND = os.getenv("WRITE_BEHIND", "0") in ("1", "true", "yes")
+WRITE_BEHIND_BATCH = int(os.getenv("WRITE_BEHIND_BATCH", "256"))
+WRITE_BEHIND_DELAY = float(os.getenv("WRITE_BEHIND_DELAY", "0.05"))
+WRITE_BEHIND_QUEUE = int(os.getenv("WRITE_BEHIND_QUEUE", "10000"))
+
+logger = logging.getLogger(__name__)
+
+
+class Turn:
+    """One exchange to persist: messages as (role, content) pairs."""
+
+    __slots__ = ("session_id", "model", "messages", "username", "created_at", "discarded")
+
+    def __init__(
+        self,
+        session_id: str,
+        model: str,
+        messages: Sequence[Tuple[str, str]],
+        username: Optional[str] = None,
+    ):
+        self.session_id = session_id
+        self.model = model
+        self.messages = list(messages)
+        self.username = username
+        self.created_at = datetime.now(timezone.utc).replace(tzinfo=None)
+        self.discarded = False
+
+
+async def write_turns(turns: Sequence[Turn]) -> None:
+    """Write turns (sessions with their counters + messages) in one transaction."""
+    turns = [t for t in turns if not t.discarded]
+    if not turns:
+        return
+    # Счётчики сессий: сколько сообщений добавляется и время последней реплики
+    sessions: Dict[str, dict] = {}
+    for turn in turns:
+        row = sessions.setdefault(turn.session_id, {
+            "session_id": turn.session_id, "username": turn.username, "message_count": 0,
+        })
+        row["message_count"] += len(turn.messages)
+        row["last_activity"] = turn.created_at
+        row["username"] = row["username"] or turn.username
+    stmt = upsert(SessionModel)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=[SessionModel.session_id],
+        set_={
+            "message_count": SessionModel.message_count + stmt.excluded.message_count,
+            "last_activity": stmt.excluded.last_activity,
+            # Владелец — пользователь, начавший сессию
+            "username": func.coalesce(SessionModel.username, stmt.excluded.username),
+        },
+    )
+    rows: List[Tuple[Turn, Message]] = []
+    async with AsyncSessionLocal() as db:
+        with phase("session_upsert"):
+            await db.execute(stmt, list(sessions.values()))
+            # Последний id каждой сессии до записи: кэш контекста дописывается, только если он актуален
+            last_ids = dict((await db.execute(
+                select(Message.session_id, func.max(Message.id))
+                .where(Message.session_id.in_(list(sessions)))
+                .group_by(Message.session_id)
+            )).all())
+        for turn in turns:
+            for role, content in turn.messages:
+                msg = Message(session_id=turn.session_id, role=role, model=turn.model, content=content)
+                db.add(msg)
+                rows.append((turn, msg))
+        # Сообщения вставляются при flush во время commit
+        with phase("message_write"), metrics.timed(metrics.DB_COMMIT, "writer"):
+            await db.commit()
+    for turn, msg in rows:
+        context_cache.append(turn.session_id, last_ids.get(turn.session_id), msg.id, msg.role, msg.content)
+        last_ids[turn.session_id] = msg.id
+
+
+async def delete_sessions(session_ids: Sequence[str]) -> None:
+    """Delete sessions with their messages (sessions removed while their turns were being written)."""
+    async with AsyncSessionLocal() as db:
+        await db.execute(delete(Message).where(Message.session_id.in_(session_ids)))
+        await db.execute(delete(SessionModel).where(SessionModel.session_id.in_(session_ids)))
+        await db.commit()
+    for session_id in session_ids:
+        context_cache.invalidate(session_id)
+
+
+class TurnWriter:
+    def __init__(
+        self,
+        enabled: bool = WRITE_BEHIND,
+        batch_size: int = WRITE_BEHIND_BATCH,
+        max_delay: float = WRITE_BEHIND_DELAY,
+        max_queue: int = WRITE_BEHIND_QUEUE,
+    ):
+        self.enabled = enabled
+        self.batch_size = batch_size
+        self.max_delay = max_delay
+        self.max_queue = max_queue
+        self._queue: Optional[asyncio.Queue] = None
+        self._pending: Dict[str, List[Turn]] = {}
+        self._task: Optional[asyncio.Task] = None
+
+    async def record(self, turn: Turn) -> None:
+        """Persist a turn: immediately, or via the queue when write-behind is on."""
+        if not self.enabled or self._queue is None:
+            await write_turns([turn])
+            return
+        self._pending.setdefault(turn.session_id, []).append(turn)
+        # Очередь ограничена: при переполнении запрос ждёт писателя (backpressure)
+        with phase("write_queue"):
+            await self._queue.put(turn)
+
+    def pending_messages(self, session_id: str) -> List[dict]:
+        """Queued but not yet committed messages of a session (read-your-writes)."""
+        return [
+            {"role": role, "model": turn.model, "content": content, "timestamp": turn.created_at}
+            for turn in self._pending.get(session_id, ())
+            if not turn.discarded
+            for role, content in turn.messages
+        ]
+
+    def pending_sessions(self) -> Dict[str, datetime]:
+        """Session ids with queued turns and the time of their first queued turn."""
+        return {
+            sid: turns[0].created_at
+            for sid, turns in self._pending.items()
+            if any(not t.discarded for t in turns)
+        }
+
+    def discard(self, session_id: str) -> None:
+        """Drop queued turns of a deleted session."""
+        for turn in self._pending.pop(session_id, ()):
+            turn.discarded = True
+
+    def _done(self, batch: List[Turn]) -> None:
+        for turn in batch:
+            turns = self._pending.get(turn.session_id)
+            if turns and turn in turns:
+                turns.remove(turn)
+                if not turns:
+                    del self._pending[turn.session_id]
+
+    async def _collect(self) -> List[Turn]:
+        batch = [await self._queue.get()]
+        deadline = asyncio.get_running_loop().time() + self.max_delay
+        while len(batch) < self.batch_size:
+            timeout = deadline - asyncio.get_running_loop().time()
+            if timeout <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+            except asyncio.TimeoutError:
+                break
+        return batch
+
+    async def _write(self, batch: List[Turn], attempts: int = 5) -> None:
+        live = [turn for turn in batch if not turn.discarded]
+        for attempt in range(1, attempts + 1):
+            try:
+                await write_turns(batch)
+                break
+            except Exception:
+                if attempt == attempts:
+                    logger.exception("Write-behind flush of %d turns failed, dropping them", len(batch))
+                else:
+                    logger.warning("Write-behind flush failed (attempt %d), retrying", attempt)
+                    await asyncio.sleep(attempt)
+        # Сессию удалили, пока пачка записывалась: её реплики уже могли попасть в БД
+        deleted = sorted({turn.session_id for turn in live if turn.discarded})
+        if deleted:
+            try:
+                await delete_sessions(deleted)
+            except Exception:
+                logger.exception("Cannot delete %d sessions removed during a write-behind flush", len(deleted))
+        self._done(batch)
+        for _ in batch:
+            self._queue.task_done()
+
+    async def _run(self) -> None:
+        while True:
+            batch = await self._collect()
+            await self._write(batch)
+
+    async def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Flush everything still queued, then stop the writer."""
+        if self._task is None:
+            return
+        await self._queue.join()
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+        self._task = None
+        self._queue = None
+
+
+turn_writer = TurnWriter()
+context_cache.pending_source = turn_writer.pending_messages
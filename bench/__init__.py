@@ -0,0 +1,20 @@
+# bench/__init__.py
+"""
+Load tests and benchmarks of the API against the stub Ollama backend.
+
+A run starts `app.api_app` (uvicorn, API_WORKERS-style `--workers`) on a
+freshly seeded SQLite database in a temporary directory, with
+app.utils.stub_ollama as the backend, drives a weighted mix of requests at
+a fixed concurrency and reports throughput, p50/p95/p99 latency per
+operation, errors and SQLite lock errors ("database is locked" in
+responses or in the server log).
+
+Results are saved as JSON under bench/results/ and compared with the
+previous run of the same mix (or with an explicit baseline file);
+regressions beyond the threshold are flagged.
+
+Запуск:
+    python -m bench --mix default --concurrency 32 --duration 30
+    python -m bench --mix chat --latency 0.2 --tokens-per-sec 50 --baseline bench/results/chat-....json
+    python -m bench --list
+"""
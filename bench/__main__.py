@@ -0,0 +1,129 @@
+# bench/__main__.py
+"""
+python -m bench — run a benchmark, save the result and compare it with the
+previous run of the same mix. Exits with 1 on a regression when --check is set.
+"""
+import argparse
+import asyncio
+import json
+import sys
+from datetime import datetime
+
+from bench import baseline
+from bench.harness import BenchStack, run_load, summarize
+from bench.mixes import MIXES
+
+
+def parse_env(items):
+    env = {}
+    for item in items or []:
+        key, sep, value = item.partition("=")
+        if not sep:
+            raise SystemExit(f"--env expects KEY=VALUE, got '{item}'")
+        env[key] = value
+    return env
+
+
+def print_summary(summary) -> None:
+    header = f"{'operation':<18}{'requests':>9}{'rps':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'errors':>8}{'locks':>7}"
+    print(header)
+    print("-" * len(header))
+    rows = list(summary["operations"].items()) + [("overall", summary["overall"])]
+    for name, s in rows:
+        print(f"{name:<18}{s['requests']:>9}{s['throughput']:>9}{s['p50_ms']:>10}{s['p95_ms']:>10}"
+              f"{s['p99_ms']:>10}{s['errors']:>8}{s['lock_errors']:>7}")
+    print(f"statuses: {summary['statuses']}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(prog="python -m bench", description="Benchmark the API against the stub backend")
+    parser.add_argument("--mix", default="default", help=f"Request mix: {', '.join(MIXES)}")
+    parser.add_argument("--list", action="store_true", help="Show the mixes and exit")
+    parser.add_argument("--concurrency", type=int, default=16, help="Concurrent clients")
+    parser.add_argument("--duration", type=float, default=20.0, help="Measured seconds")
+    parser.add_argument("--warmup", type=float, default=3.0, help="Seconds before measuring")
+    parser.add_argument("--workers", type=int, default=1, help="uvicorn worker processes")
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--sessions", type=int, default=200, help="Seeded sessions (total)")
+    parser.add_argument("--messages", type=int, default=20, help="Seeded messages per session")
+    parser.add_argument("--latency", type=float, default=0.05, help="Stub time to first token, seconds")
+    parser.add_argument("--tokens-per-sec", type=float, default=200.0, help="Stub token rate, 0 = unlimited")
+    parser.add_argument("--reply-tokens", type=int, default=32)
+    parser.add_argument("--seed", type=int, default=0, help="Seed of the data and of the request sequence")
+    parser.add_argument("--env", action="append", metavar="KEY=VALUE",
+                        help="Extra environment of the API server (repeatable), e.g. WRITE_BEHIND=1")
+    parser.add_argument("--baseline", help="Compare with this result file instead of the previous run")
+    parser.add_argument("--threshold", type=float, default=0.10, help="Relative change counted as a regression")
+    parser.add_argument("--no-save", action="store_true", help="Do not save the result")
+    parser.add_argument("--check", action="store_true", help="Exit with 1 if a regression is found")
+    parser.add_argument("--json", action="store_true", help="Print the result as JSON")
+    args = parser.parse_args()
+
+    if args.list:
+        for name, mix in MIXES.items():
+            print(f"{name:<10} " + ", ".join(f"{op}={weight}" for op, weight in mix.items()))
+        return
+    if args.mix not in MIXES:
+        raise SystemExit(f"Unknown mix '{args.mix}', choose from: {', '.join(MIXES)}")
+
+    env = parse_env(args.env)
+    config = {
+        "mix": args.mix,
+        "concurrency": args.concurrency,
+        "duration": args.duration,
+        "workers": args.workers,
+        "users": args.users,
+        "sessions": args.sessions,
+        "messages": args.messages,
+        "latency": args.latency,
+        "tokens_per_sec": args.tokens_per_sec,
+        "reply_tokens": args.reply_tokens,
+        "seed": args.seed,
+        "env": env,
+    }
+    print(f"Seeding {args.sessions} sessions x {args.messages} messages, starting the API...", file=sys.stderr)
+    with BenchStack(
+        users=args.users, sessions=args.sessions, messages=args.messages,
+        latency=args.latency, tokens_per_sec=args.tokens_per_sec, reply_tokens=args.reply_tokens,
+        workers=args.workers, env=env, seed_value=args.seed,
+    ) as stack:
+        print(f"Running mix '{args.mix}' at concurrency {args.concurrency} for {args.duration:g}s...", file=sys.stderr)
+        samples, seconds = asyncio.run(run_load(
+            stack.url, stack.owned, MIXES[args.mix], args.concurrency, args.duration,
+            warmup=args.warmup, seed_value=args.seed,
+        ))
+        summary = summarize(samples, seconds)
+        summary["server_lock_errors"] = stack.lock_errors_in_log()
+
+    result = {
+        "created_at": datetime.now().isoformat(timespec="seconds"),
+        "revision": baseline.git_revision(),
+        "config": config,
+        "summary": summary,
+    }
+    if args.json:
+        print(json.dumps(result, ensure_ascii=False, indent=2))
+    else:
+        print_summary(summary)
+        print(f"database locked errors in the server log: {summary['server_lock_errors']}")
+
+    reference = args.baseline or baseline.previous(args.mix)
+    regressed = False
+    if reference:
+        old = baseline.load(reference)
+        print(f"\nCompared with {reference} (revision {old.get('revision')}):")
+        differs = baseline.config_differs(old, result)
+        if differs:
+            print(f"  note: settings differ ({', '.join(differs)})")
+        for scope, text, bad in baseline.compare(old, result, args.threshold):
+            if bad:
+                regressed = True
+            print(f"  {'REGRESSION' if bad else 'ok':<10} {scope:<18} {text}")
+    if not args.no_save:
+        print(f"\nSaved {baseline.save(result, args.mix)}", file=sys.stderr)
+    if regressed and args.check:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# bench/baseline.py
+"""
+JSON results of benchmark runs and comparison between two runs.
+
+A result file holds the configuration of the run (mix, concurrency, stub
+latency, ...), the git commit and the summary from bench.harness.summarize().
+compare() flags a regression when throughput drops, or p50/p95/p99 latency
+or the error rate rises, by more than the threshold (relative); latency
+changes below NOISE_MS are ignored.
+"""
+import glob
+import json
+import os
+import subprocess
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from bench.harness import ROOT
+
+RESULTS_DIR = os.path.join(ROOT, "bench", "results")
+
+# Абсолютная разница задержки, которую не считаем регрессией
+NOISE_MS = 1.0
+
+
+def git_revision() -> Optional[str]:
+    try:
+        out = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT, capture_output=True, text=True, timeout=10,
+        )
+    except (OSError, subprocess.SubprocessError):
+        return None
+    return out.stdout.strip() or None
+
+
+def save(result: Dict[str, object], mix: str, directory: str = RESULTS_DIR) -> str:
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"{mix}-{datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(result, f, ensure_ascii=False, indent=2)
+    return path
+
+
+def load(path: str) -> Dict[str, object]:
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def previous(mix: str, directory: str = RESULTS_DIR) -> Optional[str]:
+    """The latest saved result of the mix."""
+    paths = sorted(glob.glob(os.path.join(directory, f"{mix}-*.json")))
+    return paths[-1] if paths else None
+
+
+def _changes(name: str, old: Dict[str, float], new: Dict[str, float], threshold: float) -> List[Tuple[str, str, bool]]:
+    rows = []
+    if old.get("throughput"):
+        change = (new["throughput"] - old["throughput"]) / old["throughput"]
+        rows.append((name, f"throughput {old['throughput']} -> {new['throughput']} rps ({change:+.1%})", change < -threshold))
+    for key in ("p50_ms", "p95_ms", "p99_ms"):
+        before, after = old.get(key, 0.0), new.get(key, 0.0)
+        change = (after - before) / before if before else 0.0
+        regressed = change > threshold and after - before > NOISE_MS
+        rows.append((name, f"{key[:-3]} {before} -> {after} ms ({change:+.1%})", regressed))
+    before, after = old.get("error_rate", 0.0), new.get("error_rate", 0.0)
+    if before or after:
+        rows.append((name, f"errors {before:.2%} -> {after:.2%}", after > before * (1 + threshold) and after - before > 0.001))
+    if new.get("lock_errors", 0) > old.get("lock_errors", 0):
+        rows.append((name, f"lock errors {old.get('lock_errors', 0)} -> {new['lock_errors']}", True))
+    return rows
+
+
+def compare(old: Dict[str, object], new: Dict[str, object], threshold: float = 0.1) -> List[Tuple[str, str, bool]]:
+    """(scope, description, regressed) rows for the whole run and each operation."""
+    rows = _changes("overall", old["summary"]["overall"], new["summary"]["overall"], threshold)
+    old_ops = old["summary"]["operations"]
+    for name, stats in new["summary"]["operations"].items():
+        if name in old_ops:
+            rows.extend(_changes(name, old_ops[name], stats, threshold))
+    return rows
+
+
+def config_differs(old: Dict[str, object], new: Dict[str, object]) -> List[str]:
+    """Settings that differ between two runs (the comparison may be meaningless)."""
+    a, b = old.get("config", {}), new.get("config", {})
+    return [key for key in sorted(set(a) | set(b)) if a.get(key) != b.get(key)]
@@ -0,0 +1,357 @@
+# bench/harness.py
+"""
+Benchmark stack and load generator.
+
+BenchStack seeds a database, starts the stub backend and the API as
+subprocesses and tears everything down again; run_load() drives a request
+mix against it and returns a summary (see summarize()).
+"""
+import asyncio
+import math
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PASSWORD = "bench"
+MODEL = "stub"
+LOCK_ERROR = "database is locked"
+
+
+def _free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+def seed(database_url: str, users: int, sessions: int, messages: int, seed_value: int = 0) -> Dict[str, List[str]]:
+    """
+    Create the schema and fill it: `users` users with `sessions` sessions in
+    total, `messages` messages each. Returns the session ids per user.
+    """
+    # Схема и PRAGMA — те же, что у приложения: импортируем его с нужной БД
+    os.environ["DATABASE_URL"] = database_url
+    from sqlalchemy import insert
+
+    from app.database import Base, engine
+    from app.migrations import migrate
+    from app.models import Message, Session as SessionModel, User
+
+    Base.metadata.create_all(bind=engine)
+    migrate(engine)
+    rnd = random.Random(seed_value)
+    names = [f"bench{i}" for i in range(users)]
+    owned: Dict[str, List[str]] = {name: [] for name in names}
+    started = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=30)
+    words = "the model answer question context session history token stream cache queue".split()
+    with engine.begin() as conn:
+        conn.execute(insert(User), [
+            {"username": name, "password_hash": PASSWORD, "is_admin": False, "daily_limit": 10 ** 9}
+            for name in names
+        ])
+        session_rows, message_rows = [], []
+        for i in range(sessions):
+            name = names[i % users]
+            session_id = f"bench-{i}"
+            owned[name].append(session_id)
+            created = started + timedelta(seconds=i * 60)
+            session_rows.append({
+                "session_id": session_id, "username": name, "created_at": created,
+                "message_count": messages, "last_activity": created,
+            })
+            for j in range(messages):
+                message_rows.append({
+                    "session_id": session_id,
+                    "role": "user" if j % 2 == 0 else "assistant",
+                    "model": MODEL,
+                    "content": " ".join(rnd.choice(words) for _ in range(rnd.randint(5, 60))),
+                    "timestamp": created + timedelta(seconds=j),
+                })
+            if len(message_rows) >= 10000:
+                conn.execute(insert(Message), message_rows)
+                message_rows = []
+        if session_rows:
+            conn.execute(insert(SessionModel), session_rows)
+        if message_rows:
+            conn.execute(insert(Message), message_rows)
+    engine.dispose()
+    return owned
+
+
+class BenchStack:
+    """Seeded database + stub Ollama + API server, all in a temporary directory."""
+
+    def __init__(
+        self,
+        users: int = 20,
+        sessions: int = 200,
+        messages: int = 20,
+        latency: float = 0.05,
+        tokens_per_sec: float = 200.0,
+        reply_tokens: int = 32,
+        workers: int = 1,
+        env: Optional[Dict[str, str]] = None,
+        seed_value: int = 0,
+    ):
+        self.users = users
+        self.sessions = sessions
+        self.messages = messages
+        self.latency = latency
+        self.tokens_per_sec = tokens_per_sec
+        self.reply_tokens = reply_tokens
+        self.workers = workers
+        self.env = env or {}
+        self.seed_value = seed_value
+        self.dir: Optional[str] = None
+        self.url = ""
+        self.owned: Dict[str, List[str]] = {}
+        self._stub: Optional[subprocess.Popen] = None
+        self._server: Optional[subprocess.Popen] = None
+        self._log = None
+
+    @property
+    def log_path(self) -> str:
+        return os.path.join(self.dir, "server.log")
+
+    def _wait(self, url: str, auth=None, timeout: float = 60) -> None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self._server is not None and self._server.poll() is not None:
+                raise RuntimeError(f"API server exited with {self._server.returncode}, see {self.log_path}")
+            try:
+                if httpx.get(url, auth=auth, timeout=2).status_code < 500:
+                    return
+            except httpx.TransportError:
+                pass
+            time.sleep(0.2)
+        raise RuntimeError(f"{url} did not come up in {timeout:g}s")
+
+    def start(self) -> None:
+        self.dir = tempfile.mkdtemp(prefix="synapse-bench-")
+        database_url = f"sqlite:///{os.path.join(self.dir, 'bench.db')}"
+        self.owned = seed(database_url, self.users, self.sessions, self.messages, self.seed_value)
+
+        stub_port = _free_port()
+        self._stub = subprocess.Popen([
+            sys.executable, "-m", "app.utils.stub_ollama", "--port", str(stub_port),
+            "--latency", str(self.latency), "--tokens-per-sec", str(self.tokens_per_sec),
+            "--reply-tokens", str(self.reply_tokens), "--model", MODEL,
+        ], cwd=ROOT, stdout=subprocess.DEVNULL)
+        self._wait(f"http://127.0.0.1:{stub_port}/api/tags")
+
+        port = _free_port()
+        env = dict(os.environ)
+        env.update({
+            "DATABASE_URL": database_url,
+            "OLLAMA_BACKEND": "http",
+            "OLLAMA_HOST": f"http://127.0.0.1:{stub_port}",
+            "OLLAMA_HOSTS": "",
+            "OLLAMA_CLI_FALLBACK": "0",
+            "RESPONSE_CACHE_PATH": os.path.join(self.dir, "response_cache.db"),
+            "RESPONSE_CACHE_EVICT_PATH": os.path.join(self.dir, ".response_cache_evict"),
+            "SLOW_REQUEST_SECONDS": env.get("SLOW_REQUEST_SECONDS", "3600"),
+        })
+        env.pop("PROMETHEUS_MULTIPROC_DIR", None)
+        if self.workers > 1:
+            # Общий счётчик лимитов для нескольких процессов
+            env.setdefault("RATE_LIMIT_BACKEND", "db")
+        env.update(self.env)
+        self._log = open(self.log_path, "w")
+        self._server = subprocess.Popen([
+            sys.executable, "-m", "uvicorn", "app.api_app:app",
+            "--host", "127.0.0.1", "--port", str(port),
+            "--workers", str(self.workers), "--log-level", "warning", "--no-access-log",
+        ], cwd=ROOT, env=env, stdout=self._log, stderr=subprocess.STDOUT)
+        self.url = f"http://127.0.0.1:{port}"
+        self._wait(f"{self.url}/ping", auth=("bench0", PASSWORD))
+
+    def lock_errors_in_log(self) -> int:
+        try:
+            with open(self.log_path, encoding="utf-8", errors="replace") as f:
+                return sum(line.count(LOCK_ERROR) for line in f)
+        except OSError:
+            return 0
+
+    def stop(self) -> None:
+        for process in (self._server, self._stub):
+            if process is not None and process.poll() is None:
+                process.terminate()
+                try:
+                    process.wait(timeout=30)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+                    process.wait()
+        if self._log is not None:
+            self._log.close()
+        if self.dir is not None:
+            shutil.rmtree(self.dir, ignore_errors=True)
+
+    def __enter__(self) -> "BenchStack":
+        try:
+            self.start()
+        except BaseException:
+            self.stop()
+            raise
+        return self
+
+    def __exit__(self, *exc) -> None:
+        self.stop()
+
+
+# ---- operations ----------------------------------------------------------------
+class Client:
+    """One virtual user: its credentials and sessions."""
+
+    def __init__(self, username: str, sessions: List[str], rnd: random.Random):
+        self.username = username
+        self.sessions = sessions or [f"bench-new-{username}"]
+        self.rnd = rnd
+        self.sent = 0
+
+    @property
+    def auth(self) -> Tuple[str, str]:
+        return self.username, PASSWORD
+
+    def session(self) -> str:
+        return self.rnd.choice(self.sessions)
+
+    def prompt(self) -> str:
+        # Каждый промпт уникален: кэш ответов и single-flight не срабатывают
+        self.sent += 1
+        return f"benchmark prompt {self.username} {self.sent} {self.rnd.random():.6f}"
+
+
+async def _chat(http: httpx.AsyncClient, client: Client, stream: bool) -> httpx.Response:
+    body = {"model": MODEL, "prompt": client.prompt(), "stream": stream}
+    if not stream:
+        return await http.post(f"/chat/{client.session()}", json=body, auth=client.auth)
+    async with http.stream("POST", f"/chat/{client.session()}", json=body, auth=client.auth) as resp:
+        await resp.aread()
+    return resp
+
+
+async def op_chat(http, client):
+    return await _chat(http, client, False)
+
+
+async def op_chat_stream(http, client):
+    return await _chat(http, client, True)
+
+
+async def op_history_sessions(http, client):
+    return await http.get("/history/sessions", auth=client.auth)
+
+
+async def op_history_messages(http, client):
+    return await http.get(f"/history/{client.session()}", params={"latest": "true"}, auth=client.auth)
+
+
+async def op_models(http, client):
+    return await http.get("/models/installed", auth=client.auth)
+
+
+async def op_ping(http, client):
+    return await http.get("/ping", auth=client.auth)
+
+
+OPERATIONS = {
+    "chat": op_chat,
+    "chat_stream": op_chat_stream,
+    "history_sessions": op_history_sessions,
+    "history_messages": op_history_messages,
+    "models": op_models,
+    "ping": op_ping,
+}
+
+
+# ---- load --------------------------------------------------------------------
+Sample = Tuple[str, float, int, bool]  # (операция, секунды, статус, ошибка блокировки БД)
+
+
+async def run_load(
+    url: str,
+    owned: Dict[str, List[str]],
+    mix: Dict[str, int],
+    concurrency: int,
+    duration: float,
+    warmup: float = 2.0,
+    seed_value: int = 0,
+    timeout: float = 120.0,
+) -> Tuple[List[Sample], float]:
+    """Closed loop: `concurrency` clients send requests back to back. Returns samples and measured seconds."""
+    unknown = set(mix) - set(OPERATIONS)
+    if unknown:
+        raise ValueError(f"Unknown operations in mix: {', '.join(sorted(unknown))}")
+    names, weights = list(mix), list(mix.values())
+    users = sorted(owned)
+    samples: List[Sample] = []
+    limits = httpx.Limits(max_connections=concurrency, max_keepalive_connections=concurrency)
+    loop = asyncio.get_running_loop()
+    measure_from = loop.time() + warmup
+    stop_at = measure_from + duration
+
+    async def worker(i: int, http: httpx.AsyncClient) -> None:
+        rnd = random.Random(seed_value * 1000003 + i)
+        username = users[i % len(users)]
+        client = Client(username, list(owned[username]), rnd)
+        while loop.time() < stop_at:
+            name = rnd.choices(names, weights)[0]
+            started = loop.time()
+            try:
+                resp = await OPERATIONS[name](http, client)
+                status, locked = resp.status_code, LOCK_ERROR in resp.text
+            except httpx.HTTPError as e:
+                status, locked = 0, LOCK_ERROR in str(e)
+            if started >= measure_from:
+                samples.append((name, loop.time() - started, status, locked))
+
+    async with httpx.AsyncClient(base_url=url, timeout=timeout, limits=limits) as http:
+        await asyncio.gather(*(worker(i, http) for i in range(concurrency)))
+    return samples, max(loop.time() - measure_from, 1e-9)
+
+
+def percentile(values: List[float], p: float) -> float:
+    """Nearest-rank percentile of sorted values."""
+    if not values:
+        return 0.0
+    rank = max(1, min(len(values), math.ceil(p / 100.0 * len(values))))
+    return values[rank - 1]
+
+
+def _stats(samples: List[Sample], seconds: float) -> Dict[str, object]:
+    latencies = sorted(s[1] for s in samples)
+    errors = sum(1 for s in samples if not 200 <= s[2] < 400)
+    return {
+        "requests": len(samples),
+        "throughput": round(len(samples) / seconds, 2),
+        "errors": errors,
+        "error_rate": round(errors / len(samples), 4) if samples else 0.0,
+        "lock_errors": sum(1 for s in samples if s[3]),
+        "p50_ms": round(percentile(latencies, 50) * 1000, 2),
+        "p95_ms": round(percentile(latencies, 95) * 1000, 2),
+        "p99_ms": round(percentile(latencies, 99) * 1000, 2),
+        "max_ms": round(latencies[-1] * 1000, 2) if latencies else 0.0,
+    }
+
+
+def summarize(samples: List[Sample], seconds: float) -> Dict[str, object]:
+    by_op: Dict[str, List[Sample]] = {}
+    statuses: Dict[str, int] = {}
+    for sample in samples:
+        by_op.setdefault(sample[0], []).append(sample)
+        statuses[str(sample[2])] = statuses.get(str(sample[2]), 0) + 1
+    return {
+        "seconds": round(seconds, 2),
+        "overall": _stats(samples, seconds),
+        "operations": {name: _stats(ops, seconds) for name, ops in sorted(by_op.items())},
+        "statuses": dict(sorted(statuses.items())),
+    }
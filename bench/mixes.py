@@ -0,0 +1,42 @@
+# bench/mixes.py
+"""
+Request mixes: operation name -> relative weight.
+
+Operations (see bench.harness.OPERATIONS):
+- chat              POST /chat/{session_id}, non-streaming, new prompt each time
+- chat_stream       POST /chat/{session_id} with "stream": true (NDJSON)
+- history_sessions  GET /history/sessions
+- history_messages  GET /history/{session_id}?latest=true
+- models            GET /models/installed (the remote catalog behind
+                    GET /models is not reachable from a benchmark)
+- ping              GET /ping (auth only)
+"""
+from typing import Dict
+
+MIXES: Dict[str, Dict[str, int]] = {
+    # Типичная нагрузка: чат и чтение истории
+    "default": {
+        "chat": 25,
+        "chat_stream": 10,
+        "history_messages": 25,
+        "history_sessions": 15,
+        "models": 10,
+        "ping": 15,
+    },
+    # Только генерации: очередь моделей, запись реплик, лимиты
+    "chat": {
+        "chat": 70,
+        "chat_stream": 30,
+    },
+    # Только чтение: пул соединений, пагинация, кэш авторизации
+    "read": {
+        "history_messages": 45,
+        "history_sessions": 25,
+        "models": 15,
+        "ping": 15,
+    },
+    # Нижняя граница накладных расходов запроса
+    "ping": {
+        "ping": 1,
+    },
+}
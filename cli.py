@@ -1,18 +1,24 @@
 # cli.py
 import os
+import sys
+import time
 import typer
 import subprocess
 import webbrowser
+from datetime import datetime
+from typing import Optional
 from dotenv import load_dotenv, set_key
-from sqlalchemy import inspect, text
 from sqlalchemy.orm import Session
 from app.database import engine, Base, SessionLocal
+from app.migrations import migrate
+from app.utils.search import reindex as rebuild_search_index
+from app.utils.transfer import IMPORT_BATCH, Exporter, Importer, gzip_chunks
 from app.models import User
 
 app = typer.Typer(invoke_without_command=True)
 
 @app.callback(invoke_without_command=True)
-def main():
+def main(ctx: typer.Context):
     """
     Запуск админ-панели с управлением API-сервером.
     При первом старте: создаёт администратора и спрашивает порты.
@@ -20,19 +26,17 @@ def main():
     """
     load_dotenv()
 
-    # 1) Миграция схемы: users → is_admin, daily_limit
-    insp = inspect(engine)
-    if "users" in insp.get_table_names():
-        cols = [c["name"] for c in insp.get_columns("users")]
-        with engine.connect() as conn:
-            if "is_admin" not in cols:
-                conn.execute(text("ALTER TABLE users ADD COLUMN is_admin BOOLEAN DEFAULT 0"))
-            if "daily_limit" not in cols:
-                conn.execute(text("ALTER TABLE users ADD COLUMN daily_limit INTEGER DEFAULT 1000"))
-
-    # 2) Создание таблиц rate_limits, sessions, messages, если не созданы
+    # 1) Создание таблиц rate_limits, sessions, messages, если не созданы
     Base.metadata.create_all(bind=engine)
 
+    # 2) Миграция схемы: новые колонки и индексы существующих таблиц
+    #    (FTS-индекс и триггеры ссылаются на messages — она уже должна быть)
+    migrate(engine)
+
+    # Вызвана подкоманда (export, ...) — админ-панель не запускаем
+    if ctx.invoked_subcommand is not None:
+        return
+
     # 3) Первый запуск — создание админа и выбор портов
     db: Session = SessionLocal()
     try:
@@ -87,5 +91,76 @@ def main():
         if proc.poll() is None:
             proc.terminate()
 
+@app.command()
+def export(
+    output: str = typer.Option("-", "--output", "-o", help="Файл для выгрузки, '-' — stdout"),
+    gzip: bool = typer.Option(False, "--gzip", help="Сжать выгрузку gzip"),
+    user: Optional[str] = typer.Option(None, "--user", help="Только сессии пользователя"),
+    since: Optional[datetime] = typer.Option(None, help="Сообщения начиная с даты"),
+    until: Optional[datetime] = typer.Option(None, help="Сообщения до даты (не включая)"),
+    model: Optional[str] = typer.Option(None, help="Только сообщения модели"),
+):
+    """Выгрузка истории чатов в NDJSON (потоком, с постоянным расходом памяти)."""
+    exporter = Exporter(user, since, until, model)
+    chunks = exporter.chunks()
+    if gzip:
+        chunks = gzip_chunks(chunks)
+    out = sys.stdout.buffer if output == "-" else open(output, "wb")
+    started = time.perf_counter()
+    try:
+        for chunk in chunks:
+            out.write(chunk)
+    finally:
+        if out is not sys.stdout.buffer:
+            out.close()
+    typer.secho(
+        f"Выгружено сессий: {exporter.sessions}, сообщений: {exporter.messages} "
+        f"за {time.perf_counter() - started:.1f} с",
+        fg=typer.colors.GREEN, err=True,
+    )
+
+@app.command(name="import")
+def import_(
+    source: str = typer.Argument("-", help="NDJSON-файл (можно .gz), '-' — stdin"),
+    batch: int = typer.Option(IMPORT_BATCH, help="Сообщений на транзакцию"),
+    defer_indexes: bool = typer.Option(
+        True, "--defer-indexes/--keep-indexes",
+        help="Перестроить индексы messages один раз после загрузки",
+    ),
+):
+    """Массовая загрузка истории чатов из NDJSON (формат команды export)."""
+    def report(stats):
+        typer.echo(
+            f"\rсессий: {stats.sessions}, сообщений: {stats.messages}, "
+            f"{stats.rows_per_sec:,.0f} строк/с",
+            err=True, nl=False,
+        )
+
+    src = sys.stdin.buffer if source == "-" else open(source, "rb")
+    try:
+        stats = Importer(batch_size=batch, defer_indexes=defer_indexes, progress=report).run(src)
+    finally:
+        if src is not sys.stdin.buffer:
+            src.close()
+    typer.echo("", err=True)
+    typer.secho(
+        f"Загружено сессий: {stats.sessions}, сообщений: {stats.messages}, "
+        f"ошибок: {stats.errors} за {stats.seconds:.1f} с ({stats.rows_per_sec:,.0f} строк/с)",
+        fg=typer.colors.GREEN, err=True,
+    )
+
+@app.command()
+def reindex():
+    """Перестроить полнотекстовый индекс сообщений (FTS5) для GET /history/search."""
+    try:
+        count, seconds = rebuild_search_index(engine)
+    except RuntimeError as e:
+        typer.secho(str(e), fg=typer.colors.RED, err=True)
+        raise typer.Exit(1)
+    typer.secho(
+        f"Проиндексировано сообщений: {count} за {seconds:.1f} с",
+        fg=typer.colors.GREEN, err=True,
+    )
+
 if __name__ == "__main__":
     app()
@@ -0,0 +1,93 @@
+# tests/conftest.py
+"""
+Shared fixtures. Settings are read from the environment when the app
+modules are imported, so the environment is prepared here first: a
+scratch directory for the database and every state file, and a stub
+Ollama server (app.utils.stub_ollama) as the backend.
+"""
+import os
+import tempfile
+import uuid
+
+import pytest
+
+TMP_DIR = tempfile.mkdtemp(prefix="synapse-tests-")
+
+from app.utils.stub_ollama import StubState, start_in_thread  # noqa: E402
+
+STUB = StubState(models=["stub:latest", "other:latest"])
+_stub_server = start_in_thread(port=0, state=STUB)
+
+os.environ.update(
+    DATABASE_URL=f"sqlite:///{os.path.join(TMP_DIR, 'test.db')}",
+    OLLAMA_HOST=f"http://127.0.0.1:{_stub_server.server_address[1]}",
+    OLLAMA_CLI_FALLBACK="0",
+    AUTH_EPOCH_PATH=os.path.join(TMP_DIR, ".auth_epoch"),
+    RATE_LIMIT_RESET_PATH=os.path.join(TMP_DIR, ".ratelimit_reset"),
+    RESPONSE_CACHE_PATH=os.path.join(TMP_DIR, "response_cache.db"),
+    RESPONSE_CACHE_EVICT_PATH=os.path.join(TMP_DIR, ".response_cache_evict"),
+    CATALOG_CACHE_PATH=os.path.join(TMP_DIR, "catalog_cache.json"),
+    RESIDENCY="0",
+    RESIDENCY_STATE_PATH=os.path.join(TMP_DIR, "residency.json"),
+    TRACE_PROFILE_DIR=os.path.join(TMP_DIR, "profiles"),
+)
+
+import httpx  # noqa: E402
+
+from app.database import Base, SessionLocal, engine  # noqa: E402
+from app.migrations import migrate  # noqa: E402
+from app.models import User  # noqa: E402
+
+Base.metadata.create_all(bind=engine)
+migrate(engine)
+
+
+@pytest.fixture(scope="session")
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+def stub():
+    """The stub backend; its knobs are restored after each test."""
+    saved = (STUB.latency, STUB.tokens_per_sec, STUB.reply_tokens, STUB.drop_after)
+    yield STUB
+    STUB.latency, STUB.tokens_per_sec, STUB.reply_tokens, STUB.drop_after = saved
+
+
+@pytest.fixture(scope="session")
+async def api():
+    """The API application, started once for the whole run."""
+    from app.api_app import app
+
+    await app.router._startup()
+    yield app
+    await app.router._shutdown()
+
+
+@pytest.fixture
+async def client(api):
+    transport = httpx.ASGITransport(app=api)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test", timeout=30) as c:
+        yield c
+
+
+def make_user(daily_limit: int = 1000, is_admin: bool = False) -> User:
+    """A fresh user; the password equals the name."""
+    name = f"u-{uuid.uuid4().hex[:8]}"
+    with SessionLocal() as db:
+        user = User(username=name, password_hash=name, is_admin=is_admin, daily_limit=daily_limit)
+        db.add(user)
+        db.commit()
+        db.refresh(user)
+    return user
+
+
+@pytest.fixture
+def user():
+    return make_user()
+
+
+@pytest.fixture
+def auth(user):
+    return (user.username, user.username)
@@ -0,0 +1,64 @@
+# tests/test_admin.py
+"""Admin tables: keyset pages over (sort column, primary key)."""
+import pytest
+from sqlalchemy import select
+
+from app.database import AsyncSessionLocal
+from app.models import User
+from app.routers.admin import USER_SORTS, _page
+from tests.conftest import make_user
+
+
+async def walk(db, order: str, size: int):
+    """All pages forward, then all pages back from the last one."""
+    forward, pages = [], []
+    rows, prev, nxt = await _page(db, User, USER_SORTS["daily_limit"], User.username, order, size)
+    assert prev is None
+    while True:
+        pages.append([u.username for u in rows])
+        forward += pages[-1]
+        if nxt is None:
+            break
+        rows, prev, nxt = await _page(db, User, USER_SORTS["daily_limit"], User.username, order, size, after=nxt)
+        assert prev == rows[0].username
+
+    backward = [pages[-1]]
+    prev = await _prev_of_last(db, order, size, pages)
+    while prev is not None:
+        rows, prev, nxt = await _page(db, User, USER_SORTS["daily_limit"], User.username, order, size, before=prev)
+        backward.insert(0, [u.username for u in rows])
+        assert nxt == rows[-1].username
+    return forward, pages, backward
+
+
+async def _prev_of_last(db, order, size, pages):
+    if len(pages) < 2:
+        return None
+    _, prev, _ = await _page(
+        db, User, USER_SORTS["daily_limit"], User.username, order, size, after=pages[-2][-1],
+    )
+    return prev
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("order", ["asc", "desc"])
+async def test_user_pages_follow_cursors(order):
+    # Одинаковый лимит у нескольких — порядок решает первичный ключ
+    for limit in (5, 7, 7, 7, 9, 9, 11):
+        make_user(daily_limit=limit)
+    async with AsyncSessionLocal() as db:
+        users = (await db.scalars(select(User))).all()
+        expected = sorted(users, key=lambda u: (u.daily_limit, u.username), reverse=order == "desc")
+        forward, pages, backward = await walk(db, order, 3)
+    assert forward == [u.username for u in expected]
+    assert all(len(p) == 3 for p in pages[:-1])
+    assert backward == pages
+
+
+@pytest.mark.anyio
+async def test_unknown_cursor_starts_over():
+    make_user()
+    async with AsyncSessionLocal() as db:
+        first, _, _ = await _page(db, User, User.username, User.username, "asc", 2)
+        rows, prev, _ = await _page(db, User, User.username, User.username, "asc", 2, after="gone")
+    assert [u.username for u in rows] == [u.username for u in first] and prev is None
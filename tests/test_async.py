@@ -0,0 +1,58 @@
+# tests/test_async.py
+"""The request path does not block the event loop: slow backends and subprocesses overlap."""
+import sys
+import time
+import uuid
+
+import anyio
+import pytest
+
+from app.utils.concurrency import run_blocking, run_command
+
+
+async def chat(client, auth, model="stub:latest"):
+    body = {"model": model, "prompt": f"hi {uuid.uuid4().hex}"}
+    r = await client.post(f"/chat/{uuid.uuid4().hex}", json=body, auth=auth)
+    assert r.status_code == 200
+
+
+@pytest.mark.anyio
+async def test_concurrent_chats_overlap(client, auth, stub):
+    stub.latency = 0.4
+    started = time.monotonic()
+    async with anyio.create_task_group() as tg:
+        for model in ("stub:latest", "stub:latest", "other:latest"):
+            tg.start_soon(chat, client, auth, model)
+    # Последовательно было бы 1.2 с
+    assert time.monotonic() - started < 0.8
+
+
+@pytest.mark.anyio
+async def test_other_requests_are_served_during_a_slow_chat(client, auth, stub):
+    stub.latency = 0.8
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(chat, client, auth)
+        await anyio.sleep(0.1)
+        started = time.monotonic()
+        r = await client.get("/history/sessions", auth=auth)
+        assert r.status_code == 200
+        assert time.monotonic() - started < 0.4
+
+
+@pytest.mark.anyio
+async def test_subprocess_and_pool_do_not_block_the_loop():
+    ticks = 0
+
+    async def tick():
+        nonlocal ticks
+        while True:
+            ticks += 1
+            await anyio.sleep(0.02)
+
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(tick)
+        code, out, _ = await run_command([sys.executable, "-c", "import time; time.sleep(0.3); print('ok')"])
+        await run_blocking(time.sleep, 0.2)
+        tg.cancel_scope.cancel()
+    assert code == 0 and out.strip() == b"ok"
+    assert ticks >= 10
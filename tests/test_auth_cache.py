@@ -0,0 +1,55 @@
+# tests/test_auth_cache.py
+"""Credential cache: exact credentials only, TTL and size bounds, invalidation across processes."""
+import pytest
+
+from app.database import SessionLocal
+from app.models import User
+from app.utils import auth_cache
+from app.utils.auth_cache import CachedUser, CredentialCache
+
+
+def make_cache(tmp_path, **kwargs) -> CredentialCache:
+    return CredentialCache(epoch_path=str(tmp_path / ".epoch"), **kwargs)
+
+
+def test_hit_needs_the_same_password(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.put("alice", "secret", CachedUser("alice", False, 10))
+    assert cache.get("alice", "secret").daily_limit == 10
+    assert cache.get("alice", "guess") is None
+    # Пароль в кэше не хранится — только HMAC
+    assert b"secret" not in repr(cache._entries).encode()
+
+
+def test_entries_expire_and_are_bounded(tmp_path, monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(auth_cache.time, "monotonic", lambda: now[0])
+    cache = make_cache(tmp_path, ttl=60, max_size=2)
+    for name in ("a", "b"):
+        cache.put(name, name, CachedUser(name, False, 1))
+    assert cache.get("a", "a") is not None
+    cache.put("c", "c", CachedUser("c", False, 1))
+    # Вытеснен самый давно использованный
+    assert cache.get("b", "b") is None and cache.get("a", "a") is not None
+    now[0] += 61
+    assert cache.get("a", "a") is None and list(cache._entries) == ["c"]
+
+
+def test_invalidate_reaches_other_processes(tmp_path):
+    api, admin = make_cache(tmp_path), make_cache(tmp_path)
+    api.put("alice", "secret", CachedUser("alice", False, 10))
+    admin.invalidate("alice")
+    assert api.get("alice", "secret") is None
+
+
+@pytest.mark.anyio
+async def test_password_change_takes_effect_after_invalidate(client, user):
+    auth = (user.username, user.username)
+    assert (await client.get("/history/sessions", auth=auth)).status_code == 200
+    with SessionLocal() as db:
+        db.get(User, user.username).password_hash = "changed"
+        db.commit()
+    # Проверенные учётные данные ещё в кэше — БД не читается
+    assert (await client.get("/history/sessions", auth=auth)).status_code == 200
+    auth_cache.credential_cache.invalidate(user.username)
+    assert (await client.get("/history/sessions", auth=auth)).status_code == 401
@@ -0,0 +1,49 @@
+# tests/test_backends.py
+"""HTTP backend: one keep-alive pool for all requests, closed on shutdown."""
+import asyncio
+
+import pytest
+
+from app.utils import backends
+from app.utils.backends import HTTPBackend
+from app.utils.stub_ollama import StubState, start_in_thread
+
+MESSAGES = [{"role": "user", "content": "hi"}]
+
+
+@pytest.fixture
+def stub_server():
+    state = StubState(reply_tokens=2)
+    server = start_in_thread(port=0, state=state)
+    yield state, f"http://127.0.0.1:{server.server_address[1]}"
+    server.shutdown()
+    server.server_close()
+
+
+@pytest.mark.anyio
+async def test_requests_reuse_pooled_connections(stub_server):
+    state, host = stub_server
+    backend = HTTPBackend(host=host, pool_size=2)
+    try:
+        for _ in range(5):
+            assert await backend.chat("stub:latest", MESSAGES)
+        assert state.requests == 5 and state.connections == 1
+        # Параллельные запросы не открывают больше соединений, чем размер пула
+        await asyncio.gather(*(backend.chat("stub:latest", MESSAGES) for _ in range(6)))
+        assert state.requests == 11 and state.connections <= 2
+    finally:
+        await backend.aclose()
+    assert backend.client.is_closed
+
+
+@pytest.mark.anyio
+async def test_close_backend_drops_the_process_wide_client(stub_server):
+    _, host = stub_server
+    backend = HTTPBackend(host=host)
+    previous = backends.set_backend(backend)
+    try:
+        assert backends.get_backend() is backend
+        await backends.close_backend()
+        assert backend.client.is_closed and backends._backend is None
+    finally:
+        backends.set_backend(previous)
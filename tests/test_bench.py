@@ -0,0 +1,52 @@
+# tests/test_bench.py
+"""Benchmark suite: summaries, saved results and regression checks."""
+import pytest
+
+from bench import baseline
+from bench.harness import OPERATIONS, percentile, run_load, summarize
+from bench.mixes import MIXES
+
+
+def result(throughput: float, p95_ms: float, lock_errors: int = 0) -> dict:
+    stats = {"throughput": throughput, "p50_ms": 10.0, "p95_ms": p95_ms, "p99_ms": 50.0,
+             "error_rate": 0.0, "lock_errors": lock_errors}
+    return {"config": {"mix": "default"}, "summary": {"overall": stats, "operations": {"chat": dict(stats)}}}
+
+
+def test_every_mix_uses_known_operations():
+    for mix in MIXES.values():
+        assert set(mix) <= set(OPERATIONS) and all(weight > 0 for weight in mix.values())
+
+
+@pytest.mark.anyio
+async def test_unknown_operation_is_rejected():
+    with pytest.raises(ValueError, match="nope"):
+        await run_load("http://127.0.0.1:9", {"u": ["s"]}, {"nope": 1}, concurrency=1, duration=0)
+
+
+def test_summary_percentiles_and_errors():
+    assert percentile([0.1, 0.2, 0.3, 0.4], 50) == 0.2 and percentile([], 99) == 0.0
+    samples = [("chat", i / 1000, 200, False) for i in range(1, 100)] + [("ping", 0.5, 503, True)]
+    summary = summarize(samples, seconds=10)
+    overall = summary["overall"]
+    assert overall["requests"] == 100 and overall["throughput"] == 10.0
+    assert overall["errors"] == 1 and overall["lock_errors"] == 1
+    assert overall["p50_ms"] == 50.0 and overall["max_ms"] == 500.0
+    assert summary["statuses"] == {"200": 99, "503": 1}
+    assert summary["operations"]["ping"]["error_rate"] == 1.0
+
+
+def test_regressions_beyond_threshold_and_noise(tmp_path):
+    old = result(throughput=100, p95_ms=20)
+    path = baseline.save(old, "default", directory=str(tmp_path))
+    assert baseline.previous("default", directory=str(tmp_path)) == path
+    assert baseline.load(path) == old
+
+    def regressed(new):
+        return {(scope, text.split()[0]) for scope, text, bad in baseline.compare(old, new, 0.1) if bad}
+
+    # В пределах порога, и рост задержки меньше NOISE_MS — не регрессия
+    assert regressed(result(throughput=95, p95_ms=20.9)) == set()
+    assert regressed(result(throughput=80, p95_ms=20)) == {("overall", "throughput"), ("chat", "throughput")}
+    assert ("overall", "p95") in regressed(result(throughput=100, p95_ms=30))
+    assert ("overall", "lock") in regressed(result(throughput=100, p95_ms=20, lock_errors=1))
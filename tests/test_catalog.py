@@ -0,0 +1,115 @@
+# tests/test_catalog.py
+"""Model catalog against saved library pages: conditional refresh, on-disk cache, failures."""
+import os
+
+import httpx
+import pytest
+
+from app.utils.catalog import ModelCatalog, parse_base_models, parse_variants
+
+FIXTURES = os.path.join(os.path.dirname(__file__), "fixtures", "catalog")
+BASE_URL = "https://ollama.test/library"
+
+
+def page(name: str) -> str:
+    with open(os.path.join(FIXTURES, f"{name}.html"), encoding="utf-8") as f:
+        return f.read()
+
+
+class Library:
+    """MockTransport handler serving the fixture pages with ETags."""
+
+    def __init__(self):
+        self.requests = []
+        self.failing = set()
+
+    def __call__(self, request: httpx.Request) -> httpx.Response:
+        name = request.url.path.rstrip("/").split("/")[-1]
+        self.requests.append((name, request.headers.get("if-none-match")))
+        if name in self.failing:
+            return httpx.Response(503)
+        if not os.path.exists(os.path.join(FIXTURES, f"{name}.html")):
+            return httpx.Response(404)
+        etag = f'"{name}-v1"'
+        if request.headers.get("if-none-match") == etag:
+            return httpx.Response(304, headers={"ETag": etag})
+        return httpx.Response(200, text=page(name), headers={"ETag": etag})
+
+
+def catalog(tmp_path, library: Library, **kwargs) -> ModelCatalog:
+    return ModelCatalog(
+        path=str(tmp_path / "catalog.json"),
+        base_url=BASE_URL,
+        transport=httpx.MockTransport(library),
+        **kwargs,
+    )
+
+
+def test_parsers():
+    assert parse_base_models(page("library")) == ["llama3", "phi3"]
+    assert parse_variants("llama3", page("llama3")) == ["llama3:70b", "llama3:8b", "llama3:latest"]
+
+
+@pytest.mark.anyio
+async def test_refresh_uses_etags(tmp_path):
+    library = Library()
+    cat = catalog(tmp_path, library)
+    await cat.refresh()
+    assert cat.base == ["llama3", "phi3"]
+    assert cat.variants["phi3"] == ["phi3:medium", "phi3:mini"]
+    assert all(etag is None for _, etag in library.requests)
+
+    library.requests.clear()
+    await cat.refresh()
+    # Всё не изменилось: условные запросы, ответ 304, данные те же
+    assert sorted(library.requests) == [
+        ("library", '"library-v1"'), ("llama3", '"llama3-v1"'), ("phi3", '"phi3-v1"'),
+    ]
+    assert cat.variants["llama3"] == ["llama3:70b", "llama3:8b", "llama3:latest"]
+
+
+@pytest.mark.anyio
+async def test_disk_cache_survives_restart(tmp_path):
+    library = Library()
+    await catalog(tmp_path, library).refresh()
+
+    def offline(request):
+        raise httpx.ConnectError("offline")
+
+    restarted = ModelCatalog(
+        path=str(tmp_path / "catalog.json"), base_url=BASE_URL, transport=httpx.MockTransport(offline),
+    )
+    restarted.load()
+    assert await restarted.all_models() == [
+        "llama3:70b", "llama3:8b", "llama3:latest", "phi3:medium", "phi3:mini",
+    ]
+    # Валидаторы тоже восстановлены: следующее обновление будет условным
+    assert restarted.validators[BASE_URL]["etag"] == '"library-v1"'
+
+
+@pytest.mark.anyio
+async def test_failed_variant_page_is_not_cached(tmp_path):
+    library = Library()
+    library.failing.add("phi3")
+    cat = catalog(tmp_path, library, failure_ttl=60)
+    assert await cat.model_variants("phi3") == []
+    assert "phi3" not in cat.variants
+    # В пределах failure_ttl повторно не запрашиваем
+    library.requests.clear()
+    assert await cat.model_variants("phi3") == []
+    assert library.requests == []
+
+    library.failing.clear()
+    cat.failure_ttl = 0
+    assert await cat.model_variants("phi3") == ["phi3:medium", "phi3:mini"]
+
+
+@pytest.mark.anyio
+async def test_failure_keeps_stale_variants(tmp_path):
+    library = Library()
+    cat = catalog(tmp_path, library)
+    await cat.refresh()
+    library.failing.add("llama3")
+    cat.validators.clear()
+    await cat.refresh()
+    assert cat.variants["llama3"] == ["llama3:70b", "llama3:8b", "llama3:latest"]
@@ -0,0 +1,31 @@
+# tests/test_chat.py
+"""Streaming chat replies: token frames and how backend failures reach the client."""
+import json
+import uuid
+
+import pytest
+
+
+async def frames(client, auth, body):
+    async with client.stream("POST", f"/chat/{uuid.uuid4().hex}", json=body, auth=auth) as r:
+        assert r.status_code == 200
+        return [json.loads(line) async for line in r.aiter_lines() if line]
+
+
+@pytest.mark.anyio
+async def test_stream_ends_with_full_reply(client, auth, stub):
+    stub.reply_tokens = 4
+    body = {"model": "stub:latest", "prompt": uuid.uuid4().hex, "stream": True, "temperature": 0.7}
+    result = await frames(client, auth, body)
+    assert [f["done"] for f in result] == [False] * 4 + [True]
+    assert result[-1]["response"] == "".join(f["token"] for f in result[:-1]).strip()
+
+
+@pytest.mark.anyio
+async def test_connection_lost_mid_stream(client, auth, stub):
+    stub.reply_tokens, stub.drop_after = 8, 3
+    body = {"model": "stub:latest", "prompt": uuid.uuid4().hex, "stream": True, "temperature": 0.7}
+    result = await frames(client, auth, body)
+    # Три токена дошли, затем — кадр с ошибкой, а не оборванный ответ
+    assert [f["done"] for f in result] == [False] * 3 + [True]
+    assert "interrupted" in result[-1]["error"]
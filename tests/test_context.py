@@ -0,0 +1,88 @@
+# tests/test_context.py
+"""Context window: token budget, turn limit, LRU, writes by another process, queued turns."""
+import uuid
+
+import pytest
+
+from app.database import AsyncSessionLocal, SessionLocal
+from app.models import Message
+from app.utils.context import ContextCache, estimate_tokens
+
+
+def add_messages(session_id: str, *contents: str) -> None:
+    with SessionLocal() as db:
+        db.add_all(Message(session_id=session_id, role="user", model="m", content=c) for c in contents)
+        db.commit()
+
+
+async def window(cache: ContextCache, session_id: str, prompt: str = "now", model: str = "m"):
+    async with AsyncSessionLocal() as db:
+        return [m["content"] for m in await cache.window(db, session_id, model, prompt)]
+
+
+def test_estimate_tokens():
+    assert estimate_tokens("") == 1 and estimate_tokens("x" * 40) == 10
+
+
+@pytest.mark.anyio
+async def test_window_keeps_newest_turns_within_budget(api, monkeypatch):
+    from app.utils import context
+
+    # 10 токенов на реплику, бюджет 32: промпт (1) и три последние реплики
+    monkeypatch.setattr(context, "CONTEXT_TOKEN_BUDGETS", {"m": 32})
+    sid = uuid.uuid4().hex
+    add_messages(sid, *(f"{i}" * 40 for i in range(5)))
+    assert await window(ContextCache(), sid) == ["2" * 40, "3" * 40, "4" * 40, "now"]
+
+
+@pytest.mark.anyio
+async def test_turn_limit_and_lru(api):
+    cache = ContextCache(max_sessions=2, max_turns=3)
+    a, b, c = (uuid.uuid4().hex for _ in range(3))
+    for sid in (a, b, c):
+        add_messages(sid, "1", "2", "3", "4")
+    assert await window(cache, a) == ["2", "3", "4", "now"]
+    await window(cache, b)
+    await window(cache, c)
+    assert list(cache._entries) == [b, c]
+
+
+@pytest.mark.anyio
+async def test_reload_after_write_by_another_process(api):
+    cache = ContextCache()
+    sid = uuid.uuid4().hex
+    add_messages(sid, "old")
+    assert await window(cache, sid) == ["old", "now"]
+    # Другой воркер дописал сессию мимо этого кэша — max(id) изменился
+    add_messages(sid, "theirs")
+    assert await window(cache, sid) == ["old", "theirs", "now"]
+
+
+@pytest.mark.anyio
+async def test_queued_turns_are_included(api):
+    cache = ContextCache()
+    sid = uuid.uuid4().hex
+    add_messages(sid, "stored")
+    cache.pending_source = lambda session_id: [{"role": "assistant", "content": "queued"}] if session_id == sid else []
+    assert await window(cache, sid) == ["stored", "queued", "now"]
+
+
+
+@pytest.mark.anyio
+async def test_write_extends_only_a_current_entry(api, monkeypatch):
+    from app.utils import writer
+
+    cache = ContextCache()
+    monkeypatch.setattr(writer, "context_cache", cache)
+    sid = uuid.uuid4().hex
+    add_messages(sid, "old")
+    assert await window(cache, sid) == ["old", "now"]
+
+    await writer.write_turns([writer.Turn(sid, "m", [("user", "q"), ("assistant", "a")])])
+    assert [t["content"] for t in cache._entries[sid].turns] == ["old", "q", "a"]
+
+    # Другой воркер дописал сессию, затем пишет этот: устаревшая запись сбрасывается, а не дополняется
+    add_messages(sid, "theirs")
+    await writer.write_turns([writer.Turn(sid, "m", [("user", "mine")])])
+    assert sid not in cache._entries
+    assert await window(cache, sid) == ["old", "q", "a", "theirs", "mine", "now"]
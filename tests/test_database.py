@@ -0,0 +1,36 @@
+# tests/test_database.py
+"""DB_PROFILE: PRAGMAs on every connection and the settings reported on the admin page."""
+import httpx
+import pytest
+
+from app.admin_app import app as admin_app
+from app.database import DB_PROFILE, SQLITE_PROFILES, effective_settings, engine
+from tests.conftest import make_user
+
+
+def test_sync_connection_gets_profile_pragmas():
+    assert DB_PROFILE == "balanced"
+    with engine.connect() as conn:
+        pragma = lambda name: conn.exec_driver_sql(f"PRAGMA {name}").scalar()  # noqa: E731
+        assert pragma("journal_mode") == "wal"
+        assert pragma("busy_timeout") == SQLITE_PROFILES["balanced"]["busy_timeout"]
+        assert pragma("synchronous") == 1   # NORMAL
+
+
+@pytest.mark.anyio
+async def test_effective_settings_on_admin_page(api):
+    settings = await effective_settings()
+    assert settings["profile"] == "balanced"
+    assert settings["driver"] == "aiosqlite"
+    assert settings["journal_mode"] == "wal"
+    assert settings["busy_timeout"] == "5000"
+    assert settings["synchronous"] == "1"
+    assert settings["pool_size"] == "10"
+
+    admin = make_user(is_admin=True)
+    transport = httpx.ASGITransport(app=admin_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        r = await client.get("/admin", auth=(admin.username, admin.username))
+    assert r.status_code == 200
+    assert "<tr><th>journal_mode</th><td>wal</td></tr>" in r.text
+    assert "<tr><th>profile</th><td>balanced</td></tr>" in r.text
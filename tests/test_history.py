@@ -0,0 +1,84 @@
+# tests/test_history.py
+"""History endpoints: keyset cursors in both directions."""
+import uuid
+from datetime import datetime
+
+import pytest
+
+from app.database import SessionLocal
+from app.routers import history
+from app.models import Message, Session as SessionModel
+
+
+def add_session(n_messages: int, created_at=None) -> str:
+    sid = uuid.uuid4().hex
+    with SessionLocal() as db:
+        db.add(SessionModel(session_id=sid, username="nobody", created_at=created_at, message_count=n_messages))
+        db.add_all(Message(session_id=sid, role="user", model="m", content=str(i)) for i in range(n_messages))
+        db.commit()
+    return sid
+
+
+async def pages(client, auth, url, limit, direction="after", **params):
+    """Follow X-Next-Cursor (or X-Prev-Cursor) until the last page."""
+    header = "X-Next-Cursor" if direction == "after" else "X-Prev-Cursor"
+    result = []
+    while True:
+        r = await client.get(url, params={"limit": limit, **params}, auth=auth)
+        assert r.status_code == 200
+        result.append(r.json())
+        cursor = r.headers.get(header)
+        if cursor is None:
+            return result
+        params = {direction: cursor}
+
+
+@pytest.mark.anyio
+async def test_messages_pages(client, auth):
+    sid = add_session(7)
+    forward = await pages(client, auth, f"/history/{sid}", 3)
+    assert [[m["content"] for m in page] for page in forward] == [["0", "1", "2"], ["3", "4", "5"], ["6"]]
+
+    backward = await pages(client, auth, f"/history/{sid}", 3, direction="before", latest="true")
+    assert [[m["content"] for m in page] for page in backward] == [["4", "5", "6"], ["1", "2", "3"], ["0"]]
+
+    r = await client.get(f"/history/{sid}", params={"before": forward[1][0]["id"], "limit": 3}, auth=auth)
+    assert [m["content"] for m in r.json()] == ["0", "1", "2"]
+    assert r.headers["X-Next-Cursor"] == str(forward[0][-1]["id"])
+
+
+@pytest.mark.anyio
+async def test_latest_with_pending_turns(client, auth, monkeypatch):
+    sid = add_session(5)
+    queued = [{"role": "user", "model": "m", "content": f"p{i}", "timestamp": datetime.utcnow()} for i in range(2)]
+    monkeypatch.setattr(history.turn_writer, "pending_messages", lambda session_id: queued if session_id == sid else [])
+
+    # Незаписанные реплики занимают хвост страницы, курсор не теряет строки из БД
+    backward = await pages(client, auth, f"/history/{sid}", 3, direction="before", latest="true")
+    assert [[m["content"] for m in page] for page in backward] == [["4", "p0", "p1"], ["1", "2", "3"], ["0"]]
+
+    r = await client.get(f"/history/{sid}", params={"latest": "true", "limit": 2}, auth=auth)
+    assert [m["content"] for m in r.json()] == ["p0", "p1"]
+    r = await client.get(f"/history/{sid}", params={"before": r.headers["X-Prev-Cursor"], "limit": 2}, auth=auth)
+    assert [m["content"] for m in r.json()] == ["3", "4"]
+
+
+@pytest.mark.anyio
+async def test_sessions_pages_with_equal_timestamps(client, auth):
+    same = datetime(2001, 1, 1)
+    for _ in range(5):
+        add_session(0, created_at=same)
+    listed = [s for page in await pages(client, auth, "/history/sessions", 2) for s in page]
+    forward = [s["session_id"] for s in listed]
+    # Без пропусков и повторов на границах страниц, порядок (created_at, session_id) по убыванию
+    assert len(forward) == len(set(forward))
+    keys = [(s["created_at"], s["session_id"]) for s in listed]
+    assert keys == sorted(keys, reverse=True)
+
+    # От последней страницы назад — те же сессии в том же порядке
+    last = forward[-1]
+    backward = await pages(client, auth, "/history/sessions", 2, direction="before", before=last)
+    assert [s["session_id"] for page in reversed(backward) for s in page] + [last] == forward
+
+    r = await client.get("/history/sessions", params={"after": "no-such-session"}, auth=auth)
+    assert r.status_code == 400
@@ -0,0 +1,60 @@
+# tests/test_inventory.py
+"""Model inventory: misses share one backend reconcile, aliases, backend failures."""
+import asyncio
+
+import pytest
+
+from app.utils import inventory
+from app.utils.backends import ModelInfo
+from app.utils.inventory import ModelInventory
+
+
+class Backend:
+    def __init__(self, names):
+        self.names = list(names)
+        self.calls = 0
+        self.fail = False
+
+    async def list_models(self):
+        self.calls += 1
+        await asyncio.sleep(0.05)
+        if self.fail:
+            raise RuntimeError("backend down")
+        return [ModelInfo(name) for name in self.names]
+
+
+@pytest.fixture
+def backend(monkeypatch):
+    backend = Backend(["llama3:latest", "phi3:mini"])
+    monkeypatch.setattr(inventory, "get_backend", lambda: backend)
+    return backend
+
+
+@pytest.mark.anyio
+async def test_concurrent_misses_share_one_reconcile(backend):
+    inv = ModelInventory(miss_recheck=0)
+    results = await asyncio.gather(*(inv.contains("missing:7b") for _ in range(20)))
+    assert results == [False] * 20
+    assert backend.calls == 1
+
+    # Модель появилась на бэкенде — следующий промах её находит
+    backend.names.append("missing:7b")
+    assert await inv.contains("missing:7b")
+    assert backend.calls == 2
+
+
+@pytest.mark.anyio
+async def test_aliases_and_recheck_window(backend):
+    inv = ModelInventory(miss_recheck=60)
+    assert await inv.contains("llama3") and await inv.contains("phi3:mini")
+    assert not await inv.contains("gone")
+    assert not await inv.contains("gone")
+    assert backend.calls == 1
+    inv.discard("llama3")
+    assert inv.get("llama3:latest") is None
+
+
+@pytest.mark.anyio
+async def test_unreachable_backend_lets_the_request_through(backend):
+    backend.fail = True
+    assert await ModelInventory(miss_recheck=0).contains("anything")
@@ -0,0 +1,139 @@
+# tests/test_jobs.py
+"""Model pull jobs: dedup, progress, cancellation — within one worker and across two."""
+import os
+import socket
+import subprocess
+import sys
+import time
+
+import anyio
+import httpx
+import pytest
+
+from tests.conftest import make_user
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def wait_finished(client, auth, job_id, timeout=10.0):
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        job = (await client.get(f"/models/jobs/{job_id}", auth=auth)).json()
+        if job["status"] in ("completed", "failed", "cancelled"):
+            return job
+        await anyio.sleep(0.1)
+    raise AssertionError(f"job {job_id} did not finish")
+
+
+@pytest.mark.anyio
+async def test_install_dedup_and_progress(client, auth, stub):
+    stub.latency = 0.05
+    first = (await client.post("/models/pulled-a/install", auth=auth)).json()
+    second = (await client.post("/models/pulled-a/install", auth=auth)).json()
+    assert first["job_id"] == second["job_id"]
+
+    async with client.stream("GET", f"/models/jobs/{first['job_id']}/events", auth=auth) as r:
+        events = [line for line in [l async for l in r.aiter_lines()] if line.startswith("event:")]
+    assert events[-1] == "event: done"
+    job = await wait_finished(client, auth, first["job_id"])
+    assert job["status"] == "completed" and job["percent"] == 100.0
+    assert stub.find_model("pulled-a") is not None
+    # Завершённое задание не мешает новому
+    third = (await client.post("/models/pulled-a/install", auth=auth)).json()
+    assert third["job_id"] != first["job_id"]
+    await wait_finished(client, auth, third["job_id"])
+
+
+@pytest.mark.anyio
+async def test_cancel_running_job(client, auth, stub):
+    stub.latency = 0.3
+    job = (await client.post("/models/pulled-b/install", auth=auth)).json()
+    await anyio.sleep(0.5)
+    cancelled = (await client.delete(f"/models/jobs/{job['job_id']}", auth=auth)).json()
+    assert cancelled["status"] == "cancelled"
+    assert (await client.get("/models/jobs/nope", auth=auth)).status_code == 404
+
+
+# ---- two API workers sharing one database -------------------------------------------
+def _free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _start_worker(auth) -> tuple:
+    port = _free_port()
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.api_app:app", "--host", "127.0.0.1", "--port", str(port)],
+        cwd=ROOT, env={**os.environ, "PULL_SYNC_INTERVAL": "0.1"},
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+    )
+    url = f"http://127.0.0.1:{port}"
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"{url}/ping", auth=auth, timeout=1).status_code == 200:
+                return proc, url
+        except httpx.HTTPError:
+            pass
+        if proc.poll() is not None:
+            break
+        time.sleep(0.2)
+    proc.kill()
+    raise AssertionError("API worker did not start")
+
+
+@pytest.fixture
+def two_workers(stub):
+    user = make_user()
+    auth = (user.username, user.username)
+    workers = []
+    try:
+        # По очереди: create_all/migrate при старте не должны пересекаться
+        workers.append(_start_worker(auth))
+        workers.append(_start_worker(auth))
+        yield auth, workers[0][1], workers[1][1]
+    finally:
+        for proc, _ in workers:
+            proc.terminate()
+        for proc, _ in workers:
+            proc.wait(10)
+
+
+def test_jobs_are_shared_between_workers(two_workers, stub):
+    auth, a, b = two_workers
+    stub.latency = 0.3
+    job = httpx.post(f"{a}/models/shared-c/install", auth=auth).json()
+
+    # Другой воркер видит задание и не начинает вторую загрузку
+    seen = httpx.get(f"{b}/models/jobs/{job['job_id']}", auth=auth)
+    assert seen.status_code == 200
+    again = httpx.post(f"{b}/models/shared-c/install", auth=auth).json()
+    assert again["job_id"] == job["job_id"]
+    assert job["job_id"] in [j["job_id"] for j in httpx.get(f"{b}/models/jobs", auth=auth).json()]
+
+    # Прогресс, записанный владельцем, виден через другой воркер
+    deadline = time.monotonic() + 10
+    while httpx.get(f"{b}/models/jobs/{job['job_id']}", auth=auth).json()["completed"] == 0:
+        assert time.monotonic() < deadline
+        time.sleep(0.1)
+
+    # Отмена через другой воркер прерывает загрузку у владельца
+    httpx.delete(f"{b}/models/jobs/{job['job_id']}", auth=auth)
+    deadline = time.monotonic() + 10
+    while True:
+        status = httpx.get(f"{a}/models/jobs/{job['job_id']}", auth=auth).json()["status"]
+        if status == "cancelled":
+            break
+        assert status == "running" and time.monotonic() < deadline
+        time.sleep(0.1)
+
+
+def test_events_stream_from_another_worker(two_workers, stub):
+    auth, a, b = two_workers
+    stub.latency = 0.05
+    job = httpx.post(f"{a}/models/shared-d/install", auth=auth).json()
+    with httpx.stream("GET", f"{b}/models/jobs/{job['job_id']}/events", auth=auth, timeout=20) as r:
+        assert r.status_code == 200
+        events = [line for line in r.iter_lines() if line.startswith("event:")]
+    assert events[-1] == "event: done"
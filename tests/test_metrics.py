@@ -0,0 +1,61 @@
+# tests/test_metrics.py
+"""Prometheus metrics: route templates, inference and SQL samples; dead workers in multiprocess mode."""
+import os
+import subprocess
+import sys
+import uuid
+
+import pytest
+from prometheus_client import CollectorRegistry, generate_latest
+from prometheus_client.multiprocess import MultiProcessCollector
+
+from app.utils import metrics
+
+
+def sample(text: str, prefix: str) -> float:
+    """Value of the first exposition line starting with `prefix` (0 if absent)."""
+    for line in text.splitlines():
+        if line.startswith(prefix):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+@pytest.mark.anyio
+async def test_requests_are_labelled_by_route_template(client, auth, stub):
+    sid = uuid.uuid4().hex
+    r = await client.post(f"/chat/{sid}", json={"model": "stub:latest", "prompt": uuid.uuid4().hex}, auth=auth)
+    assert r.status_code == 200
+    await client.get(f"/history/{sid}", auth=auth)
+
+    text = (await client.get("/metrics")).text
+    # Шаблон маршрута, а не конкретный session_id
+    assert sid not in text
+    assert sample(text, 'http_requests_total{app="api",method="GET",route="/history/{session_id}",status="200"}') >= 1
+    assert sample(text, 'inference_tokens_total{model="stub:latest"}') >= stub.reply_tokens
+    assert sample(text, 'db_query_duration_seconds_count{engine="async",statement="select"}') >= 1
+
+
+def test_dead_worker_gauges_are_dropped(tmp_path):
+    # Воркер в режиме multiprocess: пишет счётчик и live-gauge в общий каталог и завершается
+    script = (
+        "import os\n"
+        "from prometheus_client import Counter, Gauge\n"
+        "Counter('worker_jobs', 'jobs').inc(3)\n"
+        "Gauge('worker_busy', 'busy', multiprocess_mode='livesum').inc()\n"
+        "print(os.getpid())\n"
+    )
+    env = {**os.environ, "PROMETHEUS_MULTIPROC_DIR": str(tmp_path)}
+    pid = int(subprocess.run(
+        [sys.executable, "-c", script], env=env, capture_output=True, text=True, check=True,
+    ).stdout)
+
+    def collect() -> str:
+        registry = CollectorRegistry()
+        MultiProcessCollector(registry, path=str(tmp_path))
+        return generate_latest(registry).decode()
+
+    assert sample(collect(), "worker_busy ") == 1
+    metrics.mark_process_dead(pid, str(tmp_path))
+    text = collect()
+    assert sample(text, "worker_busy ") == 0
+    assert sample(text, "worker_jobs_total ") == 3
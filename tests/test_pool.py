@@ -0,0 +1,72 @@
+# tests/test_pool.py
+"""Backend pool: routing by installed model, failover past a dead host, ejection."""
+import socket
+
+import pytest
+
+from app.utils.backends import BackendUnavailable
+from app.utils.pool import PoolBackend
+from app.utils.stub_ollama import StubState, start_in_thread
+
+
+def dead_host() -> str:
+    # Порт, который никто не слушает
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return f"http://127.0.0.1:{s.getsockname()[1]}"
+
+
+@pytest.fixture(scope="module")
+def hosts():
+    states = [StubState(models=["stub:latest"]), StubState(models=["stub:latest", "only:latest"])]
+    servers = [start_in_thread(port=0, state=state) for state in states]
+    yield [f"http://127.0.0.1:{s.server_address[1]}" for s in servers], states
+    for server in servers:
+        server.shutdown()
+
+
+@pytest.fixture
+async def pool(hosts):
+    urls, _ = hosts
+    pool = PoolBackend([dead_host(), *urls], interval=3600)
+    yield pool
+    await pool.aclose()
+
+
+async def reply(pool, model: str) -> str:
+    tokens = await pool.stream_chat(model, [{"role": "user", "content": "hi"}])
+    return "".join([t async for t in tokens])
+
+
+@pytest.mark.anyio
+async def test_requests_fail_over_past_a_dead_host(pool, hosts):
+    _, states = hosts
+    before = [s.requests for s in states]
+    # Каждый хост побывает первым в ротации — ни один запрос не теряется
+    for _ in range(len(pool.members)):
+        assert await reply(pool, "stub:latest")
+    dead = pool.members[0]
+    assert dead.failures >= 1 and not dead.available
+    assert sum(s.requests for s in states) > sum(before)
+    assert all(m.outstanding == 0 for m in pool.members)
+
+
+@pytest.mark.anyio
+async def test_health_check_routes_to_the_host_with_the_model(pool, hosts):
+    await pool.check()
+    dead, first, second = pool.members
+    assert not dead.available and first.available and second.available
+    assert pool.route("only")[0] is second
+    assert {m.name for m in await pool.list_models()} == {"stub:latest", "only:latest"}
+    assert await reply(pool, "only")
+
+
+@pytest.mark.anyio
+async def test_no_reachable_host():
+    pool = PoolBackend([dead_host(), dead_host()], interval=3600)
+    try:
+        with pytest.raises(BackendUnavailable):
+            await pool.stream_chat("stub:latest", [{"role": "user", "content": "hi"}])
+        assert all(m.failures >= 1 and not m.available for m in pool.members)
+    finally:
+        await pool.aclose()
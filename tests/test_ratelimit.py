@@ -0,0 +1,101 @@
+# tests/test_ratelimit.py
+"""Daily limits: check-and-increment is atomic under concurrency; resets reach other processes."""
+import asyncio
+
+import pytest
+from sqlalchemy import delete, select
+
+from app.database import SessionLocal, engine
+from app.models import RateLimit
+from app.utils.auth_cache import CachedUser
+from app.utils.ratelimit import DBRateLimiter, MemoryRateLimiter, RateLimitExceeded, today
+from tests.conftest import make_user
+
+
+def cached(daily_limit: int) -> CachedUser:
+    user = make_user(daily_limit=daily_limit)
+    return CachedUser(user.username, user.is_admin, user.daily_limit)
+
+
+def stored(username: str) -> int:
+    with SessionLocal() as db:
+        return db.scalar(select(RateLimit.count).where(
+            RateLimit.username == username, RateLimit.date == today()
+        )) or 0
+
+
+async def burst(limiter, user: CachedUser, n: int) -> int:
+    async def one():
+        try:
+            await limiter.hit(user)
+            return True
+        except RateLimitExceeded:
+            return False
+
+    return sum(await asyncio.gather(*(one() for _ in range(n))))
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("make_limiter", [
+    lambda tmp: MemoryRateLimiter(reset_path=str(tmp / ".reset")),
+    lambda tmp: DBRateLimiter(),
+], ids=["memory", "db"])
+async def test_concurrent_hits_never_exceed_the_limit(api, tmp_path, make_limiter):
+    limiter, user = make_limiter(tmp_path), cached(daily_limit=7)
+    assert await burst(limiter, user, 40) == 7
+    if isinstance(limiter, MemoryRateLimiter):
+        await limiter.flush()
+    assert stored(user.username) == 7
+
+
+@pytest.mark.anyio
+async def test_reset_reaches_other_processes(api, tmp_path):
+    worker = MemoryRateLimiter(reset_path=str(tmp_path / ".reset"))
+    admin = MemoryRateLimiter(reset_path=str(tmp_path / ".reset"))
+    user = cached(daily_limit=3)
+    assert await burst(worker, user, 5) == 3
+    await worker.flush()
+
+    # Админка очистила rate_limits и сообщила об этом остальным процессам
+    with engine.begin() as conn:
+        conn.execute(delete(RateLimit).where(RateLimit.username == user.username))
+    await admin.forget(user.username)
+    assert await burst(worker, user, 5) == 3
+
+
+@pytest.mark.anyio
+async def test_flush_in_progress_skips_forgotten_user(api, tmp_path, monkeypatch):
+    from app.utils import ratelimit
+
+    limiter = MemoryRateLimiter(reset_path=str(tmp_path / ".reset"))
+    user, other = cached(daily_limit=5), cached(daily_limit=5)
+    await burst(limiter, user, 2)
+    await burst(limiter, other, 2)
+
+    # Запись дельт «зависла» на получении соединения, пока админка удаляет пользователя
+    gate, begin = asyncio.Event(), ratelimit.async_engine.begin
+
+    class SlowEngine:
+        def begin(self):
+            class Begin:
+                async def __aenter__(self):
+                    await gate.wait()
+                    self.ctx = begin()
+                    return await self.ctx.__aenter__()
+
+                async def __aexit__(self, *exc):
+                    return await self.ctx.__aexit__(*exc)
+
+            return Begin()
+
+    monkeypatch.setattr(ratelimit, "async_engine", SlowEngine())
+    flush = asyncio.create_task(limiter.flush())
+    await asyncio.sleep(0.01)
+    with engine.begin() as conn:
+        conn.execute(delete(RateLimit).where(RateLimit.username == user.username))
+    forget = asyncio.create_task(limiter.forget(user.username))
+    await asyncio.sleep(0.01)
+    assert not forget.done()
+    gate.set()
+    await asyncio.gather(flush, forget)
+    assert stored(user.username) == 0 and stored(other.username) == 2
@@ -0,0 +1,86 @@
+# tests/test_residency.py
+"""Residency eviction sees the activity of other workers (on the loop of the `api` fixture, which owns the backend client)."""
+import asyncio
+import os
+import time
+
+import pytest
+
+from app.utils.residency import ResidencyManager
+
+
+def manager(tmp_path, **kwargs) -> ResidencyManager:
+    m = ResidencyManager(
+        hot_models=[], popular=0, max_models=1, state_path=str(tmp_path / "residency.json"),
+        activity_interval=1, idle_seconds=30, **kwargs,
+    )
+    m.resident = [{"name": "stub:latest", "size_vram": 1}, {"name": "other:latest", "size_vram": 1}]
+    return m
+
+
+def worker(tmp_path, pid: int) -> ResidencyManager:
+    """Another worker's manager writing its own activity file."""
+    m = manager(tmp_path)
+    m.activity_path = os.path.join(m.activity_dir, f"{pid}.json")
+    return m
+
+
+@pytest.mark.anyio
+async def test_model_used_by_another_worker_is_kept(tmp_path, api, stub):
+    leader, other = manager(tmp_path), worker(tmp_path, 1)
+    # У лидера other:latest популярнее, но stub:latest только что запрошен другим воркером
+    leader.usage = {"other:latest": 5}
+    other.touch("stub:latest")
+    other.publish_activity()
+
+    await leader.evict()
+    assert [m["name"] for m in leader.resident] == ["stub:latest"]
+    assert [m["name"] for m in leader.evicted] == ["other:latest"]
+
+
+@pytest.mark.anyio
+async def test_stale_activity_is_ignored(tmp_path, api, stub):
+    leader, other = manager(tmp_path), worker(tmp_path, 2)
+    leader.usage = {"other:latest": 5}
+    other.touch("stub:latest")
+    other.publish_activity()
+    old = time.time() - 60
+    os.utime(other.activity_path, (old, old))
+
+    busy, last_used = leader.activity()
+    assert not busy and "stub:latest" not in last_used
+    await leader.evict()
+    assert [m["name"] for m in leader.resident] == ["other:latest"]
+
+
+@pytest.mark.anyio
+async def test_follower_takes_over_released_lock(tmp_path, api, stub, monkeypatch):
+    first, second = manager(tmp_path, interval=0.05), manager(tmp_path, interval=0.05)
+    assert first._acquire()
+    steps = []
+
+    async def step(preload: bool = False) -> None:
+        steps.append(preload)
+
+    monkeypatch.setattr(second, "step", step)
+    monkeypatch.setattr(second, "refresh_usage", lambda: step(None))
+    task = asyncio.create_task(second._run())
+    try:
+        await asyncio.sleep(0.2)
+        assert True not in steps and False not in steps
+        # Прежний лидер ушёл (перезапуск воркера) — блокировку подхватывает follower
+        first._lock_file.close()
+        first._lock_file = None
+        for _ in range(50):
+            if False in steps:
+                break
+            await asyncio.sleep(0.05)
+    finally:
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        second._lock_file.close()
+    leading = [p for p in steps if p is not None]
+    assert leading[0] is True and False in leading
@@ -0,0 +1,83 @@
+# tests/test_response_cache.py
+"""Response cache: tiers, TTL, Cache-Control bypass, eviction across processes."""
+import uuid
+
+import pytest
+
+from app.utils.response_cache import ResponseCache, cache_mode, completion_key
+
+
+def make_cache(tmp_path, **kwargs) -> ResponseCache:
+    return ResponseCache(
+        path=str(tmp_path / "cache.db"), evict_path=str(tmp_path / ".evict"), enabled=True, **kwargs,
+    )
+
+
+def key(model: str, prompt: str) -> str:
+    return completion_key(model, {"temperature": 0}, [{"role": "user", "content": prompt}])
+
+
+def test_cache_mode():
+    assert cache_mode("") == (True, True)
+    assert cache_mode("max-age=0, No-Cache") == (False, True)
+    assert cache_mode("no-cache, no-store") == (False, False)
+
+
+@pytest.mark.anyio
+async def test_disk_tier_is_shared_and_expires(tmp_path):
+    a, b = make_cache(tmp_path), make_cache(tmp_path)
+    await a.put(key("m", "hi"), "m", "hello")
+    assert await a.get(key("m", "hi")) == "hello" and a.memory_hits == 1
+    assert await b.get(key("m", "hi")) == "hello" and b.disk_hits == 1
+
+    b.ttl = 0
+    assert await b.get(key("m", "hi")) is None
+    assert b.stats()["memory_entries"] == 0
+
+
+@pytest.mark.anyio
+async def test_clear_by_model_reaches_other_processes(tmp_path):
+    a, b = make_cache(tmp_path), make_cache(tmp_path)
+    for model in ("m", "n"):
+        await a.put(key(model, "hi"), model, f"from {model}")
+        assert await b.get(key(model, "hi")) == f"from {model}"
+
+    # Память b заполнена; удаление модели в a сбрасывает её и там
+    await a.clear(["m"])
+    assert await b.get(key("m", "hi")) is None
+    assert await b.get(key("n", "hi")) == "from n"
+    await b.clear()
+    assert await a.get(key("n", "hi")) is None
+
+
+@pytest.mark.anyio
+async def test_disabled_cache_clear_touches_no_files(tmp_path):
+    cache = make_cache(tmp_path)
+    cache.enabled = False
+    await cache.clear(["m"])
+    assert list(tmp_path.iterdir()) == []
+
+
+@pytest.mark.anyio
+async def test_chat_uses_cache_for_deterministic_requests(client, auth, monkeypatch):
+    from app.routers import chat
+
+    monkeypatch.setattr(chat.response_cache, "enabled", True)
+    prompt = f"cache me {uuid.uuid4().hex}"
+
+    async def send(headers=None, **extra):
+        # Новая сессия на каждый запрос: пустая история — одинаковый контекст
+        body = {"model": "stub:latest", "prompt": prompt, "temperature": 0, **extra}
+        return await client.post(f"/chat/{uuid.uuid4().hex}", json=body, auth=auth, headers=headers or {})
+
+    first = await send()
+    assert first.headers["X-Cache"] == "MISS"
+    second = await send()
+    assert second.headers["X-Cache"] == "HIT"
+    assert second.json() == first.json()
+    assert (await send({"Cache-Control": "no-store"})).headers["X-Cache"] == "BYPASS"
+    # Недетерминированные запросы кэш не трогают
+    assert "X-Cache" not in (await send(temperature=0.7)).headers
+
+    await chat.response_cache.clear(["stub:latest"])
+    assert (await send()).headers["X-Cache"] == "MISS"
@@ -0,0 +1,102 @@
+# tests/test_scheduler.py
+"""Inference scheduler: round-robin across users, admin priority, rejections."""
+import asyncio
+
+import pytest
+
+from app.utils.scheduler import InferenceScheduler, QueueFull, QueueTimeout, UserQueueFull, parse_limits
+
+
+def test_parse_limits():
+    assert parse_limits(" llama3:70b=1, phi3=4,bad, x=0") == {"llama3:70b": 1, "phi3:latest": 4, "x:latest": 1}
+
+
+@pytest.mark.anyio
+async def test_untagged_name_shares_the_latest_queue():
+    scheduler = InferenceScheduler(concurrency=2, limits={"phi3": 1}, queue_size=10, user_queue=5)
+    running = scheduler.enqueue("phi3", "a")
+    await running.wait()
+    # Тот же лимит и та же очередь, как бы ни была записана модель
+    waiting = scheduler.enqueue("phi3:latest", "b")
+    assert waiting.granted_at is None
+    assert [q["model"] for q in scheduler.stats()] == ["phi3:latest"]
+    running.release()
+    await waiting.wait()
+    waiting.release()
+
+
+@pytest.mark.anyio
+async def test_users_are_served_round_robin():
+    scheduler = InferenceScheduler(concurrency=1, limits={}, queue_size=10, user_queue=5)
+    running = scheduler.enqueue("m", "first")
+    await running.wait()
+    # Пользователь a поставил три запроса раньше b и c
+    tickets = [scheduler.enqueue("m", user) for user in ("a", "a", "a", "b", "c")]
+    admin = scheduler.enqueue("m", "root", admin=True)
+
+    order = []
+    current = running
+    for _ in range(len(tickets) + 1):
+        current.release()
+        current = next(t for t in [admin, *tickets] if t.granted_at is not None and not t.released)
+        order.append(current.user)
+    assert order == ["root", "a", "b", "c", "a", "a"]
+    current.release()
+    assert scheduler.queue("m").stats()["running"] == 0
+
+
+@pytest.mark.anyio
+async def test_rejections_carry_status_codes():
+    scheduler = InferenceScheduler(concurrency=1, limits={}, queue_size=2, user_queue=1)
+    first = scheduler.enqueue("m", "a")
+    await first.wait()
+    scheduler.enqueue("m", "a")
+    with pytest.raises(UserQueueFull) as e:
+        scheduler.enqueue("m", "a")
+    assert e.value.status_code == 429 and e.value.retry_after >= 1
+    scheduler.enqueue("m", "b")
+    with pytest.raises(QueueFull) as e:
+        scheduler.enqueue("m", "c")
+    assert e.value.status_code == 503
+    # Админ не упирается в размер очереди
+    scheduler.enqueue("m", "root", admin=True)
+    assert scheduler.queue("m").stats()["rejected"] == 2
+
+
+@pytest.mark.anyio
+async def test_timeout_and_cancel_free_the_place():
+    scheduler = InferenceScheduler(concurrency=1, limits={}, queue_size=1, user_queue=1)
+    running = scheduler.enqueue("m", "a")
+    await running.wait()
+    waiting = scheduler.enqueue("m", "b")
+    with pytest.raises(QueueTimeout) as e:
+        await waiting.wait(timeout=0.05)
+    assert e.value.status_code == 503
+    assert scheduler.queue("m").waiting == 0
+
+    task = asyncio.create_task(scheduler.enqueue("m", "c").wait())
+    await asyncio.sleep(0.01)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+    assert scheduler.queue("m").waiting == 0
+    running.release()
+    assert scheduler.queue("m").running == 0
+
+
+@pytest.mark.anyio
+async def test_full_queue_is_rejected_over_http(client, auth, stub, monkeypatch):
+    from app.routers import chat
+
+    monkeypatch.setattr(chat, "inference_scheduler", InferenceScheduler(
+        concurrency=1, limits={}, queue_size=1, user_queue=1,
+    ))
+    busy = chat.inference_scheduler.enqueue("stub:latest", "someone")
+    await busy.wait()
+    queued = chat.inference_scheduler.enqueue("stub:latest", "someone")
+    try:
+        r = await client.post("/chat/sched-full", json={"model": "stub:latest", "prompt": "hi"}, auth=auth)
+    finally:
+        queued.release()
+        busy.release()
+    assert r.status_code == 503 and int(r.headers["Retry-After"]) >= 1
@@ -0,0 +1,117 @@
+# tests/test_search.py
+"""Full-text search: the FTS5 triggers keep the index in sync, query building, the endpoint."""
+import uuid
+
+import pytest
+from sqlalchemy import create_engine, delete, text, update
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+
+from app.database import SessionLocal, engine
+from app.models import Message, Session as SessionModel
+from app.utils import search
+from tests.conftest import make_user
+
+
+def _fts5() -> bool:
+    with engine.connect() as conn:
+        return search.fts5_supported(conn)
+
+
+pytestmark = pytest.mark.skipif(not _fts5(), reason="SQLite without FTS5")
+
+
+def add_session(username: str, *contents: str) -> str:
+    sid = uuid.uuid4().hex
+    with SessionLocal() as db:
+        db.add(SessionModel(session_id=sid, username=username, message_count=len(contents)))
+        db.add_all(Message(session_id=sid, role="user", model="stub:latest", content=c) for c in contents)
+        db.commit()
+    return sid
+
+
+def matches(word: str) -> set:
+    with engine.connect() as conn:
+        return set(conn.execute(
+            text(f"SELECT rowid FROM {search.FTS_TABLE} WHERE {search.FTS_TABLE} MATCH :q"),
+            {"q": search.match_query(word)},
+        ).scalars())
+
+
+def test_match_query():
+    assert search.match_query('hello "new world" pre* ?!') == '"hello" "new world" "pre"*'
+    assert search.match_query('say "hi') == '"say" """hi"'
+    assert search.match_query("... --") == ""
+
+
+def test_triggers_follow_insert_update_delete():
+    word = f"zebra{uuid.uuid4().hex[:6]}"
+    sid = add_session("nobody", f"a {word} here", "nothing")
+    with SessionLocal() as db:
+        ids = [m.id for m in db.query(Message).filter(Message.session_id == sid).order_by(Message.id)]
+    assert matches(word) == {ids[0]}
+
+    other = f"yak{uuid.uuid4().hex[:6]}"
+    with engine.begin() as conn:
+        conn.execute(update(Message).where(Message.id == ids[1]).values(content=f"now {word} and {other}"))
+    assert matches(word) == set(ids) and matches(other) == {ids[1]}
+
+    with engine.begin() as conn:
+        conn.execute(delete(Message).where(Message.id == ids[0]))
+    assert matches(word) == {ids[1]}
+
+
+@pytest.mark.anyio
+async def test_missing_index_is_rechecked(tmp_path, monkeypatch):
+    monkeypatch.setattr(search, "_available", False)
+    url = f"sqlite:///{tmp_path / 'fresh.db'}"
+    sync = create_engine(url)
+    Message.__table__.create(sync)
+    db_engine = create_async_engine(url.replace("sqlite://", "sqlite+aiosqlite://"))
+    try:
+        async with AsyncSession(db_engine) as db:
+            assert not await search.available(db)
+            # Индекс создан позже (cli.py reindex) — без перезапуска
+            search.reindex(sync)
+            assert await search.available(db)
+    finally:
+        await db_engine.dispose()
+        sync.dispose()
+
+
+@pytest.mark.anyio
+async def test_endpoint_searches_own_sessions(client, user, auth):
+    word = f"okapi{uuid.uuid4().hex[:6]}"
+    mine = add_session(user.username, f"the {word} runs", f"{word}s everywhere")
+    add_session("someone-else", f"another {word}")
+
+    r = await client.get("/history/search", params={"q": word}, auth=auth)
+    assert r.status_code == 200
+    hits = r.json()
+    assert [h["session_id"] for h in hits] == [mine]
+    assert f"<mark>{word}</mark>" in hits[0]["snippet"]
+    # Префикс находит и вторую реплику
+    r = await client.get("/history/search", params={"q": f"{word}*", "limit": 1}, auth=auth)
+    assert len(r.json()) == 1 and r.headers["X-Next-Offset"] == "1"
+    r = await client.get("/history/search", params={"q": word, "username": "someone-else"}, auth=auth)
+    assert r.status_code == 403
+
+
+@pytest.mark.anyio
+async def test_snippet_is_escaped(client, user, auth):
+    word = f"ibex{uuid.uuid4().hex[:6]}"
+    add_session(user.username, f'<img src=x onerror="alert(1)"> {word} & more')
+    r = await client.get("/history/search", params={"q": word}, auth=auth)
+    snippet = r.json()[0]["snippet"]
+    assert "<img" not in snippet
+    assert snippet == f"&lt;img src=x onerror=&quot;alert(1)&quot;&gt; <mark>{word}</mark> &amp; more"
+
+
+@pytest.mark.anyio
+async def test_unowned_sessions_only_for_admins(client, auth):
+    word = f"gnu{uuid.uuid4().hex[:6]}"
+    sid = add_session(None, f"old {word}")
+    r = await client.get("/history/search", params={"q": word}, auth=auth)
+    assert r.json() == []
+    admin = make_user(is_admin=True)
+    r = await client.get("/history/search", params={"q": word}, auth=(admin.username, admin.username))
+    assert [h["session_id"] for h in r.json()] == [sid]
@@ -0,0 +1,113 @@
+# tests/test_singleflight.py
+"""Single-flight: shared generations, leaving, cancelling, what gets coalesced."""
+import asyncio
+import uuid
+
+import anyio
+import pytest
+
+from app.utils.backends import TokenStream
+from app.utils.singleflight import SingleFlight
+
+
+class Generation:
+    """A fake backend stream releasing one token per `step()`."""
+
+    def __init__(self, tokens=("a", "b", "c"), fail: bool = False):
+        self.tokens = list(tokens)
+        self.fail = fail
+        self.opened = 0
+        self.cancelled = False
+        self.gate = asyncio.Queue()
+
+    def step(self, n: int = 1) -> None:
+        for _ in range(n):
+            self.gate.put_nowait(None)
+
+    async def open(self) -> TokenStream:
+        self.opened += 1
+        if self.fail:
+            raise RuntimeError("backend down")
+
+        async def chunks():
+            for token in self.tokens:
+                await self.gate.get()
+                yield token
+
+        async def cancel():
+            self.cancelled = True
+
+        return TokenStream(chunks(), cancel)
+
+
+@pytest.mark.anyio
+async def test_followers_share_one_generation():
+    flights, gen = SingleFlight(enabled=True), Generation()
+    finished = []
+    leader = flights.start("k", "m", gen.open, on_finish=lambda: finished.append(True))
+    await leader.wait_open()
+    gen.step()
+    await asyncio.sleep(0)
+    follower = flights.join("k")
+    assert follower is leader and leader.subscribers == 2
+
+    stream = flights.subscribe(follower)
+    gen.step(2)
+    # Подписчик получает и токены, выданные до его подключения
+    assert [t async for t in stream] == ["a", "b", "c"]
+    assert await leader.result() == "abc"
+    assert gen.opened == 1 and finished == [True]
+    assert flights.join("k") is None
+
+
+@pytest.mark.anyio
+async def test_last_subscriber_leaving_cancels():
+    flights, gen = SingleFlight(enabled=True), Generation()
+    flight = flights.start("k", "m", gen.open)
+    flights.join("k")
+    await flight.wait_open()
+
+    flights.leave(flight)
+    await asyncio.sleep(0.01)
+    assert not flight.finished
+    flights.leave(flight)
+    with pytest.raises(RuntimeError, match="cancelled"):
+        await flight.result()
+    assert gen.cancelled and flights.stats()["in_flight"] == 0
+
+
+@pytest.mark.anyio
+async def test_errors_reach_every_subscriber():
+    flights, gen = SingleFlight(enabled=True), Generation(fail=True)
+    flight = flights.start("k", "m", gen.open)
+    other = flights.join("k")
+    for subscriber in (flight, other):
+        with pytest.raises(RuntimeError, match="backend down"):
+            await subscriber.wait_open()
+
+
+@pytest.mark.anyio
+async def test_unshared_flight_is_not_joined():
+    flights, gen = SingleFlight(enabled=True), Generation()
+    flight = flights.start("k", "m", gen.open, share=False)
+    assert flights.join("k") is None
+    flights.leave(flight)
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("temperature, roles", [(0, {"leader", "follower"}), (0.7, {"leader"})])
+async def test_only_deterministic_requests_are_coalesced(client, auth, stub, temperature, roles):
+    stub.tokens_per_sec = 20
+    prompt = f"same {uuid.uuid4().hex}"
+    replies = []
+
+    async def send():
+        body = {"model": "stub:latest", "prompt": prompt, "temperature": temperature}
+        replies.append(await client.post(f"/chat/{uuid.uuid4().hex}", json=body, auth=auth))
+
+    async with anyio.create_task_group() as tg:
+        tg.start_soon(send)
+        await anyio.sleep(0.2)
+        tg.start_soon(send)
+    assert all(r.status_code == 200 for r in replies)
+    assert {r.headers["X-Singleflight"] for r in replies} == roles
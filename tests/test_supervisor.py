@@ -0,0 +1,41 @@
+# tests/test_supervisor.py
+"""API supervisor: only one rolling restart runs at a time."""
+import threading
+
+import anyio
+import httpx
+import pytest
+
+from app.admin_app import app as admin_app
+from app.utils.supervisor import supervisor
+from tests.conftest import make_user
+
+
+@pytest.mark.anyio
+async def test_second_restart_is_rejected(api, monkeypatch):
+    release, ports = threading.Event(), []
+
+    def restart(port=None):
+        ports.append(port)
+        release.wait(5)
+
+    monkeypatch.setattr(supervisor, "restart", restart)
+    admin = make_user(is_admin=True)
+    transport = httpx.ASGITransport(app=admin_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        first = await client.post("/admin/restart", auth=(admin.username, admin.username))
+        assert first.status_code == 303
+        # Первый перезапуск ещё идёт — второй не запускается
+        second = await client.post("/admin/restart", auth=(admin.username, admin.username))
+        assert second.status_code == 409
+        release.set()
+
+    thread = None
+    for _ in range(50):
+        thread = supervisor.restart_async(9000)
+        if thread is not None:
+            break
+        await anyio.sleep(0.05)
+    assert thread is not None
+    thread.join(5)
+    assert len(ports) == 2 and ports[1] == 9000
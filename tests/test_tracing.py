@@ -0,0 +1,52 @@
+# tests/test_tracing.py
+"""Server-Timing phases of a chat request; the slow-request log."""
+import asyncio
+import json
+import logging
+import uuid
+
+import httpx
+import pytest
+from fastapi import FastAPI
+
+from app.utils.tracing import TracingMiddleware, phase
+
+
+def phases(response) -> dict:
+    items = [item.strip().split(";dur=") for item in response.headers["server-timing"].split(",")]
+    return {name: float(ms) for name, ms in items}
+
+
+@pytest.mark.anyio
+async def test_chat_reports_queue_and_open_separately(client, auth, stub):
+    stub.latency = 0.2
+    r = await client.post(f"/chat/{uuid.uuid4().hex}", json={"model": "stub:latest", "prompt": "hi"}, auth=auth)
+    assert r.status_code == 200
+    timing = phases(r)
+    assert {"auth", "model_check", "context", "queue", "open", "inference", "total"} <= set(timing)
+    # Задержка бэкенда до первого ответа — это запуск генерации, а не очередь
+    assert timing["open"] >= 150 > timing["queue"]
+    assert "join" not in timing
+
+
+@pytest.mark.anyio
+async def test_slow_requests_are_logged_with_their_phases(caplog):
+    app = FastAPI()
+
+    @app.get("/items/{delay}")
+    async def item(delay: float):
+        with phase("work"):
+            await asyncio.sleep(delay)
+        return {}
+
+    transport = httpx.ASGITransport(app=TracingMiddleware(app, slow_seconds=0.1))
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        with caplog.at_level(logging.WARNING, logger="app.utils.tracing"):
+            await client.get("/items/0")
+            assert caplog.records == []
+            r = await client.get("/items/0.15")
+    assert phases(r)["work"] >= 150
+    [record] = caplog.records
+    entry = json.loads(record.getMessage())
+    assert entry["event"] == "slow_request" and entry["path"] == "/items/0.15" and entry["status"] == 200
+    assert entry["total_ms"] >= 150 and entry["phases_ms"]["work"] >= 150
@@ -0,0 +1,92 @@
+# tests/test_transfer.py
+"""NDJSON export / import of chat history."""
+import gzip
+import io
+import json
+import uuid
+from datetime import datetime, timedelta, timezone
+
+import httpx
+import pytest
+
+from app.admin_app import app as admin_app
+from app.utils.transfer import Exporter, Importer
+from tests.conftest import make_user
+
+
+def ndjson(*records) -> io.BytesIO:
+    return io.BytesIO("".join(json.dumps(r) + "\n" for r in records).encode("utf-8"))
+
+
+def message(session_id: str, content: str, timestamp: str, model: str = "m") -> dict:
+    return {
+        "type": "message", "session_id": session_id, "role": "user", "model": model,
+        "content": content, "timestamp": timestamp,
+    }
+
+
+def exported(exporter: Exporter) -> list:
+    lines = b"".join(exporter.chunks()).decode("utf-8").splitlines()
+    return [json.loads(line) for line in lines]
+
+
+def test_export_window_accepts_aware_datetimes():
+    user = make_user()
+    sid = uuid.uuid4().hex
+    Importer().run(ndjson(
+        {"type": "session", "session_id": sid, "username": user.username},
+        message(sid, "early", "2024-05-01T09:00:00"),
+        message(sid, "late", "2024-05-01T11:00:00"),
+    ))
+    # 12:30 в UTC+2 — это 10:30 UTC: в окно попадает только первое сообщение
+    plus2 = timezone(timedelta(hours=2))
+    records = exported(Exporter(user.username, until=datetime(2024, 5, 1, 12, 30, tzinfo=plus2)))
+    assert [r["content"] for r in records if r["type"] == "message"] == ["early"]
+    records = exported(Exporter(user.username, since=datetime(2024, 5, 1, 12, 30, tzinfo=plus2)))
+    assert [r["content"] for r in records if r["type"] == "message"] == ["late"]
+
+
+def test_import_counts_distinct_sessions():
+    a, b = uuid.uuid4().hex, uuid.uuid4().hex
+    stats = Importer(batch_size=2).run(ndjson(
+        message(a, "1", "2024-05-01T09:00:00"),
+        message(b, "2", "2024-05-01T09:01:00"),
+        message(a, "3", "2024-05-01T09:02:00"),
+        message(b, "4", "2024-05-01T09:03:00"),
+        message(a, "5", "2024-05-01T09:04:00"),
+    ))
+    assert stats.sessions == 2 and stats.messages == 5 and stats.errors == 0
+
+
+@pytest.mark.anyio
+async def test_gzip_export_over_http_groups_messages_by_session(api):
+    user, admin = make_user(), make_user(is_admin=True)
+    a, b = sorted(uuid.uuid4().hex for _ in range(2))
+    Importer().run(ndjson(
+        {"type": "session", "session_id": a, "username": user.username},
+        {"type": "session", "session_id": b, "username": user.username},
+        message(b, "b1", "2024-05-01T09:00:00"),
+        message(a, "a1", "2024-05-01T09:01:00"),
+        message(b, "b2", "2024-05-01T09:02:00", model="other"),
+        message(a, "a2", "2024-05-01T09:03:00"),
+    ))
+    transport = httpx.ASGITransport(app=admin_app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        r = await client.get(
+            "/admin/export", params={"username": user.username, "gzip": "true"},
+            auth=(admin.username, admin.username),
+        )
+        assert r.status_code == 200 and r.headers["content-type"] == "application/gzip"
+        records = [json.loads(line) for line in gzip.decompress(r.content).decode("utf-8").splitlines()]
+        # Заголовок сессии, затем её сообщения по порядку записи
+        assert [(r["type"], r.get("content")) for r in records] == [
+            ("session", None), ("message", "a1"), ("message", "a2"),
+            ("session", None), ("message", "b1"), ("message", "b2"),
+        ]
+        assert records[0]["session_id"] == a and records[0]["username"] == user.username
+
+        r = await client.get(
+            "/admin/export", params={"username": user.username, "model": "other"},
+            auth=(admin.username, admin.username),
+        )
+        assert [json.loads(line).get("content") for line in r.text.splitlines()] == [None, "b2"]
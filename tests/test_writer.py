@@ -0,0 +1,103 @@
+# tests/test_writer.py
+"""Write-behind queue: batched flush, read-your-writes, discard, drain on stop."""
+import asyncio
+import uuid
+
+import pytest
+from sqlalchemy import select
+
+from app.database import SessionLocal
+from app.models import Message, Session as SessionModel
+from app.utils.writer import Turn, TurnWriter
+
+
+def stored(session_id: str):
+    with SessionLocal() as db:
+        session = db.get(SessionModel, session_id)
+        contents = db.scalars(
+            select(Message.content).where(Message.session_id == session_id).order_by(Message.id)
+        ).all()
+    return session, contents
+
+
+@pytest.mark.anyio
+async def test_queued_turns_are_visible_then_flushed(api):
+    writer = TurnWriter(enabled=True, batch_size=100, max_delay=1)
+    await writer.start()
+    sid = uuid.uuid4().hex
+    try:
+        for i in range(3):
+            await writer.record(Turn(sid, "m", [("user", f"q{i}"), ("assistant", f"a{i}")], "alice"))
+        # Пачка ещё не набралась: в БД пусто, но чтение видит свои записи
+        assert stored(sid) == (None, [])
+        assert [m["content"] for m in writer.pending_messages(sid)] == ["q0", "a0", "q1", "a1", "q2", "a2"]
+        assert sid in writer.pending_sessions()
+    finally:
+        await writer.stop()
+    session, contents = stored(sid)
+    assert contents == ["q0", "a0", "q1", "a1", "q2", "a2"]
+    assert session.message_count == 6 and session.username == "alice"
+    assert writer.pending_messages(sid) == [] and writer.pending_sessions() == {}
+
+
+@pytest.mark.anyio
+async def test_full_batch_is_written_without_waiting(api):
+    writer = TurnWriter(enabled=True, batch_size=2, max_delay=1)
+    await writer.start()
+    sid = uuid.uuid4().hex
+    try:
+        await writer.record(Turn(sid, "m", [("user", "1")]))
+        await writer.record(Turn(sid, "m", [("user", "2")]))
+        await writer._queue.join()
+        assert stored(sid)[1] == ["1", "2"]
+    finally:
+        await writer.stop()
+
+
+@pytest.mark.anyio
+async def test_discarded_session_is_not_written(api):
+    writer = TurnWriter(enabled=True, batch_size=100, max_delay=1)
+    await writer.start()
+    kept, dropped = uuid.uuid4().hex, uuid.uuid4().hex
+    await writer.record(Turn(kept, "m", [("user", "stay")]))
+    await writer.record(Turn(dropped, "m", [("user", "go")]))
+    writer.discard(dropped)
+    assert writer.pending_messages(dropped) == [] and dropped not in writer.pending_sessions()
+    await writer.stop()
+    assert stored(kept)[1] == ["stay"]
+    assert stored(dropped) == (None, [])
+
+
+@pytest.mark.anyio
+async def test_disabled_writer_commits_immediately(api):
+    writer = TurnWriter(enabled=False)
+    sid = uuid.uuid4().hex
+    await writer.record(Turn(sid, "m", [("user", "now")]))
+    assert stored(sid)[1] == ["now"]
+
+
+@pytest.mark.anyio
+async def test_session_deleted_during_flush_stays_deleted(api, monkeypatch):
+    from app.utils import writer as module
+
+    started, gate, write = asyncio.Event(), asyncio.Event(), module.write_turns
+
+    async def slow_write(turns):
+        # Строки уже в транзакции, но писатель ещё не закончил
+        await write(turns)
+        started.set()
+        await gate.wait()
+
+    monkeypatch.setattr(module, "write_turns", slow_write)
+    writer = TurnWriter(enabled=True, batch_size=1, max_delay=1)
+    await writer.start()
+    sid = uuid.uuid4().hex
+    try:
+        await writer.record(Turn(sid, "m", [("user", "late")]))
+        # Пачка уже забрана писателем, когда сессию удаляют
+        await started.wait()
+        writer.discard(sid)
+        gate.set()
+    finally:
+        await writer.stop()
+    assert stored(sid) == (None, [])